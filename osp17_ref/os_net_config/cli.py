@@ -118,6 +118,96 @@ def parse_opts(argv):
              "(WARNING, permanently renames nics).",
         required=False)
 
+    parser.add_argument(
+        '--partial-state',
+        dest="partial_state",
+        action='store_true',
+        help="Send only the changed parts of each interface to nmstate "
+             "(nmstate provider only).",
+        required=False)
+
+    parser.add_argument(
+        '--dump-sink',
+        dest="dump_sink",
+        metavar='SINK',
+        help="Where the nmstate provider dumps the config it handles. "
+             "One of: log (debug log), stderr, none, or a file path.",
+        default=impl_nmstate.DUMP_SINK_LOG,
+        required=False)
+
+    parser.add_argument(
+        '--force-full-reconcile',
+        dest="force_full_reconcile",
+        action='store_true',
+        help="Compare every interface with the running config, even if "
+             "its config has not changed since the last successful run "
+             "(nmstate provider only).",
+        required=False)
+
+    parser.add_argument(
+        '--rollback-timeout',
+        dest="rollback_timeout",
+        metavar='SECONDS',
+        type=int,
+        help="Apply the config in a checkpoint, committed only once the "
+             "default gateways reply. The config is rolled back if they "
+             "don't, or after SECONDS if the checkpoint can't be committed "
+             "(nmstate provider only).",
+        default=None,
+        required=False)
+
+    parser.add_argument(
+        '--probe-dns',
+        dest="probe_dns",
+        action='store_true',
+        help="With --rollback-timeout, also require the DNS servers to "
+             "reply to ping before committing the config (nmstate provider "
+             "only).",
+        required=False)
+
+    parser.add_argument(
+        '--deferred-verify',
+        dest="deferred_verify",
+        action='store_true',
+        help="Apply the config without the nmstate verification, then only "
+             "verify the changed settings against the running config, "
+             "with a bounded exponential backoff (nmstate provider only).",
+        required=False)
+
+    parser.add_argument(
+        '--runtime-only',
+        dest="runtime_only",
+        action='store_true',
+        help="Apply the config to the running system only, without saving "
+             "the NetworkManager profiles. Use --persist to make it "
+             "persistent (nmstate provider only).",
+        required=False)
+
+    parser.add_argument(
+        '--persist',
+        dest="persist",
+        action='store_true',
+        help="Make the config of the last --runtime-only run persistent, "
+             "then exit (nmstate provider only).",
+        required=False)
+
+    parser.add_argument(
+        '--offline',
+        dest="offline",
+        action='store_true',
+        help="Generate the NetworkManager keyfiles under the root dir "
+             "instead of applying the config, without using NetworkManager "
+             "(nmstate provider only).",
+        required=False)
+
+    parser.add_argument(
+        '--restart-ovs-on-dpdk',
+        dest="restart_ovs_on_dpdk",
+        action='store_true',
+        help="Restart openvswitch when DPDK ports are added or changed, "
+             "instead of hotplugging them (ifcfg provider only).",
+        required=False)
+
     opts = parser.parse_args(argv[1:])
 
     return opts
@@ -137,6 +227,38 @@ def _is_sriovpf_obj_found(obj):
     return configure_sriov
 
 
+# The SriovVF settings which are not in the sr-iov subtree of the PF, they
+# need the VF device
+_SRIOV_VF_IFACE_KEYS = ('use_dhcp', 'use_dhcpv6', 'addresses', 'routes',
+                        'rules', 'dns_servers', 'domain', 'mtu', 'promisc',
+                        'ethtool_opts')
+
+
+def _is_sriov_config_required(iface_json, dpdk=False, member=False):
+    """Check if the SR-IOV devices need the sriov_config service.
+
+    PFs in switchdev mode, with vdpa or with a steering mode and VFs bound
+    to DPDK can't be expressed with the nmstate sr-iov subtree, they are
+    configured by the sriov_config service once the PFs are applied. So are
+    the VFs with an interface config or a master, which need the VF device
+    names.
+    """
+    iface_type = iface_json.get('type')
+    if iface_type == 'sriov_pf':
+        if (iface_json.get('link_mode', 'legacy') != 'legacy' or
+                iface_json.get('vdpa') or iface_json.get('steering_mode')):
+            return True
+    elif iface_type == 'sriov_vf':
+        if dpdk or member or any(iface_json.get(key)
+                                 for key in _SRIOV_VF_IFACE_KEYS):
+            return True
+    dpdk = dpdk or iface_type in ('ovs_dpdk_port', 'ovs_dpdk_bond')
+    for child in iface_json.get('members') or []:
+        if _is_sriov_config_required(child, dpdk, member=True):
+            return True
+    return False
+
+
 def disable_ipv6_for_netdevs(net_devices):
     sysctl_conf = ""
     for net_device in net_devices:
@@ -168,8 +290,9 @@ def main(argv=sys.argv, main_logger=None):
     provider = None
     if opts.provider:
         if opts.provider == 'ifcfg':
-            provider = impl_ifcfg.IfcfgNetConfig(noop=opts.noop,
-                                                 root_dir=opts.root_dir)
+            provider = impl_ifcfg.IfcfgNetConfig(
+                noop=opts.noop, root_dir=opts.root_dir,
+                restart_ovs_on_dpdk=opts.restart_ovs_on_dpdk)
         elif opts.provider == 'eni':
             provider = impl_eni.ENINetConfig(noop=opts.noop,
                                              root_dir=opts.root_dir)
@@ -177,15 +300,24 @@ def main(argv=sys.argv, main_logger=None):
             provider = impl_iproute.IPRouteNetConfig(noop=opts.noop,
                                                      root_dir=opts.root_dir)
         elif opts.provider == 'nmstate':
-            provider = impl_nmstate.NmstateNetConfig(noop=opts.noop,
-                                                     root_dir=opts.root_dir)
+            provider = impl_nmstate.NmstateNetConfig(
+                noop=opts.noop, root_dir=opts.root_dir,
+                partial_state=opts.partial_state,
+                dump_sink=opts.dump_sink,
+                force_full_reconcile=opts.force_full_reconcile,
+                rollback_timeout=opts.rollback_timeout,
+                probe_dns=opts.probe_dns,
+                deferred_verify=opts.deferred_verify,
+                runtime_only=opts.runtime_only,
+                offline=opts.offline)
         else:
             main_logger.error("Invalid provider specified.")
             return 1
     else:
         if os.path.exists('%s/etc/sysconfig/network-scripts/' % opts.root_dir):
-            provider = impl_ifcfg.IfcfgNetConfig(noop=opts.noop,
-                                                 root_dir=opts.root_dir)
+            provider = impl_ifcfg.IfcfgNetConfig(
+                noop=opts.noop, root_dir=opts.root_dir,
+                restart_ovs_on_dpdk=opts.restart_ovs_on_dpdk)
         elif os.path.exists('%s/etc/network/' % opts.root_dir):
             provider = impl_eni.ENINetConfig(noop=opts.noop,
                                              root_dir=opts.root_dir)
@@ -194,6 +326,19 @@ def main(argv=sys.argv, main_logger=None):
                               "system.")
             return 1
 
+    if opts.persist:
+        if not isinstance(provider, impl_nmstate.NmstateNetConfig):
+            main_logger.error("--persist requires the nmstate provider")
+            return 1
+        provider.persist()
+        return 0
+
+    if opts.offline:
+        if not isinstance(provider, impl_nmstate.NmstateNetConfig):
+            main_logger.error("--offline requires the nmstate provider")
+            return 1
+        objects.use_offline()
+
     # Read the interface mapping file, if it exists
     # This allows you to override the default network naming abstraction
     # mappings by specifying a specific nicN->name or nicN->MAC mapping
@@ -277,6 +422,19 @@ def main(argv=sys.argv, main_logger=None):
         else:
             main_logger.warning('\n'.join(validation_errors))
 
+    # With nmstate, the PFs and the VFs are configured in a single
+    # transaction, unless the sriov_config service is needed. The VFs which
+    # are not created yet are referred by the PF name and the VF id.
+    sriov_single_pass = opts.provider == 'nmstate' and not any(
+        _is_sriov_config_required(iface_json) for iface_json in iface_array)
+    if sriov_single_pass:
+        objects.use_sriov_vf_refs()
+    if opts.offline and not sriov_single_pass:
+        main_logger.error("The SR-IOV config needs the sriov_config "
+                          "service of the host, it is not supported "
+                          "with --offline")
+        return 1
+
     # Look for the presence of SriovPF types in the first parse of the json
     # if SriovPFs exists then PF devices needs to be configured so that the VF
     # devices are created.
@@ -285,14 +443,22 @@ def main(argv=sys.argv, main_logger=None):
     # After the first parse the SR-IOV PF devices would be configured and the
     # VF devices would be created.
     # In the second parse, all other objects shall be added
+    # In single pass mode, the config is only parsed here and the objects
+    # are all added after the first parse.
+    parsed_objs = []
     for iface_json in iface_array:
         try:
             obj = objects.object_from_json(iface_json)
         except utils.SriovVfNotFoundException:
+            if sriov_single_pass and not opts.noop:
+                raise
             continue
+        if sriov_single_pass:
+            parsed_objs.append(obj)
         if _is_sriovpf_obj_found(obj):
             configure_sriov = True
-            provider.add_object(obj)
+            if not sriov_single_pass:
+                provider.add_object(obj)
             # Look for the presence of SriovPF as members of LinuxBond and that
             # LinuxBond is member of OvsBridge
             sriovpf_bond_ovs_ports.extend(
@@ -307,7 +473,8 @@ def main(argv=sys.argv, main_logger=None):
     if sriovpf_bond_ovs_ports:
         disable_ipv6_for_netdevs(sriovpf_bond_ovs_ports)
 
-    if configure_sriov:
+    pf_files_changed = {}
+    if configure_sriov and not sriov_single_pass:
         # Apply the ifcfgs for PFs now, so that NM_CONTROLLED=no is applied
         # for each of the PFs before configuring the numvfs for the PF device.
         # This step allows the network manager to unmanage the created VFs.
@@ -327,27 +494,30 @@ def main(argv=sys.argv, main_logger=None):
                 execution_from_cli=True,
                 restart_openvswitch=restart_ovs)
 
-    for iface_json in iface_array:
-        # All sriov_pfs at top level or at any member level will be
-        # ignored and all other objects are parsed will be added here.
-        # The VFs are expected to be available now and an exception
-        # SriovVfNotFoundException shall be raised if not available.
-        try:
-            obj = objects.object_from_json(iface_json)
-        except utils.SriovVfNotFoundException:
-            if not opts.noop:
-                raise
-        if not _is_sriovpf_obj_found(obj):
+    if sriov_single_pass:
+        for obj in parsed_objs:
             provider.add_object(obj)
-
-    if configure_sriov and not opts.noop:
+    else:
+        for iface_json in iface_array:
+            # All sriov_pfs at top level or at any member level will be
+            # ignored and all other objects are parsed will be added here.
+            # The VFs are expected to be available now and an exception
+            # SriovVfNotFoundException shall be raised if not available.
+            try:
+                obj = objects.object_from_json(iface_json)
+            except utils.SriovVfNotFoundException:
+                if not opts.noop:
+                    raise
+            if not _is_sriovpf_obj_found(obj):
+                provider.add_object(obj)
+
+    if configure_sriov and not sriov_single_pass and not opts.noop:
         utils.configure_sriov_vfs()
 
     files_changed = provider.apply(cleanup=opts.cleanup,
                                    activate=not opts.no_activate)
     if opts.noop:
-        if configure_sriov:
-            files_changed.update(pf_files_changed)
+        files_changed.update(pf_files_changed)
         for location, data in files_changed.items():
             print("File: %s\n" % location)
             print(data)
@@ -14,6 +14,8 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
+import concurrent.futures
 import glob
 import itertools
 import logging
@@ -21,6 +23,8 @@ import netaddr
 import os
 import re
 
+from oslo_concurrency import processutils
+
 import os_net_config
 from os_net_config import common
 from os_net_config import objects
@@ -32,6 +36,15 @@ logger = logging.getLogger(__name__)
 netconfig = os_net_config.NetConfig()
 
 MAC_TABLE_SIZE = 50000
+# Same default timeout as ifup-ovs
+OVS_VSCTL_TIMEOUT = 10
+# The OVS_EXTRA settings changing how the rx queues of a DPDK port are spread
+# over the PMD threads
+_RXQ_SETTINGS = re.compile(
+    r'\b(n_rxq|n_rxq_desc|n_txq_desc|pmd-rxq-affinity)\b')
+_SYS_DEVICES_NODE = '/sys/devices/system/node'
+# Maximum number of interfaces brought down or up concurrently
+RESTART_WORKERS = 8
 _ROUTE_TABLE_DEFAULT = """# reserved values
 #
 255\tlocal
@@ -89,6 +102,66 @@ def route_table_config_path():
     return "/etc/iproute2/rt_tables"
 
 
+def resolv_conf_path():
+    return "/etc/resolv.conf"
+
+
+def ovs_vsctl_path():
+    return "/bin/ovs-vsctl"
+
+
+def pmd_cpu_mask():
+    """Return the CPUs of the OvS PMD threads.
+
+    :returns: set of CPU ids, empty if pmd-cpu-mask is not set
+    """
+    try:
+        out, err = processutils.execute(
+            ovs_vsctl_path(), '--if-exists', 'get', 'Open_vSwitch', '.',
+            'other_config:pmd-cpu-mask')
+    except processutils.ProcessExecutionError as e:
+        logger.warning('Failed to read pmd-cpu-mask: %s' % e)
+        return set()
+    mask = out.strip().strip('"')
+    if not mask:
+        return set()
+    mask = int(mask, 16)
+    return set(cpu for cpu in range(mask.bit_length()) if mask >> cpu & 1)
+
+
+def numa_node_cpus(node):
+    """Return the CPUs of a NUMA node.
+
+    :param node: the NUMA node id
+    :returns: set of CPU ids
+    """
+    cpulist = common.get_file_data(os.path.join(
+        _SYS_DEVICES_NODE, 'node%d' % node, 'cpulist')).strip()
+    cpus = set()
+    for cpu_range in filter(None, cpulist.split(',')):
+        first, _, last = cpu_range.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def dpdk_numa_node(ifname, dpdk_devargs):
+    """Return the NUMA node of the NIC of a DPDK port.
+
+    :param ifname: the name of the NIC
+    :param dpdk_devargs: the dpdk-devargs of the port, a PCI address unless
+                         the NIC is bound to its kernel driver
+    :returns: the NUMA node id, -1 if it is not known
+    """
+    if re.match(r'^[0-9a-fA-F]{4}:', dpdk_devargs or ''):
+        path = common.get_pci_dev_path(dpdk_devargs, 'numa_node')
+    else:
+        path = common.get_dev_path(ifname, 'numa_node')
+    try:
+        return int(common.get_file_data(path).strip())
+    except ValueError:
+        return -1
+
+
 def cleanup_pattern():
     return "/etc/sysconfig/network-scripts/ifcfg-*"
 
@@ -126,11 +199,107 @@ def stop_dhclient_process(interface):
                          (pid_file, err))
 
 
+class FileSnapshot(object):
+    """The config files compared by an apply, each read once.
+
+    Deciding how to apply a changed interface compares its ifcfg, route
+    and rule files with the new config several times. The file contents
+    and the parsed ifcfg key/values are kept in memory for the whole apply.
+    """
+
+    def __init__(self, parse_ifcfg):
+        self.parse_ifcfg = parse_ifcfg
+        self.file_data = {}
+        self.ifcfg_values = {}
+
+    def get_file_data(self, filename):
+        if filename not in self.file_data:
+            self.file_data[filename] = common.get_file_data(filename)
+        return self.file_data[filename]
+
+    def diff(self, filename, data):
+        return not self.get_file_data(filename) == data
+
+    def get_ifcfg_values(self, ifcfg_data):
+        if ifcfg_data not in self.ifcfg_values:
+            self.ifcfg_values[ifcfg_data] = self.parse_ifcfg(ifcfg_data)
+        return self.ifcfg_values[ifcfg_data]
+
+
+class MemberClosure(object):
+    """The transitive members of the bridges, bonds and teams.
+
+    The members and masters of each interface are computed once from
+    member_names, then looked up.
+    """
+
+    def __init__(self, member_names):
+        self.member_names = member_names
+        self._descendants = {}
+        self._ancestors = None
+
+    def descendants(self, name, _path=()):
+        """Return the members of an interface and their own members."""
+        if name not in self._descendants:
+            children = set()
+            for member in self.member_names.get(name, ()):
+                children.add(member)
+                # Guard against a loop in the members
+                if member not in _path:
+                    children.update(self.descendants(member,
+                                                     _path + (name,)))
+            self._descendants[name] = frozenset(children)
+        return self._descendants[name]
+
+    def ancestors(self, name):
+        """Return the interfaces that have the interface as a member."""
+        if self._ancestors is None:
+            self._ancestors = {}
+            for master in self.member_names:
+                for child in self.descendants(master):
+                    self._ancestors.setdefault(child, set()).add(master)
+        return self._ancestors.get(name, frozenset())
+
+
+class RestartSet(object):
+    """A set of interface names, iterated in insertion order."""
+
+    def __init__(self, names=()):
+        self._names = dict.fromkeys(names)
+
+    def add(self, name):
+        self._names[name] = None
+
+    def update(self, names):
+        for name in names:
+            self.add(name)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __iter__(self):
+        return iter(list(self._names))
+
+    def __len__(self):
+        return len(self._names)
+
+
+# An ifcfg object type handled by apply:
+# data: the IfcfgNetConfig attribute with the ifcfg data of the objects
+# kind: how the objects are handled
+# description: the name of the type in the logs
+# config_path: function returning the ifcfg path of an object
+# restarts: the restart list the objects go to
+IfcfgType = collections.namedtuple(
+    'IfcfgType', ['data', 'kind', 'description', 'config_path', 'restarts'])
+
+
 class IfcfgNetConfig(os_net_config.NetConfig):
     """Configure network interfaces using the ifcfg format."""
 
-    def __init__(self, noop=False, root_dir=''):
+    def __init__(self, noop=False, root_dir='', restart_ovs_on_dpdk=False):
         super(IfcfgNetConfig, self).__init__(noop, root_dir)
+        self.restart_ovs_on_dpdk = restart_ovs_on_dpdk
         self.interface_data = {}
         self.ivsinterface_data = {}
         self.nfvswitch_intiface_data = {}
@@ -151,8 +320,67 @@ class IfcfgNetConfig(os_net_config.NetConfig):
         self.member_names = {}
         self.renamed_interfaces = {}
         self.bond_primary_ifaces = {}
+        self.file_snapshot = None
+        self.member_closure = None
+        self.pmd_rxqs = {}  # DPDK NIC to the PMD CPUs of its rx queues
+        self.pmd_cpus = None  # pmd-cpu-mask, read once by pmd_rxq_affinity
         logger.info('Ifcfg net config provider created.')
 
+    def pmd_rxq_affinity(self, ifname, dpdk_devargs, rx_queue):
+        """Map the rx queues of a DPDK port to the PMDs of its NUMA node.
+
+        Each queue goes to the PMD CPU of the NIC's NUMA node with the
+        fewest queues of the other ports, so the ports are balanced over
+        the PMDs.
+        :param ifname: the name of the NIC of the DPDK port
+        :param dpdk_devargs: the dpdk-devargs of the port
+        :param rx_queue: the number of rx queues of the port
+        :returns: the pmd-rxq-affinity value, None if there are no PMDs
+        """
+        if self.pmd_cpus is None:
+            self.pmd_cpus = pmd_cpu_mask()
+        pmd_cpus = self.pmd_cpus
+        if not pmd_cpus:
+            logger.warning('pmd-cpu-mask is not set, no rx queue affinity '
+                           'for %s' % ifname)
+            return None
+        node = dpdk_numa_node(ifname, dpdk_devargs)
+        local_cpus = pmd_cpus & numa_node_cpus(node) if node >= 0 else set()
+        if not local_cpus:
+            logger.warning('No PMD on the NUMA node of %s, using all the '
+                           'PMDs for its rx queues' % ifname)
+            local_cpus = pmd_cpus
+        load = {}
+        for name, cpus in self.pmd_rxqs.items():
+            if name != ifname:
+                for cpu in cpus:
+                    load[cpu] = load.get(cpu, 0) + 1
+        self.pmd_rxqs[ifname] = []
+        for queue in range(rx_queue):
+            cpu = min(sorted(local_cpus), key=lambda c: load.get(c, 0))
+            load[cpu] = load.get(cpu, 0) + 1
+            self.pmd_rxqs[ifname].append(cpu)
+        return ','.join('%d:%d' % (queue, cpu)
+                        for queue, cpu in enumerate(self.pmd_rxqs[ifname]))
+
+    def get_file_data(self, filename):
+        """Return the contents of a config file, from the apply snapshot."""
+        if self.file_snapshot:
+            return self.file_snapshot.get_file_data(filename)
+        return common.get_file_data(filename)
+
+    def diff(self, filename, data):
+        """Check if the data differs from the config file."""
+        if self.file_snapshot:
+            return self.file_snapshot.diff(filename, data)
+        return utils.diff(filename, data)
+
+    def get_ifcfg_values(self, ifcfg_data):
+        """Return the key/values of ifcfg data, parsed once per apply."""
+        if self.file_snapshot:
+            return self.file_snapshot.get_ifcfg_values(ifcfg_data)
+        return self.parse_ifcfg(ifcfg_data)
+
     def parse_ifcfg(self, ifcfg_data):
         """Break out the key/value pairs from ifcfg_data
 
@@ -250,23 +478,44 @@ class IfcfgNetConfig(os_net_config.NetConfig):
         :returns: boolean value for whether a restart is required
         """
 
-        file_data = common.get_file_data(filename)
+        file_data = self.get_file_data(filename)
         logger.debug("Original ifcfg file:\n%s" % file_data)
         logger.debug("New ifcfg file:\n%s" % new_data)
-        file_values = self.parse_ifcfg(file_data)
-        new_values = self.parse_ifcfg(new_data)
+        file_values = self.get_ifcfg_values(file_data)
+        new_values = self.get_ifcfg_values(new_data)
         restart_required = False
         # Certain changes can be applied without restarting the interface
         permitted_changes = [
             "IPADDR",
             "NETMASK",
+            "IPV6ADDR",
+            "IPV6ADDR_SECONDARIES",
             "MTU",
             "ONBOOT",
             "ETHTOOL_OPTS"
         ]
+        # The resolver is updated in place, unless NetworkManager owns it.
+        # PEERDNS=no is toggled by adding the first or removing the last
+        # DNS server.
+        if new_values.get("NM_CONTROLLED", "").lower() != "yes":
+            permitted_changes.extend(["DNS1", "DNS2", "DOMAIN", "PEERDNS"])
+        # OVS_EXTRA changes are applied in place when they can be reverted
+        if self.ovs_extra_delta(file_values, new_values) is not None:
+            permitted_changes.append("OVS_EXTRA")
+            # The DPDK queues are set by OVS_EXTRA from these values
+            if new_values.get("TYPE", "").startswith("OVSDPDK"):
+                permitted_changes.extend(["RX_QUEUE", "RX_QUEUE_SIZE",
+                                          "TX_QUEUE_SIZE"])
         # Check whether any of the changes require restart
         for change in self.enumerate_ifcfg_changes(file_values, new_values):
-            if change not in permitted_changes:
+            if re.sub(r'\d+$', '', change) in ["IPADDR", "NETMASK"]:
+                continue
+            if change == "IPV6_MTU":
+                # Setting the link MTU also sets the IPv6 MTU
+                if new_values.get(change) in (None, new_values.get("MTU")):
+                    continue
+                restart_required = True
+            elif change not in permitted_changes:
                 # Moving to DHCP requires restarting interface
                 if change in ["BOOTPROTO", "OVSBOOTPROTO"]:
                     if change in new_values:
@@ -280,6 +529,69 @@ class IfcfgNetConfig(os_net_config.NetConfig):
             logger.debug("Changes do not require restart")
         return restart_required
 
+    def ifcfg_addresses(self, ifcfg_values):
+        """Return the static addresses set by ifcfg values.
+
+        :param ifcfg_values: dict of ifcfg key/values
+        :returns: list of addresses in CIDR notation, the IPv4 ones without
+                  a NETMASK have no prefix length
+        """
+        addresses = []
+        for key in sorted(ifcfg_values, key=lambda k: (len(k), k)):
+            match = re.match(r'^IPADDR(\d*)$', key)
+            if match:
+                netmask = ifcfg_values.get("NETMASK%s" % match.group(1))
+                if netmask:
+                    addresses.append("%s/%s" % (
+                        ifcfg_values[key],
+                        netaddr.IPAddress(netmask).netmask_bits()))
+                else:
+                    addresses.append(ifcfg_values[key])
+        if "IPV6ADDR" in ifcfg_values:
+            addresses.append(ifcfg_values["IPV6ADDR"])
+        addresses.extend(
+            ifcfg_values.get("IPV6ADDR_SECONDARIES", "").split())
+        return addresses
+
+    def resolv_conf_data(self, resolv_data, file_values, data_values):
+        """Return the resolv.conf contents updated for an ifcfg change.
+
+        The nameservers and search domains of the previous ifcfg values are
+        replaced by the new ones, the other lines are kept.
+        :param resolv_data: contents of the current resolv.conf
+        :param file_values: dict of the previous ifcfg key/values
+        :param data_values: dict of the new ifcfg key/values
+        :returns: the new contents of resolv.conf
+        """
+        old_servers = [file_values[key] for key in ("DNS1", "DNS2")
+                       if key in file_values]
+        new_servers = [data_values[key] for key in ("DNS1", "DNS2")
+                       if key in data_values]
+        old_domain = file_values.get("DOMAIN")
+        new_domain = data_values.get("DOMAIN")
+        if old_servers == new_servers and old_domain == new_domain:
+            return resolv_data
+        lines = []
+        servers_index = None
+        for line in resolv_data.splitlines():
+            words = line.split()
+            if words[:1] == ["nameserver"] and len(words) > 1:
+                if servers_index is None:
+                    servers_index = len(lines)
+                if words[1] in old_servers or words[1] in new_servers:
+                    continue
+            elif words[:1] == ["search"] and old_domain != new_domain:
+                if new_domain or words[1:] == old_domain.split():
+                    continue
+            lines.append(line)
+        if servers_index is None:
+            servers_index = len(lines)
+        lines[servers_index:servers_index] = ["nameserver %s" % server
+                                              for server in new_servers]
+        if new_domain and old_domain != new_domain:
+            lines.insert(0, "search %s" % new_domain)
+        return "".join("%s\n" % line for line in lines)
+
     def iproute2_apply_commands(self, device_name, filename, data):
         """Return list of commands needed to implement changes.
 
@@ -295,35 +607,33 @@ class IfcfgNetConfig(os_net_config.NetConfig):
         :returns: commands (commands to be run)
         """
 
-        previous_cfg = common.get_file_data(filename)
-        file_values = self.parse_ifcfg(previous_cfg)
-        data_values = self.parse_ifcfg(data)
+        previous_cfg = self.get_file_data(filename)
+        file_values = self.get_ifcfg_values(previous_cfg)
+        data_values = self.get_ifcfg_values(data)
         logger.debug("File values:\n%s" % file_values)
         logger.debug("Data values:\n%s" % data_values)
         changes = self.enumerate_ifcfg_changes(file_values, data_values)
         commands = []
-        new_cidr = 0
-        old_cidr = 0
-        # Convert dot notation netmask to CIDR length notation
-        if "NETMASK" in file_values:
-            netmask = file_values["NETMASK"]
-            old_cidr = netaddr.IPAddress(netmask).netmask_bits()
-        if "NETMASK" in data_values:
-            netmask = data_values["NETMASK"]
-            new_cidr = netaddr.IPAddress(netmask).netmask_bits()
-        if "IPADDR" in changes:
-            if changes["IPADDR"] == "removed" or changes[
-                "IPADDR"] == "modified":
-                if old_cidr:
-                    commands.append("addr del %s/%s dev %s" %
-                                    (file_values["IPADDR"], old_cidr,
-                                     device_name))
-                else:
-                    # Cannot remove old IP specifically if netmask not known
-                    commands.append("addr flush dev %s" % device_name)
-            if changes["IPADDR"] == "added" or changes["IPADDR"] == "modified":
-                commands.insert(0, "addr add %s/%s dev %s" %
-                                (data_values["IPADDR"], new_cidr, device_name))
+        old_addresses = self.ifcfg_addresses(file_values)
+        new_addresses = self.ifcfg_addresses(data_values)
+        removed = [address for address in old_addresses
+                   if address not in new_addresses]
+        if any('/' not in address for address in removed):
+            # Cannot remove old IP specifically if netmask not known
+            commands.append("addr flush dev %s" % device_name)
+            removed = []
+            added = new_addresses
+        else:
+            added = [address for address in new_addresses
+                     if address not in old_addresses]
+        # Add the new addresses first so the interface stays reachable
+        for address in added:
+            commands.append("addr add %s dev %s" % (address, device_name))
+        for address in removed:
+            commands.append("addr del %s dev %s" % (address, device_name))
+        # The MTU of DPDK ports is the mtu_request set by OVS_EXTRA
+        if data_values.get("TYPE", "").startswith("OVSDPDK"):
+            return commands
         if "MTU" in changes:
             if changes["MTU"] == "added" or changes["MTU"] == "modified":
                 commands.append("link set dev %s mtu %s" %
@@ -332,6 +642,127 @@ class IfcfgNetConfig(os_net_config.NetConfig):
                 commands.append("link set dev %s mtu 1500" % device_name)
         return commands
 
+    def ovs_extra_commands(self, ifcfg_values):
+        """Return the ovs-vsctl commands of the OVS_EXTRA ifcfg value.
+
+        The variables are expanded with the other ifcfg values, as when
+        ifup-ovs sources the ifcfg file.
+        :param ifcfg_values: dict of ifcfg key/values
+        :returns: list of commands, each a list of ovs-vsctl arguments
+        """
+        ovs_extra = re.sub(r'\$\{?(\w+)\}?',
+                           lambda m: ifcfg_values.get(m.group(1), ''),
+                           ifcfg_values.get("OVS_EXTRA", ""))
+        return [command.split() for command in ovs_extra.split(" -- ")
+                if command.split()]
+
+    def ovs_extra_delta(self, file_values, data_values):
+        """Return the ovs-vsctl commands to go from old to new OVS_EXTRA.
+
+        The settings of the old 'set' commands missing from the new ones are
+        removed or cleared and the new commands are run. Other old commands
+        cannot be reverted, so their removal requires a restart.
+        :param file_values: dict of the previous ifcfg key/values
+        :param data_values: dict of the new ifcfg key/values
+        :returns: list of commands, each a list of ovs-vsctl arguments, or
+                  None if the change cannot be applied in place
+        """
+        old_commands = self.ovs_extra_commands(file_values)
+        new_commands = self.ovs_extra_commands(data_values)
+        new_settings = set()
+        for command in new_commands:
+            if command[0] == 'set' and len(command) > 3:
+                for setting in command[3:]:
+                    new_settings.add((command[1].lower(), command[2],
+                                      setting.split('=', 1)[0]))
+        commands = []
+        for command in old_commands:
+            if command in new_commands:
+                continue
+            if command[0] != 'set' or len(command) < 4 or \
+                    not all('=' in setting for setting in command[3:]):
+                return None
+            table, record = command[1].lower(), command[2]
+            for setting in command[3:]:
+                column = setting.split('=', 1)[0]
+                if (table, record, column) in new_settings:
+                    continue
+                if ':' in column:
+                    commands.append(['remove', table, record] +
+                                    column.split(':', 1))
+                else:
+                    commands.append(['clear', table, record, column])
+        commands.extend(command for command in new_commands
+                        if command not in old_commands)
+        return commands
+
+    def ovs_vsctl_apply_commands(self, device_name, filename, data):
+        """Return list of ovs-vsctl commands needed to implement changes.
+
+        :param device_name: The name of the int, bridge, or bond
+        :type device_name: string
+        :param filename: The ifcfg-<int> filename.
+        :type filename: string
+        :param data: The data for the new ifcfg-<int> file.
+        :type data: string
+        :returns: commands, each a list of ovs-vsctl arguments
+        """
+        file_values = self.get_ifcfg_values(self.get_file_data(filename))
+        data_values = self.get_ifcfg_values(data)
+        return self.ovs_extra_delta(file_values, data_values) or []
+
+    def ovs_dpdk_hotplug_commands(self, ifcfg_values):
+        """Return the ovs-vsctl commands to (re)create a DPDK port or bond.
+
+        These are the commands ifup-ovs runs for the OVSDPDKPort and
+        OVSDPDKBond types, the DPDK devices being attached with their
+        dpdk-devargs from OVS_EXTRA.
+        :param ifcfg_values: dict of ifcfg key/values
+        :returns: list of commands, each a list of ovs-vsctl arguments
+        """
+        bridge = ifcfg_values["OVS_BRIDGE"]
+        device = ifcfg_values["DEVICE"]
+        options = ifcfg_values.get("OVS_OPTIONS", "").split()
+        commands = [['--if-exists', 'del-port', bridge, device]]
+        if ifcfg_values.get("TYPE") == "OVSDPDKBond":
+            ifaces = ifcfg_values.get("BOND_IFACES", "").split()
+            commands.append(['add-bond', bridge, device] + ifaces + options)
+        else:
+            ifaces = [device]
+            commands.append(['add-port', bridge, device] + options)
+        for iface in ifaces:
+            commands.append(['set', 'Interface', iface, 'type=dpdk'])
+        commands.extend(self.ovs_extra_commands(ifcfg_values))
+        return commands
+
+    def ovs_vsctl_transaction(self, commands):
+        """Run ovs-vsctl commands in a single transaction.
+
+        Either all the commands are applied or none of them.
+        :param commands: list of (name, command) tuples, the name being the
+                         interface the command applies to and the command a
+                         list of ovs-vsctl arguments
+        :returns: list of the interface names to restart on failure
+        """
+        if not commands:
+            return []
+        args = ['-t', str(OVS_VSCTL_TIMEOUT)]
+        for _, command in commands:
+            args.append('--')
+            args.extend(command)
+        try:
+            self.execute('Running ovs-vsctl %s' % ' '.join(args),
+                         ovs_vsctl_path(), *args)
+        except Exception as e:
+            names = []
+            for name, _ in commands:
+                if name not in names:
+                    names.append(name)
+            logger.warning("Error in ovs-vsctl transaction, restarting "
+                           "%s:\n%s" % (', '.join(names), str(e)))
+            return names
+        return []
+
     def ethtool_apply_command(self, device_name, filename, data):
         """Return list of commands needed to implement changes.
 
@@ -347,9 +778,9 @@ class IfcfgNetConfig(os_net_config.NetConfig):
         :returns: commands (commands to be run)
         """
 
-        previous_cfg = common.get_file_data(filename)
-        file_values = self.parse_ifcfg(previous_cfg)
-        data_values = self.parse_ifcfg(data)
+        previous_cfg = self.get_file_data(filename)
+        file_values = self.get_ifcfg_values(previous_cfg)
+        data_values = self.get_ifcfg_values(data)
         logger.debug("File values:\n%s" % file_values)
         logger.debug("Data values:\n%s" % data_values)
         changes = self.enumerate_ifcfg_changes(file_values, data_values)
@@ -384,7 +815,7 @@ class IfcfgNetConfig(os_net_config.NetConfig):
         :return: list of commands to feed to 'ip' to reconfigure routes
         """
 
-        file_values = self.parse_ifcfg_routes(common.get_file_data(filename))
+        file_values = self.parse_ifcfg_routes(self.get_file_data(filename))
         data_values = self.parse_ifcfg_routes(data)
         route_changes = self.enumerate_ifcfg_route_changes(file_values,
                                                            data_values)
@@ -409,7 +840,7 @@ class IfcfgNetConfig(os_net_config.NetConfig):
         :return: list of commands to feed to 'ip' to reconfigure route rules
         """
 
-        file_values = self.parse_ifcfg_rules(common.get_file_data(filename))
+        file_values = self.parse_ifcfg_rules(self.get_file_data(filename))
         data_values = self.parse_ifcfg_rules(data)
         rule_changes = self.enumerate_ifcfg_rule_changes(file_values,
                                                          data_values)
@@ -422,15 +853,164 @@ class IfcfgNetConfig(os_net_config.NetConfig):
                 commands.append('rule add ' + rule[0])
         return commands
 
-    def child_members(self, name):
-        children = set()
+    def iproute2_batch(self, ipcmd, commands):
+        """Run 'ip' commands with a single 'ip -force -batch' invocation.
+
+        All the commands are run, even if some of them fail. ip reports the
+        line of each failing command, which is mapped back to its interface.
+        :param ipcmd: path to the 'ip' executable
+        :param commands: list of (name, command) tuples, the name being the
+                         interface the command applies to
+        :returns: list of the names of the interfaces with failed commands
+        """
+        commands = [(name, command) for name, command in commands
+                    if command.split()]
+        if not commands:
+            return []
+        batch = ''.join('%s\n' % command for _, command in commands)
         try:
-            for member in self.member_names[name]:
-                children.add(member)
-                children.update(self.child_members(member))
-        except KeyError:
-            pass
-        return children
+            self.execute('Running ip -batch:\n%s' % batch, ipcmd, '-force',
+                         '-batch', '-', process_input=batch)
+        except Exception as e:
+            stderr = getattr(e, 'stderr', None) or ''
+            lines = [int(line) for line in
+                     re.findall(r'Command failed -:(\d+)', stderr)]
+            if not lines:
+                # The failed commands are not known, so all of them are
+                # considered failed
+                lines = range(1, len(commands) + 1)
+            failed = []
+            for line in lines:
+                name, command = commands[line - 1]
+                logger.warning("Error in 'ip %s', restarting %s:\n%s" %
+                               (command, name, str(e)))
+                if name not in failed:
+                    failed.append(name)
+            return failed
+        return []
+
+    def ifcfg_types(self):
+        """Return the ifcfg object types, in the order apply plans them.
+
+        The vlans and ib children come last, so that it is known if their
+        PHYSDEV is restarted.
+        """
+        return (
+            IfcfgType('interface_data', 'interface', 'interface',
+                      ifcfg_config_path, 'interfaces'),
+            IfcfgType('ivsinterface_data', 'ivs', 'ivs interface',
+                      ifcfg_config_path, 'interfaces'),
+            IfcfgType('nfvswitch_intiface_data', 'nfvswitch',
+                      'nfvswitch interface', ifcfg_config_path, 'interfaces'),
+            IfcfgType('bridge_data', 'bridge', 'bridge',
+                      bridge_config_path, 'bridges'),
+            IfcfgType('linuxbridge_data', 'bridge', 'bridge',
+                      bridge_config_path, 'bridges'),
+            IfcfgType('linuxteam_data', 'team', 'linux team',
+                      bridge_config_path, 'linux_teams'),
+            IfcfgType('linuxbond_data', 'bond', 'linux bond',
+                      bridge_config_path, 'linux_bonds'),
+            IfcfgType('ib_interface_data', 'ib', 'InfiniBand iface',
+                      ifcfg_config_path, 'interfaces'),
+            IfcfgType('vlan_data', 'vlan', 'vlan interface',
+                      ifcfg_config_path, 'vlans'),
+            IfcfgType('ib_childs_data', 'ib_child', 'ib child interface',
+                      ifcfg_config_path, 'ib_childs'))
+
+    def restart_dependencies(self, linux_bond_children):
+        """Map each interface to the interfaces to bring up before it.
+
+        Bridges and teams come up before their members, the members of a
+        linux bond before the bond and the PHYSDEV of a vlan before the vlan.
+        The members of a linux bond come up one after the other, since the
+        initscripts enslaving them through sysfs would race on the master.
+        :param linux_bond_children: dict of linux bond names to the names of
+                                    their members
+        :returns: dict of interface names to sets of interface names
+        """
+        parents = {}
+        for name in self.member_names:
+            if name not in linux_bond_children:
+                for child in self.child_members(name):
+                    parents.setdefault(child, set()).add(name)
+        for bond, children in linux_bond_children.items():
+            parents.setdefault(bond, set()).update(children)
+            members = self.member_names.get(bond, [])
+            for previous, member in zip(members, members[1:]):
+                parents.setdefault(member, set()).add(previous)
+        for name, data in itertools.chain(self.vlan_data.items(),
+                                          self.ib_childs_data.items()):
+            physdev = self.get_ifcfg_values(data).get('PHYSDEV')
+            if physdev:
+                parents.setdefault(name, set()).add(physdev)
+        return parents
+
+    def restart_levels(self, restarts, parents):
+        """Group the interfaces to restart by dependency level.
+
+        The interfaces of a level only depend on interfaces of the previous
+        levels, so they can be restarted concurrently.
+        :param restarts: list of (name, iftype) tuples
+        :param parents: dict as returned by restart_dependencies
+        :returns: list of lists of (name, iftype) tuples, in ifup order
+        """
+        iftypes = {}
+        for name, iftype in restarts:
+            if iftypes.get(name) != 'bridge':
+                iftypes[name] = iftype
+        depths = {}
+
+        def depth(name, seen=()):
+            if name not in depths:
+                depths[name] = 0
+                for parent in parents.get(name, ()):
+                    if parent in iftypes and parent not in seen:
+                        depths[name] = max(depths[name],
+                                           depth(parent, seen + (name,)) + 1)
+            return depths[name]
+
+        levels = []
+        for name in iftypes:
+            level = depth(name)
+            while len(levels) <= level:
+                levels.append([])
+        for name, iftype in iftypes.items():
+            levels[depths[name]].append((name, iftype))
+        return [level for level in levels if level]
+
+    def run_restarts(self, action, levels):
+        """Run ifdown or ifup on the interfaces, one level at a time.
+
+        :param action: self.ifdown or self.ifup
+        :param levels: list of lists of (name, iftype) tuples, as returned by
+                       restart_levels and in the order to run them
+        """
+        for level in levels:
+            if self.noop or len(level) == 1:
+                for name, iftype in level:
+                    action(name, iftype=iftype)
+                continue
+            workers = min(RESTART_WORKERS, len(level))
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                futures = [executor.submit(action, name, iftype=iftype)
+                           for name, iftype in level]
+                for future in futures:
+                    future.result()
+
+    def child_members(self, name):
+        if self.member_closure:
+            return self.member_closure.descendants(name)
+        return MemberClosure(self.member_names).descendants(name)
+
+    def member_masters(self, name):
+        """Return the bridges, bonds and teams an interface is a member of.
+
+        :param name: the interface name
+        :returns: set of the names of its direct and indirect masters
+        """
+        if self.member_closure:
+            return self.member_closure.ancestors(name)
+        return MemberClosure(self.member_names).ancestors(name)
 
     def _add_common(self, base_opt):
 
@@ -631,6 +1211,13 @@ class IfcfgNetConfig(os_net_config.NetConfig):
                 data += "TX_QUEUE_SIZE=%i\n" % base_opt.tx_queue_size
                 ovs_extra.append("set Interface $DEVICE " +
                                  "options:n_txq_desc=$TX_QUEUE_SIZE")
+            if base_opt.rxq_affinity == 'auto':
+                affinity = self.pmd_rxq_affinity(base_opt.members[0].name,
+                                                 dpdk_devargs,
+                                                 base_opt.rx_queue or 1)
+                if affinity:
+                    ovs_extra.append("set Interface $DEVICE other_config:"
+                                     "pmd-rxq-affinity=%s" % affinity)
         elif isinstance(base_opt, objects.OvsDpdkBond):
             ovs_extra.extend(base_opt.ovs_extra)
             # Referring to bug:1643026, the below commenting of the interfaces,
@@ -1328,596 +1915,307 @@ class IfcfgNetConfig(os_net_config.NetConfig):
         Note the noop mode is set via the constructor noop boolean
         """
         logger.info('applying network configs...')
-        restart_interfaces = []
-        restart_vlans = []
-        restart_ib_childs = []
-        restart_bridges = []
-        restart_linux_bonds = []
-        start_linux_bonds = []
-        restart_linux_teams = []
-        restart_vpp = False
-        apply_interfaces = []
-        apply_bridges = []
-        apply_routes = []
-        apply_rules = []
-        update_files = {}
-        all_file_names = []
-        linux_bond_children = {}
-        ivs_uplinks = []  # ivs physical uplinks
-        ivs_interfaces = []  # ivs internal ports
-        nfvswitch_interfaces = []       # nfvswitch physical interfaces
-        nfvswitch_internal_ifaces = []  # nfvswitch internal/management ports
-        stop_dhclient_interfaces = []
-        ovs_needs_restart = False
-        vpp_interfaces = self.vpp_interface_data.values()
-        vpp_bonds = self.vpp_bond_data.values()
-        ipcmd = utils.iproute2_path()
-        ethtoolcmd = utils.ethtool_path()
-
-        for interface_name, iface_data in self.interface_data.items():
-            route_data = self.route_data.get(interface_name, '')
-            route6_data = self.route6_data.get(interface_name, '')
-            rule_data = self.rule_data.get(interface_name, '')
-            interface_path = self.root_dir + ifcfg_config_path(interface_name)
-            route_path = self.root_dir + route_config_path(interface_name)
-            route6_path = self.root_dir + route6_config_path(interface_name)
-            rule_path = self.root_dir + route_rule_config_path(interface_name)
-            all_file_names.append(interface_path)
-            all_file_names.append(route_path)
-            all_file_names.append(route6_path)
-            if "IVS_BRIDGE" in iface_data:
-                ivs_uplinks.append(interface_name)
-            if "NFVSWITCH_BRIDGE" in iface_data:
-                nfvswitch_interfaces.append(interface_name)
-            if utils.diff(interface_path, iface_data):
-                if self.ifcfg_requires_restart(interface_path, iface_data):
-                    restart_interfaces.append(interface_name)
-                    # Openvswitch needs to be restarted when OVSDPDKPort or
-                    # OVSDPDKBond is added
-                    if "OVSDPDK" in iface_data:
-                        ovs_needs_restart = True
-                else:
-                    apply_interfaces.append(
-                        (interface_name, interface_path, iface_data))
-                update_files[interface_path] = iface_data
-                if "BOOTPROTO=dhcp" not in iface_data:
-                    stop_dhclient_interfaces.append(interface_name)
-
-            else:
-                logger.info('No changes required for interface: %s' %
-                            interface_name)
-            if utils.diff(route_path, route_data):
-                update_files[route_path] = route_data
-                if interface_name not in restart_interfaces:
-                    apply_routes.append((interface_name, route_data))
-            if utils.diff(route6_path, route6_data):
-                update_files[route6_path] = route6_data
-                if interface_name not in restart_interfaces:
-                    apply_routes.append((interface_name, route6_data))
-            if utils.diff(rule_path, rule_data):
-                update_files[rule_path] = rule_data
-                if interface_name not in restart_interfaces:
-                    apply_rules.append((interface_name, rule_data))
-
-        for interface_name, iface_data in self.ivsinterface_data.items():
-            route_data = self.route_data.get(interface_name, '')
-            route6_data = self.route6_data.get(interface_name, '')
-            rule_data = self.rule_data.get(interface_name, '')
-            interface_path = self.root_dir + ifcfg_config_path(interface_name)
-            route_path = self.root_dir + route_config_path(interface_name)
-            route6_path = self.root_dir + route6_config_path(interface_name)
-            rule_path = self.root_dir + route_rule_config_path(interface_name)
-            all_file_names.append(interface_path)
-            all_file_names.append(route_path)
-            all_file_names.append(route6_path)
-            all_file_names.append(rule_path)
-            ivs_interfaces.append(interface_name)
-            if utils.diff(interface_path, iface_data):
-                if self.ifcfg_requires_restart(interface_path, iface_data):
-                    restart_interfaces.append(interface_name)
-                else:
-                    apply_interfaces.append(
-                        (interface_name, interface_path, iface_data))
-                update_files[interface_path] = iface_data
-            else:
-                logger.info('No changes required for ivs interface: %s' %
-                            interface_name)
-            if utils.diff(route_path, route_data):
-                update_files[route_path] = route_data
-                if interface_name not in restart_interfaces:
-                    apply_routes.append((interface_name, route_data))
-            if utils.diff(route6_path, route6_data):
-                update_files[route6_path] = route6_data
-                if interface_name not in restart_interfaces:
-                    apply_routes.append((interface_name, route6_data))
-            if utils.diff(rule_path, rule_data):
-                update_files[rule_path] = rule_data
-                if interface_name not in restart_interfaces:
-                    apply_rules.append((interface_name, rule_data))
-
-        for iface_name, iface_data in self.nfvswitch_intiface_data.items():
-            route_data = self.route_data.get(iface_name, '')
-            route6_data = self.route6_data.get(iface_name, '')
-            rule_data = self.rule_data.get(iface_name, '')
-            iface_path = self.root_dir + ifcfg_config_path(iface_name)
-            route_path = self.root_dir + route_config_path(iface_name)
-            route6_path = self.root_dir + route6_config_path(iface_name)
-            rule_path = self.root_dir + route_rule_config_path(iface_name)
-            all_file_names.append(iface_path)
-            all_file_names.append(route_path)
-            all_file_names.append(route6_path)
-            all_file_names.append(rule_path)
-            nfvswitch_internal_ifaces.append(iface_name)
-            if utils.diff(iface_path, iface_data):
-                if self.ifcfg_requires_restart(iface_path, iface_data):
-                    restart_interfaces.append(iface_name)
-                else:
-                    apply_interfaces.append(
-                        (iface_name, iface_path, iface_data))
-                update_files[iface_path] = iface_data
-            else:
-                logger.info('No changes required for nfvswitch interface: %s' %
-                            iface_name)
-            if utils.diff(route_path, route_data):
-                update_files[route_path] = route_data
-                if iface_name not in restart_interfaces:
-                    apply_routes.append((iface_name, route_data))
-            if utils.diff(route6_path, route6_data):
-                update_files[route6_path] = route6_data
-                if iface_name not in restart_interfaces:
-                    apply_routes.append((iface_name, route6_data))
-            if utils.diff(rule_path, rule_data):
-                update_files[rule_path] = rule_data
-                if iface_name not in restart_interfaces:
-                    apply_rules.append((iface_name, rule_data))
-
-        for bridge_name, bridge_data in self.bridge_data.items():
-            route_data = self.route_data.get(bridge_name, '')
-            route6_data = self.route6_data.get(bridge_name, '')
-            rule_data = self.rule_data.get(bridge_name, '')
-            bridge_path = self.root_dir + bridge_config_path(bridge_name)
-            br_route_path = self.root_dir + route_config_path(bridge_name)
-            br_route6_path = self.root_dir + route6_config_path(bridge_name)
-            br_rule_path = self.root_dir + route_rule_config_path(bridge_name)
-            all_file_names.append(bridge_path)
-            all_file_names.append(br_route_path)
-            all_file_names.append(br_route6_path)
-            all_file_names.append(br_rule_path)
-            if utils.diff(bridge_path, bridge_data):
-                if self.ifcfg_requires_restart(bridge_path, bridge_data):
-                    restart_bridges.append(bridge_name)
-                    # Avoid duplicate interface being added to the restart list
-                    children = self.child_members(bridge_name)
-                    for child in children:
-                        if child not in restart_interfaces:
-                            restart_interfaces.append(child)
-                else:
-                    apply_bridges.append((bridge_name, bridge_path,
-                                          bridge_data))
-                update_files[bridge_path] = bridge_data
-            else:
-                logger.info('No changes required for bridge: %s' % bridge_name)
-            if utils.diff(br_route_path, route_data):
-                update_files[br_route_path] = route_data
-                if bridge_name not in restart_interfaces:
-                    apply_routes.append((bridge_name, route_data))
-            if utils.diff(br_route6_path, route6_data):
-                update_files[br_route6_path] = route6_data
-                if bridge_name not in restart_interfaces:
-                    apply_routes.append((bridge_name, route6_data))
-            if utils.diff(br_rule_path, rule_data):
-                update_files[br_rule_path] = rule_data
-                if bridge_name not in restart_interfaces:
-                    apply_rules.append((bridge_name, rule_data))
-
-        for bridge_name, bridge_data in self.linuxbridge_data.items():
-            route_data = self.route_data.get(bridge_name, '')
-            route6_data = self.route6_data.get(bridge_name, '')
-            rule_data = self.rule_data.get(bridge_name, '')
-            bridge_path = self.root_dir + bridge_config_path(bridge_name)
-            br_route_path = self.root_dir + route_config_path(bridge_name)
-            br_route6_path = self.root_dir + route6_config_path(bridge_name)
-            br_rule_path = self.root_dir + route_rule_config_path(bridge_name)
-            all_file_names.append(bridge_path)
-            all_file_names.append(br_route_path)
-            all_file_names.append(br_route6_path)
-            all_file_names.append(br_rule_path)
-            if utils.diff(bridge_path, bridge_data):
-                if self.ifcfg_requires_restart(bridge_path, bridge_data):
-                    restart_bridges.append(bridge_name)
-                    # Avoid duplicate interface being added to the restart list
-                    children = self.child_members(bridge_name)
-                    for child in children:
-                        if child not in restart_interfaces:
-                            restart_interfaces.append(child)
-                else:
-                    apply_bridges.append((bridge_name, bridge_path,
-                                          bridge_data))
-                update_files[bridge_path] = bridge_data
-            else:
-                logger.info('No changes required for bridge: %s' % bridge_name)
-            if utils.diff(br_route_path, route_data):
-                update_files[br_route_path] = route_data
-                if bridge_name not in restart_bridges:
-                    apply_routes.append((bridge_name, route_data))
-            if utils.diff(route6_path, route6_data):
-                update_files[route6_path] = route6_data
-                if bridge_name not in restart_bridges:
-                    apply_routes.append((bridge_name, route6_data))
-            if utils.diff(br_rule_path, rule_data):
-                update_files[br_rule_path] = rule_data
-                if bridge_name not in restart_bridges:
-                    apply_rules.append((bridge_name, rule_data))
-
-        for team_name, team_data in self.linuxteam_data.items():
-            route_data = self.route_data.get(team_name, '')
-            route6_data = self.route6_data.get(team_name, '')
-            rule_data = self.rule_data.get(team_name, '')
-            team_path = self.root_dir + bridge_config_path(team_name)
-            team_route_path = self.root_dir + route_config_path(team_name)
-            team_route6_path = self.root_dir + route6_config_path(team_name)
-            team_rule_path = self.root_dir + route_rule_config_path(team_name)
-            all_file_names.append(team_path)
-            all_file_names.append(team_route_path)
-            all_file_names.append(team_route6_path)
-            all_file_names.append(team_rule_path)
-            if utils.diff(team_path, team_data):
-                if self.ifcfg_requires_restart(team_path, team_data):
-                    restart_linux_teams.append(team_name)
-                    # Avoid duplicate interface being added to the restart list
-                    children = self.child_members(team_name)
-                    for child in children:
-                        if child not in restart_interfaces:
-                            restart_interfaces.append(child)
-                else:
-                    apply_interfaces.append(
-                        (team_name, team_path, team_data))
-                update_files[team_path] = team_data
-            else:
-                logger.info('No changes required for linux team: %s' %
-                            team_name)
-            if utils.diff(team_route_path, route_data):
-                update_files[team_route_path] = route_data
-                if team_name not in restart_linux_teams:
-                    apply_routes.append((team_name, route_data))
-            if utils.diff(team_route6_path, route6_data):
-                update_files[team_route6_path] = route6_data
-                if team_name not in restart_linux_teams:
-                    apply_routes.append((team_name, route6_data))
-            if utils.diff(team_rule_path, rule_data):
-                update_files[team_rule_path] = rule_data
-
-        for bond_name, bond_data in self.linuxbond_data.items():
-            route_data = self.route_data.get(bond_name, '')
-            route6_data = self.route6_data.get(bond_name, '')
-            rule_data = self.rule_data.get(bond_name, '')
-            bond_path = self.root_dir + bridge_config_path(bond_name)
-            bond_route_path = self.root_dir + route_config_path(bond_name)
-            bond_route6_path = self.root_dir + route6_config_path(bond_name)
-            bond_rule_path = self.root_dir + route_rule_config_path(bond_name)
-            all_file_names.append(bond_path)
-            all_file_names.append(bond_route_path)
-            all_file_names.append(bond_route6_path)
-            all_file_names.append(bond_rule_path)
-            children = self.child_members(bond_name)
-            linux_bond_children[bond_name] = children
-            if utils.diff(bond_path, bond_data):
-                if self.ifcfg_requires_restart(bond_path, bond_data):
-                    restart_linux_bonds.append(bond_name)
-                    # Avoid duplicate interface being added to the restart list
-                    for child in children:
-                        if child not in restart_interfaces:
-                            restart_interfaces.append(child)
-                else:
-                    apply_interfaces.append(
-                        (bond_name, bond_path, bond_data))
-                update_files[bond_path] = bond_data
-            else:
-                for child in children:
-                    if child in restart_interfaces and \
-                       bond_name not in restart_linux_bonds:
-                        restart_linux_bonds.append(bond_name)
-                        break
-                else:
-                    logger.info('No changes required for linux bond: %s' %
-                                bond_name)
-            if utils.diff(bond_route_path, route_data):
-                update_files[bond_route_path] = route_data
-                if bond_name not in restart_linux_bonds:
-                    apply_routes.append((bond_name, route_data))
-            if utils.diff(bond_route6_path, route6_data):
-                update_files[bond_route6_path] = route6_data
-                if bond_name not in restart_linux_bonds:
-                    apply_routes.append((bond_name, route6_data))
-            if utils.diff(bond_rule_path, rule_data):
-                update_files[bond_rule_path] = rule_data
-
-        # Infiniband interfaces are handled similarly to Ethernet interfaces
-        for interface_name, iface_data in self.ib_interface_data.items():
-            route_data = self.route_data.get(interface_name, '')
-            route6_data = self.route6_data.get(interface_name, '')
-            rule_data = self.rule_data.get(interface_name, '')
-            interface_path = self.root_dir + ifcfg_config_path(interface_name)
-            route_path = self.root_dir + route_config_path(interface_name)
-            route6_path = self.root_dir + route6_config_path(interface_name)
-            rule_path = self.root_dir + route_rule_config_path(interface_name)
-            all_file_names.append(interface_path)
-            all_file_names.append(route_path)
-            all_file_names.append(route6_path)
-            all_file_names.append(rule_path)
-            # TODO(dsneddon) determine if InfiniBand can be used with IVS
-            if "IVS_BRIDGE" in iface_data:
-                ivs_uplinks.append(interface_name)
-            if utils.diff(interface_path, iface_data):
-                if self.ifcfg_requires_restart(interface_path, iface_data):
-                    restart_interfaces.append(interface_name)
-                else:
-                    apply_interfaces.append(
-                        (interface_name, interface_path, iface_data))
-                update_files[interface_path] = iface_data
-            else:
-                logger.info('No changes required for InfiniBand iface: %s' %
-                            interface_name)
-            if utils.diff(route_path, route_data):
-                update_files[route_path] = route_data
-                if interface_name not in restart_interfaces:
-                    apply_routes.append((interface_name, route_data))
-            if utils.diff(route6_path, route6_data):
-                update_files[route6_path] = route6_data
-                if interface_name not in restart_interfaces:
-                    apply_routes.append((interface_name, route6_data))
-            if utils.diff(rule_path, rule_data):
-                update_files[rule_path] = rule_data
-                if interface_name not in restart_interfaces:
-                    apply_rules.append((interface_name, rule_data))
-
-        # NOTE(hjensas): Process the VLAN's last so that we know if the vlan's
-        # parent interface is being restarted.
-        for vlan_name, vlan_data in self.vlan_data.items():
-            route_data = self.route_data.get(vlan_name, '')
-            route6_data = self.route6_data.get(vlan_name, '')
-            rule_data = self.rule_data.get(vlan_name, '')
-            vlan_path = self.root_dir + ifcfg_config_path(vlan_name)
-            vlan_route_path = self.root_dir + route_config_path(vlan_name)
-            vlan_route6_path = self.root_dir + route6_config_path(vlan_name)
-            vlan_rule_path = self.root_dir + route_rule_config_path(vlan_name)
-            all_file_names.append(vlan_path)
-            all_file_names.append(vlan_route_path)
-            all_file_names.append(vlan_route6_path)
-            all_file_names.append(vlan_rule_path)
-            restarts_concatenated = itertools.chain(restart_interfaces,
-                                                    restart_bridges,
-                                                    restart_linux_bonds,
-                                                    restart_linux_teams)
-            if (self.parse_ifcfg(vlan_data).get('PHYSDEV') in
-                    restarts_concatenated):
-                if vlan_name not in restart_vlans:
-                    restart_vlans.append(vlan_name)
-                update_files[vlan_path] = vlan_data
-            elif utils.diff(vlan_path, vlan_data):
-                if self.ifcfg_requires_restart(vlan_path, vlan_data):
-                    restart_vlans.append(vlan_name)
-                else:
-                    apply_interfaces.append(
-                        (vlan_name, vlan_path, vlan_data))
-                update_files[vlan_path] = vlan_data
-            else:
-                logger.info('No changes required for vlan interface: %s' %
-                            vlan_name)
-            if utils.diff(vlan_route_path, route_data):
-                update_files[vlan_route_path] = route_data
-                if vlan_name not in restart_vlans:
-                    apply_routes.append((vlan_name, route_data))
-            if utils.diff(vlan_route6_path, route6_data):
-                update_files[vlan_route6_path] = route6_data
-                if vlan_name not in restart_vlans:
-                    apply_routes.append((vlan_name, route6_data))
-            if utils.diff(vlan_rule_path, rule_data):
-                update_files[vlan_rule_path] = rule_data
-                if vlan_name not in restart_vlans:
-                    apply_rules.append((vlan_name, rule_data))
-
-        for ib_child_name, ib_child_data in self.ib_childs_data.items():
-            route_data = self.route_data.get(ib_child_name, '')
-            route6_data = self.route6_data.get(ib_child_name, '')
-            rule_data = self.rule_data.get(ib_child_name, '')
-            ib_child_path = self.root_dir + ifcfg_config_path(ib_child_name)
-            ib_child_route_path = \
-                self.root_dir + route_config_path(ib_child_name)
-            ib_child_route6_path = \
-                self.root_dir + route6_config_path(ib_child_name)
-            ib_child_rule_path = \
-                self.root_dir + route_rule_config_path(ib_child_name)
-            all_file_names.append(ib_child_path)
-            all_file_names.append(ib_child_route_path)
-            all_file_names.append(ib_child_route6_path)
-            all_file_names.append(ib_child_rule_path)
-            restarts_concatenated = itertools.chain(restart_interfaces,
-                                                    restart_bridges,
-                                                    restart_linux_bonds,
-                                                    restart_linux_teams)
-            if (self.parse_ifcfg(ib_child_data).get('PHYSDEV') in
-                    restarts_concatenated):
-                if ib_child_name not in restart_ib_childs:
-                    restart_ib_childs.append(ib_child_name)
-                update_files[ib_child_path] = ib_child_data
-            elif utils.diff(ib_child_path, ib_child_data):
-                if self.ifcfg_requires_restart(ib_child_path, ib_child_data):
-                    restart_ib_childs.append(ib_child_name)
+        # Every config file is read once, the files are compared with the
+        # new config until they are written
+        self.file_snapshot = FileSnapshot(self.parse_ifcfg)
+        # The members of the bridges, bonds and teams, looked up by the
+        # planning and the restarts
+        self.member_closure = MemberClosure(self.member_names)
+        try:
+            restart_interfaces = RestartSet()
+            restart_vlans = RestartSet()
+            restart_ib_childs = RestartSet()
+            restart_bridges = RestartSet()
+            restart_linux_bonds = RestartSet()
+            start_linux_bonds = RestartSet()
+            restart_linux_teams = RestartSet()
+            restart_vpp = False
+            apply_interfaces = []
+            apply_bridges = []
+            apply_routes = []
+            apply_rules = []
+            update_files = {}
+            all_file_names = set()
+            linux_bond_children = {}
+            ivs_uplinks = []  # ivs physical uplinks
+            ivs_interfaces = []  # ivs internal ports
+            nfvswitch_interfaces = []  # nfvswitch physical interfaces
+            # nfvswitch internal/management ports
+            nfvswitch_internal_ifaces = []
+            stop_dhclient_interfaces = []
+            ovs_needs_restart = False
+            dpdk_hotplugs = []
+            vpp_interfaces = self.vpp_interface_data.values()
+            vpp_bonds = self.vpp_bond_data.values()
+            ipcmd = utils.iproute2_path()
+            ethtoolcmd = utils.ethtool_path()
+
+            restarts = {'interfaces': restart_interfaces,
+                        'bridges': restart_bridges,
+                        'linux_teams': restart_linux_teams,
+                        'linux_bonds': restart_linux_bonds,
+                        'vlans': restart_vlans,
+                        'ib_childs': restart_ib_childs}
+            for ifcfg_type in self.ifcfg_types():
+                type_restarts = restarts[ifcfg_type.restarts]
+                for name, data in getattr(self, ifcfg_type.data).items():
+                    route_data = self.route_data.get(name, '')
+                    route6_data = self.route6_data.get(name, '')
+                    rule_data = self.rule_data.get(name, '')
+                    path = self.root_dir + ifcfg_type.config_path(name)
+                    route_path = self.root_dir + route_config_path(name)
+                    route6_path = self.root_dir + route6_config_path(name)
+                    rule_path = self.root_dir + route_rule_config_path(name)
+                    all_file_names.update((path, route_path, route6_path,
+                                           rule_path))
+                    if ifcfg_type.kind in ('interface', 'ib') and \
+                            "IVS_BRIDGE" in data:
+                        ivs_uplinks.append(name)
+                    elif ifcfg_type.kind == 'ivs':
+                        ivs_interfaces.append(name)
+                    elif ifcfg_type.kind == 'nfvswitch':
+                        nfvswitch_internal_ifaces.append(name)
+                    if ifcfg_type.kind == 'interface' and \
+                            "NFVSWITCH_BRIDGE" in data:
+                        nfvswitch_interfaces.append(name)
+                    children = ()
+                    if ifcfg_type.kind in ('bridge', 'team', 'bond'):
+                        children = self.child_members(name)
+                    if ifcfg_type.kind == 'bond':
+                        linux_bond_children[name] = children
+
+                    physdev = None
+                    if ifcfg_type.kind in ('vlan', 'ib_child'):
+                        physdev = self.get_ifcfg_values(data).get('PHYSDEV')
+                    if physdev is not None and (
+                            physdev in restart_interfaces or
+                            physdev in restart_bridges or
+                            physdev in restart_linux_bonds or
+                            physdev in restart_linux_teams):
+                        type_restarts.add(name)
+                        update_files[path] = data
+                    elif self.diff(path, data):
+                        if self.ifcfg_requires_restart(path, data):
+                            type_restarts.add(name)
+                            # The members are restarted with their master
+                            restart_interfaces.update(children)
+                            # DPDK ports are hotplugged, unless openvswitch is
+                            # to be restarted when an OVSDPDKPort or
+                            # OVSDPDKBond is added
+                            if ifcfg_type.kind == 'interface' and \
+                                    "OVSDPDK" in data:
+                                if self.restart_ovs_on_dpdk:
+                                    ovs_needs_restart = True
+                                else:
+                                    dpdk_hotplugs.append(name)
+                        elif ifcfg_type.kind == 'bridge':
+                            apply_bridges.append((name, path, data))
+                        else:
+                            apply_interfaces.append((name, path, data))
+                        update_files[path] = data
+                        if ifcfg_type.kind == 'interface' and \
+                                "BOOTPROTO=dhcp" not in data:
+                            stop_dhclient_interfaces.append(name)
+                    elif ifcfg_type.kind == 'bond' and \
+                            any(child in restart_interfaces
+                                for child in children):
+                        # A bond is restarted along with its members
+                        type_restarts.add(name)
+                    else:
+                        logger.info('No changes required for %s: %s' %
+                                    (ifcfg_type.description, name))
+
+                    for file_path, file_data, apply_list in (
+                            (route_path, route_data, apply_routes),
+                            (route6_path, route6_data, apply_routes),
+                            (rule_path, rule_data, apply_rules)):
+                        if self.diff(file_path, file_data):
+                            update_files[file_path] = file_data
+                            if name not in type_restarts:
+                                apply_list.append((name, file_data))
+
+            if self.vpp_interface_data or self.vpp_bond_data:
+                vpp_path = self.root_dir + vpp_config_path()
+                vpp_config = utils.generate_vpp_config(vpp_path,
+                                                       vpp_interfaces,
+                                                       vpp_bonds)
+                if self.diff(vpp_path, vpp_config):
+                    restart_vpp = True
+                    update_files[vpp_path] = vpp_config
                 else:
-                    apply_interfaces.append(
-                        (ib_child_name, ib_child_path, ib_child_data))
-                update_files[ib_child_path] = ib_child_data
-            else:
-                logger.info('No changes required for the ib child interface: '
-                            '%s' % ib_child_name)
-            if utils.diff(ib_child_route_path, route_data):
-                update_files[ib_child_route_path] = route_data
-                if ib_child_name not in restart_ib_childs:
-                    apply_routes.append((ib_child_name, route_data))
-            if utils.diff(ib_child_route6_path, route6_data):
-                update_files[ib_child_route6_path] = route6_data
-                if ib_child_name not in restart_ib_childs:
-                    apply_routes.append((ib_child_name, route6_data))
-            if utils.diff(ib_child_rule_path, rule_data):
-                update_files[ib_child_rule_path] = rule_data
-                if ib_child_name not in restart_ib_childs:
-                    apply_rules.append((ib_child_name, rule_data))
-
-        if self.vpp_interface_data or self.vpp_bond_data:
-            vpp_path = self.root_dir + vpp_config_path()
-            vpp_config = utils.generate_vpp_config(vpp_path, vpp_interfaces,
-                                                   vpp_bonds)
-            if utils.diff(vpp_path, vpp_config):
-                restart_vpp = True
-                update_files[vpp_path] = vpp_config
-            else:
-                logger.info('No changes required for VPP')
-
-        if cleanup:
-            for ifcfg_file in glob.iglob(cleanup_pattern()):
-                if ifcfg_file not in all_file_names:
-                    interface_name = ifcfg_file[len(cleanup_pattern()) - 1:]
-                    if interface_name != 'lo':
-                        logger.info('cleaning up interface: %s'
-                                    % interface_name)
-                        self.ifdown(interface_name)
-                        self.remove_config(ifcfg_file)
-
-        if activate:
-            for interface in apply_interfaces:
-                logger.debug('Running ip commands on interface: %s' %
-                             interface[0])
-                commands = self.iproute2_apply_commands(interface[0],
-                                                        interface[1],
-                                                        interface[2])
-                for command in commands:
-                    try:
-                        args = command.split()
-                        self.execute('Running ip %s' % command, ipcmd, *args)
-                    except Exception as e:
-                        logger.warning("Error in 'ip %s', restarting %s:\n%s" %
-                                       (command, interface[0], str(e)))
-                        restart_interfaces.append(interface[0])
-                        restart_interfaces.extend(
-                            self.child_members(interface[0]))
-                        break
-
-                commands = self.ethtool_apply_command(interface[0],
-                                                      interface[1],
-                                                      interface[2])
-                if commands is not None:
-                    for command in commands:
-                        try:
-                            args = command.split()
-                            args = [interface[0]
-                                    if item in ["${DEVICE}", "$DEVICE"]
-                                    else item for item in args]
-                            self.execute('Running ethtool %s' % command,
-                                         ethtoolcmd, *args)
-                        except Exception as e:
-                            logger.warning("Error in 'ethtool %s', restarting %s:\
-                                           \n%s)" %
-                                           (command, interface[0], str(e)))
-                            restart_interfaces.append(interface[0])
-                            restart_interfaces.extend(
-                                self.child_members(interface[0]))
-                            break
-
-            for bridge in apply_bridges:
-                logger.debug('Running ip commands on bridge: %s' %
-                             bridge[0])
-                commands = self.iproute2_apply_commands(bridge[0],
-                                                        bridge[1],
-                                                        bridge[2])
-                for command in commands:
-                    try:
-                        args = command.split()
-                        self.execute('Running ip %s' % command, ipcmd, *args)
-                    except Exception as e:
-                        logger.warning("Error in 'ip %s', restarting %s:\n%s" %
-                                       (command, bridge[0], str(e)))
-                        restart_bridges.append(bridge[0])
-                        restart_interfaces.extend(
-                            self.child_members(bridge[0]))
-                        break
-
-            for interface in apply_routes:
-                logger.debug('Applying routes for interface %s' % interface[0])
-                filename = self.root_dir + route_config_path(interface[0])
-                commands = self.iproute2_route_commands(filename, interface[1])
-                for command in commands:
-                    args = command.split()
-                    try:
-                        if len(args) > 0:
-                            self.execute('Running ip %s' % command, ipcmd,
-                                         *args)
-                    except Exception as e:
-                        logger.warning("Error in 'ip %s', restarting %s:\n%s" %
-                                       (command, interface[0], str(e)))
-                        restart_interfaces.append(interface[0])
-                        restart_interfaces.extend(
-                            self.child_members(interface[0]))
-                        break
-
-            for interface in apply_rules:
-                logger.debug('Applying rules for interface %s' % interface[0])
-                filename = self.root_dir + route_rule_config_path(interface[0])
-                commands = self.iproute2_rule_commands(filename, interface[1])
-                for command in commands:
-                    args = command.split()
-                    try:
-                        if len(args) > 0:
-                            self.execute('Running ip %s' % command, ipcmd,
-                                         *args)
-                    except Exception as e:
-                        logger.warning("Error in 'ip %s', restarting %s:\n%s" %
-                                       (command, interface[0], str(e)))
-                        restart_interfaces.append(interface[0])
-                        restart_interfaces.extend(
-                            self.child_members(interface[0]))
-                        break
-
-            for vlan in restart_vlans:
-                self.ifdown(vlan)
-
-            for ib_child in restart_ib_childs:
-                self.ifdown(ib_child)
-
-            for interface in restart_interfaces:
-                self.ifdown(interface)
-                for bond in linux_bond_children:
-                    if interface in linux_bond_children[bond]:
-                        if bond not in restart_linux_bonds:
-                            start_linux_bonds.append(bond)
-
-            for linux_bond in restart_linux_bonds:
-                self.ifdown(linux_bond)
-
-            for linux_team in restart_linux_teams:
-                self.ifdown(linux_team)
-
-            for bridge in restart_bridges:
-                self.ifdown(bridge, iftype='bridge')
-
-            for vpp_interface in vpp_interfaces:
-                self.ifdown(vpp_interface.name)
-
-            for oldname, newname in self.renamed_interfaces.items():
-                self.ifrename(oldname, newname)
-
-            # DPDK initialization is done before running os-net-config, to make
-            # the DPDK ports available when enabled. DPDK Hotplug support is
-            # supported only in OvS 2.7 version. Until then, OvS needs to be
-            # restarted after adding a DPDK port. This change will be removed
-            # on migration to OvS 2.7 where DPDK Hotplug support is available.
-            if ovs_needs_restart:
-                msg = "Restart openvswitch"
-                self.execute(msg, '/usr/bin/systemctl',
-                             'restart', 'openvswitch')
-
-        for location, data in update_files.items():
-            self.write_config(location, data)
+                    logger.info('No changes required for VPP')
+
+            if cleanup:
+                for ifcfg_file in glob.iglob(cleanup_pattern()):
+                    if ifcfg_file not in all_file_names:
+                        interface_name = \
+                            ifcfg_file[len(cleanup_pattern()) - 1:]
+                        if interface_name != 'lo':
+                            logger.info('cleaning up interface: %s'
+                                        % interface_name)
+                            self.ifdown(interface_name)
+                            self.remove_config(ifcfg_file)
+
+            if activate:
+                # The ip commands of each phase are run in a single batch
+                ip_commands = []
+                for interface in apply_interfaces:
+                    logger.debug('Running ip commands on interface: %s' %
+                                 interface[0])
+                    commands = self.iproute2_apply_commands(interface[0],
+                                                            interface[1],
+                                                            interface[2])
+                    ip_commands.extend((interface[0], command)
+                                       for command in commands)
+                for name in self.iproute2_batch(ipcmd, ip_commands):
+                    restart_interfaces.add(name)
+                    restart_interfaces.update(self.child_members(name))
+
+                for interface in apply_interfaces:
+                    commands = self.ethtool_apply_command(interface[0],
+                                                          interface[1],
+                                                          interface[2])
+                    if commands is not None:
+                        for command in commands:
+                            try:
+                                args = command.split()
+                                args = [interface[0]
+                                        if item in ["${DEVICE}", "$DEVICE"]
+                                        else item for item in args]
+                                self.execute('Running ethtool %s' % command,
+                                             ethtoolcmd, *args)
+                            except Exception as e:
+                                logger.warning("Error in 'ethtool %s', "
+                                               "restarting %s:\n%s)" %
+                                               (command, interface[0], str(e)))
+                                restart_interfaces.add(interface[0])
+                                restart_interfaces.update(
+                                    self.child_members(interface[0]))
+                                break
+
+                # The OVS_EXTRA changes are applied as one ovs-vsctl
+                # transaction
+                ovs_commands = []
+                for interface in itertools.chain(apply_interfaces,
+                                                 apply_bridges):
+                    commands = self.ovs_vsctl_apply_commands(interface[0],
+                                                             interface[1],
+                                                             interface[2])
+                    ovs_commands.extend((interface[0], command)
+                                        for command in commands)
+                failed = self.ovs_vsctl_transaction(ovs_commands)
+                for name in failed:
+                    if name in self.bridge_data or \
+                            name in self.linuxbridge_data:
+                        restart_bridges.add(name)
+                    else:
+                        restart_interfaces.add(name)
+                    restart_interfaces.update(self.child_members(name))
+                # Spread the rx queues of the tuned DPDK ports over the PMD
+                # threads, once for all of them
+                if any(_RXQ_SETTINGS.search(' '.join(command))
+                       for name, command in ovs_commands
+                       if name not in failed):
+                    self.ovs_appctl('dpif-netdev/pmd-rxq-rebalance')
+
+                resolv_path = self.root_dir + resolv_conf_path()
+                resolv_data = self.get_file_data(resolv_path)
+                new_resolv_data = resolv_data
+                for interface in itertools.chain(apply_interfaces,
+                                                 apply_bridges):
+                    new_resolv_data = self.resolv_conf_data(
+                        new_resolv_data,
+                        self.get_ifcfg_values(
+                            self.get_file_data(interface[1])),
+                        self.get_ifcfg_values(interface[2]))
+                if new_resolv_data != resolv_data:
+                    self.write_config(resolv_path, new_resolv_data)
+
+                ip_commands = []
+                for bridge in apply_bridges:
+                    logger.debug('Running ip commands on bridge: %s' %
+                                 bridge[0])
+                    commands = self.iproute2_apply_commands(bridge[0],
+                                                            bridge[1],
+                                                            bridge[2])
+                    ip_commands.extend((bridge[0], command)
+                                       for command in commands)
+                for name in self.iproute2_batch(ipcmd, ip_commands):
+                    restart_bridges.add(name)
+                    restart_interfaces.update(self.child_members(name))
+
+                ip_commands = []
+                for interface in apply_routes:
+                    logger.debug('Applying routes for interface %s' %
+                                 interface[0])
+                    filename = self.root_dir + route_config_path(interface[0])
+                    commands = self.iproute2_route_commands(filename,
+                                                            interface[1])
+                    ip_commands.extend((interface[0], command)
+                                       for command in commands)
+                for name in self.iproute2_batch(ipcmd, ip_commands):
+                    restart_interfaces.add(name)
+                    restart_interfaces.update(self.child_members(name))
+
+                ip_commands = []
+                for interface in apply_rules:
+                    logger.debug('Applying rules for interface %s' %
+                                 interface[0])
+                    filename = self.root_dir + \
+                        route_rule_config_path(interface[0])
+                    commands = self.iproute2_rule_commands(filename,
+                                                           interface[1])
+                    ip_commands.extend((interface[0], command)
+                                       for command in commands)
+                for name in self.iproute2_batch(ipcmd, ip_commands):
+                    restart_interfaces.add(name)
+                    restart_interfaces.update(self.child_members(name))
+
+                for interface in restart_interfaces:
+                    for bond in sorted(self.member_masters(interface)):
+                        if bond in linux_bond_children and \
+                                bond not in restart_linux_bonds:
+                            start_linux_bonds.add(bond)
+                parents = self.restart_dependencies(linux_bond_children)
+                levels = self.restart_levels(
+                    [(name, 'interface') for name in itertools.chain(
+                        restart_linux_teams, restart_interfaces,
+                        restart_linux_bonds, start_linux_bonds)
+                     if name not in dpdk_hotplugs] +
+                    [(bridge, 'bridge') for bridge in restart_bridges],
+                    parents)
+                # The ib childs and the vlans come up last, once the active
+                # OVS bond members are set and ivs and nfvswitch are attached
+                child_levels = self.restart_levels(
+                    [(name, 'interface') for name in itertools.chain(
+                        restart_ib_childs, restart_vlans)], parents)
+                # Bonds only started for their restarted members stay up
+                keep_up = set(start_linux_bonds) - set(restart_interfaces)
+                down_levels = [[(name, iftype) for name, iftype in level
+                                if name not in keep_up]
+                               for level in reversed(levels + child_levels)]
+                self.run_restarts(self.ifdown, down_levels)
+
+                for vpp_interface in vpp_interfaces:
+                    self.ifdown(vpp_interface.name)
+
+                for oldname, newname in self.renamed_interfaces.items():
+                    self.ifrename(oldname, newname)
+
+                # DPDK initialization is done before running os-net-config, to
+                # make the DPDK ports available when enabled. Since OvS 2.7 the
+                # DPDK ports are hotplugged, restarting OvS after adding a DPDK
+                # port is only done on request.
+                if ovs_needs_restart:
+                    msg = "Restart openvswitch"
+                    self.execute(msg, '/usr/bin/systemctl',
+                                 'restart', 'openvswitch')
+
+            for location, data in update_files.items():
+                self.write_config(location, data)
+        finally:
+            self.file_snapshot = None
+            self.member_closure = None
 
         if self.route_table_data:
             location = route_table_config_path()
@@ -1944,12 +2242,6 @@ class IfcfgNetConfig(os_net_config.NetConfig):
                              'restart', 'nfvswitch')
 
         if activate:
-            for linux_team in restart_linux_teams:
-                self.ifup(linux_team)
-
-            for bridge in restart_bridges:
-                self.ifup(bridge, iftype='bridge')
-
             # If dhclient is running and dhcp not set, stop dhclient
             for interface in stop_dhclient_interfaces:
                 logger.debug("Calling stop_dhclient_interfaces() for %s" %
@@ -1957,15 +2249,21 @@ class IfcfgNetConfig(os_net_config.NetConfig):
                 if not self.noop:
                     stop_dhclient_process(interface)
 
-            for interface in restart_interfaces:
-                self.ifup(interface)
-
-            for linux_bond in start_linux_bonds:
-                if linux_bond not in restart_linux_bonds:
-                    restart_linux_bonds.append(linux_bond)
-
-            for linux_bond in restart_linux_bonds:
-                self.ifup(linux_bond)
+            self.run_restarts(self.ifup, levels)
+
+            # The DPDK ports and bonds are (re)created in one transaction,
+            # once their bridges are up
+            ovs_commands = []
+            for name in dpdk_hotplugs:
+                commands = self.ovs_dpdk_hotplug_commands(
+                    self.get_ifcfg_values(self.interface_data[name]))
+                ovs_commands.extend((name, command) for command in commands)
+            for name in self.ovs_vsctl_transaction(ovs_commands):
+                self.ifup(name)
+            # The rx queues of the new DPDK ports are spread over the PMD
+            # threads too
+            if ovs_commands:
+                self.ovs_appctl('dpif-netdev/pmd-rxq-rebalance')
 
             for bond in self.bond_primary_ifaces:
                 self.ovs_appctl('bond/set-active-slave', bond,
@@ -1991,11 +2289,7 @@ class IfcfgNetConfig(os_net_config.NetConfig):
                 for nfvswitch_internal in nfvswitch_internal_ifaces:
                     self.ifup(nfvswitch_internal)
 
-            for ib_child in restart_ib_childs:
-                self.ifup(ib_child)
-
-            for vlan in restart_vlans:
-                self.ifup(vlan)
+            self.run_restarts(self.ifup, child_levels)
 
             if not self.noop:
                 if restart_vpp:
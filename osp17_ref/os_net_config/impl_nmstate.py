@@ -14,8 +14,17 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+from concurrent import futures
+import copy
+import functools
+import hashlib
+import itertools
+import json
+from libnmstate import gen_conf
 from libnmstate import netapplier
 from libnmstate import netinfo
+from libnmstate.schema import Bond
+from libnmstate.schema import BondMode
 from libnmstate.schema import DNS
 from libnmstate.schema import Ethernet
 from libnmstate.schema import Interface
@@ -23,13 +32,25 @@ from libnmstate.schema import InterfaceIPv4
 from libnmstate.schema import InterfaceIPv6
 from libnmstate.schema import InterfaceState
 from libnmstate.schema import InterfaceType
+from libnmstate.schema import OVSBridge
+from libnmstate.schema import OVSInterface
+from libnmstate.schema import OvsDB
+from libnmstate.schema import Route as NMRoute
+from libnmstate.schema import RouteRule as NMRouteRule
+from libnmstate.schema import VLAN
 import logging
 import netaddr
+import os
+from oslo_concurrency import processutils
 import re
+import sys
+import time
 import yaml
 
 import os_net_config
+from os_net_config import common
 from os_net_config import objects
+from os_net_config import utils
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +61,147 @@ netconfig = os_net_config.NetConfig()
 IPV4_DEFAULT_GATEWAY_DESTINATION = "0.0.0.0/0"
 IPV6_DEFAULT_GATEWAY_DESTINATION = "::/0"
 
+# The ovs_extra settings translated into nmstate, by ovs-vsctl table. Each
+# setting maps to its path in the nmstate state of the bridge, the interface
+# or the bridge port.
+_OVS_EXTRA_BRIDGE = {
+    'fail_mode': [OVSBridge.CONFIG_SUBTREE, OVSBridge.OPTIONS_SUBTREE,
+                  OVSBridge.Options.FAIL_MODE],
+    'mcast_snooping_enable': [OVSBridge.CONFIG_SUBTREE,
+                              OVSBridge.OPTIONS_SUBTREE,
+                              OVSBridge.Options.MCAST_SNOOPING_ENABLED],
+    'rstp_enable': [OVSBridge.CONFIG_SUBTREE, OVSBridge.OPTIONS_SUBTREE,
+                    OVSBridge.Options.RSTP],
+    'stp_enable': [OVSBridge.CONFIG_SUBTREE, OVSBridge.OPTIONS_SUBTREE,
+                   OVSBridge.Options.STP]}
+_OVS_EXTRA_INTERFACE = {
+    'mtu_request': [Interface.MTU],
+    'options:n_rxq': [OVSInterface.DPDK_CONFIG_SUBTREE,
+                      OVSInterface.Dpdk.RX_QUEUE],
+    'options:n_rxq_desc': [OVSInterface.DPDK_CONFIG_SUBTREE,
+                           OVSInterface.Dpdk.N_RXQ_DESC],
+    'options:n_txq_desc': [OVSInterface.DPDK_CONFIG_SUBTREE,
+                           OVSInterface.Dpdk.N_TXQ_DESC]}
+_OVS_EXTRA_PORT = {
+    'tag': [OVSBridge.Port.VLAN_SUBTREE, OVSBridge.Port.Vlan.TAG]}
+
+# Hashes of the desired state of the interfaces last applied successfully
+FINGERPRINT_FILE = '/var/lib/os-net-config/nmstate_fingerprints.json'
+
+# Where the NetworkManager keyfiles are generated in offline mode
+KEYFILE_DIR = '/etc/NetworkManager/system-connections'
+
+# The full desired state of the last runtime only apply, made persistent
+# by persist()
+RUNTIME_STATE_FILE = '/var/lib/os-net-config/nmstate_runtime_state.json'
+
+# Seconds a connectivity probe waits for a reply before the checkpoint of
+# the applied config is rolled back
+PROBE_TIMEOUT = 2
+
+# Deferred verification of the applied config, in seconds: the first delay
+# before reading the running config again, the longest delay between two
+# reads and the total deadline
+VERIFY_INITIAL_DELAY = 0.5
+VERIFY_MAX_DELAY = 5
+VERIFY_TIMEOUT = 30
+
+# Where the config handled by the provider is dumped. Any other value is
+# taken as the path of a file the dumps are appended to.
+DUMP_SINK_LOG = 'log'
+DUMP_SINK_STDERR = 'stderr'
+DUMP_SINK_NONE = 'none'
+
+
+def probe_address(address, timeout=PROBE_TIMEOUT):
+    """Check that an address replies to ping.
+
+    :param address: the IPv4 or IPv6 address to probe
+    :param timeout: seconds to wait for the reply
+    :returns: True if the address replied
+    """
+    try:
+        processutils.execute('ping', '-c', '1', '-W', str(timeout), address)
+    except processutils.ProcessExecutionError:
+        return False
+    return True
+
+
+def route_table_config_path():
+    return "/etc/iproute2/rt_tables"
+
+
+def _get_type_value(str_val):
+    if isinstance(str_val, str) and str_val.isdigit():
+        return int(str_val)
+    return _convert_to_bool(str_val)
+
+
+def get_route_options(route_options, key):
+    """Return the value of a key in the route options, e.g. metric 100."""
+    items = route_options.split()
+    for index, item in enumerate(items[:-1]):
+        if item == key:
+            return _get_type_value(items[index + 1])
+
+
+def parse_bonding_options(bond_options_str):
+    """Parse the bonding options given as key=value pairs into a dict."""
+    bond_options = {}
+    for option in (bond_options_str or '').split():
+        if '=' in option:
+            key, value = option.split('=', 1)
+            bond_options[key] = _get_type_value(value)
+    return bond_options
+
+
+def set_linux_bonding_options(bond_options, primary_iface=None):
+    """Build the nmstate link aggregation subtree of a linux bond.
+
+    :param bond_options: dict of the bonding options
+    :param primary_iface: name of the primary member of the bond
+    :returns: dict of the link aggregation subtree
+    """
+    bond_options = dict(bond_options)
+    bond_data = {Bond.MODE: bond_options.pop('mode', BondMode.ACTIVE_BACKUP),
+                 Bond.PORT: []}
+    if primary_iface and bond_data[Bond.MODE] == BondMode.ACTIVE_BACKUP:
+        bond_options.setdefault('primary', primary_iface)
+    if bond_options:
+        bond_data[Bond.OPTIONS_SUBTREE] = bond_options
+    return bond_data
+
+
+def set_ovs_bonding_options(bond_options):
+    """Build the nmstate link aggregation subtree of an OVS bond port.
+
+    :param bond_options: dict of the ovs_options of the bond
+    :returns: dict of the link aggregation subtree
+    """
+    LinkAggregation = OVSBridge.Port.LinkAggregation
+    bond_data = {LinkAggregation.MODE: LinkAggregation.Mode.ACTIVE_BACKUP,
+                 LinkAggregation.PORT_SUBTREE: []}
+    if 'bond_mode' in bond_options:
+        bond_data[LinkAggregation.MODE] = bond_options['bond_mode']
+    elif bond_options.get('lacp') == 'active':
+        bond_data[LinkAggregation.MODE] = LinkAggregation.Mode.LACP
+    if 'bond_updelay' in bond_options:
+        bond_data[LinkAggregation.Options.UP_DELAY] = \
+            bond_options['bond_updelay']
+
+    other_config = {}
+    for key, value in bond_options.items():
+        m = re.match(r'^other[_-]config:(.+)$', key)
+        if m:
+            other_config[m.group(1)] = value
+    if other_config:
+        bond_data[OvsDB.KEY] = {OvsDB.OTHER_CONFIG: other_config}
+    return bond_data
+
+
+def _is_any_ip_addr(address):
+    return address.lower() in ['any', 'all']
+
 
 def _convert_to_bool(value):
     if isinstance(value, str):
@@ -50,115 +212,788 @@ def _convert_to_bool(value):
     return value
 
 
+# Keys whose values are integers, though they may be given as strings
+_INT_KEYS = frozenset(['mtu', 'prefix-length', 'id', 'metric', 'table-id',
+                       'priority', 'route-table', 'total-vfs', 'max-tx-rate',
+                       'min-tx-rate', 'qos', 'vlan-id'])
+# Keys whose values are MAC addresses
+_MAC_KEYS = frozenset(['mac-address', 'permanent-mac-address'])
+# Keys whose values are IP addresses or networks
+_IP_KEYS = frozenset(['ip', 'destination', 'next-hop-address', 'ip-from',
+                      'ip-to'])
+# Lists which shall match the running config exactly rather than being a
+# subset of it, since nmstate removes the entries that are not desired.
+_EXACT_LISTS = frozenset(['address'])
+
+
+def _normalize_ip(value):
+    try:
+        if '/' in value:
+            return str(netaddr.IPNetwork(value).cidr)
+        return str(netaddr.IPAddress(value))
+    except (netaddr.AddrFormatError, TypeError, ValueError):
+        return value
+
+
+def _normalize_value(key, value):
+    """Return the canonical form of a scalar value of the state."""
+    value = _convert_to_bool(value)
+    if isinstance(value, str):
+        if key in _INT_KEYS and value.isdigit():
+            return int(value)
+        if key in _MAC_KEYS:
+            return value.upper()
+        if key in _IP_KEYS:
+            return _normalize_ip(value)
+    return value
+
+
+def _normalize_address(address):
+    """Split an address given as ip/prefix into ip and prefix-length."""
+    ip = address.get(InterfaceIPv4.ADDRESS_IP)
+    if isinstance(ip, str) and '/' in ip and \
+       InterfaceIPv4.ADDRESS_PREFIX_LENGTH not in address:
+        address = dict(address)
+        ip, prefix = ip.split('/', 1)
+        address[InterfaceIPv4.ADDRESS_IP] = ip
+        address[InterfaceIPv4.ADDRESS_PREFIX_LENGTH] = prefix
+    return address
+
+
+def normalize_state(value, key=None):
+    """Return the canonical form of a running or desired state.
+
+    Booleans given as strings, integers given as strings, MAC addresses,
+    IP addresses and prefix lengths are normalized so that equal config
+    compares equal regardless of how it was written.
+    :param value: the state or a part of it
+    :param key: the key under which the value is found
+    :returns: the canonical copy of the value
+    """
+    if isinstance(value, dict):
+        if key == InterfaceIPv4.ADDRESS:
+            value = _normalize_address(value)
+        return {k: normalize_state(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_state(item, key) for item in value]
+    return _normalize_value(key, value)
+
+
+def _hashable(value):
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _list_diff(running, desired, exact):
+    """Check if the desired list is satisfied by the running list.
+
+    The lists are compared as sets. Dict items of the desired list are
+    matched against the running items projected onto the same keys, so
+    the additional keys reported by nmstate do not cause a mismatch.
+    :returns: True if the lists differ
+    """
+    if not isinstance(running, list):
+        return True
+    running_items = set(map(_hashable, running))
+    desired_items = set()
+    projections = {}
+    for item in desired:
+        desired_items.add(_hashable(item))
+        if isinstance(item, dict):
+            keys = frozenset(item)
+            if keys not in projections:
+                projections[keys] = set(
+                    _hashable({k: r[k] for k in keys if k in r})
+                    for r in running if isinstance(r, dict))
+            if _hashable(item) not in projections[keys]:
+                return True
+        elif _hashable(item) not in running_items:
+            return True
+    if exact:
+        return len(running_items) != len(desired_items)
+    return False
+
+
+def _state_diff(running, desired, path, changed):
+    for key, value in desired.items():
+        key_path = f"{path}.{key}" if path else key
+        if not isinstance(running, dict) or key not in running:
+            changed.add(key_path)
+        elif isinstance(value, dict):
+            _state_diff(running[key], value, key_path, changed)
+        elif isinstance(value, list):
+            if _list_diff(running[key], value, key in _EXACT_LISTS):
+                changed.add(key_path)
+        elif value != running[key]:
+            changed.add(key_path)
+
+
+def state_diff(running, desired):
+    """Find the parts of the desired state missing from the running state.
+
+    Both states are normalized first. The running state may hold more than
+    the desired state, except for the lists that must match exactly, like
+    the IP addresses.
+    :param running: the running state of an interface, or None
+    :param desired: the desired state of the interface
+    :returns: set of the dotted paths of the desired state that differ,
+              e.g. {'ipv4.address', 'mtu'}
+    """
+    if not desired:
+        return set()
+    if not running:
+        return set(desired)
+    changed = set()
+    _state_diff(normalize_state(running), normalize_state(desired), '',
+                changed)
+    return changed
+
+
+def _overlapping_paths(paths, other_paths):
+    """Return the paths equal to, above or below any of the other paths."""
+    return {path for path in paths
+            if any(other == path or other.startswith(path + '.') or
+                   path.startswith(other + '.') for other in other_paths)}
+
+
+def partial_iface_state(iface_data, changed):
+    """Return the part of the interface state that has to be applied.
+
+    Only the top level subtrees holding a changed path are kept, along with
+    the keys nmstate needs to identify the interface.
+    :param iface_data: the desired state of the interface
+    :param changed: set of the changed paths as returned by state_diff
+    :returns: the partial desired state of the interface
+    """
+    keys = set([Interface.NAME, Interface.TYPE, Interface.STATE])
+    keys.update(path.split('.', 1)[0] for path in changed)
+    return {key: value for key, value in iface_data.items() if key in keys}
+
+
+def _project(item, keys):
+    return _hashable(normalize_state({k: item[k] for k in keys if k in item}))
+
+
+def _missing_items(running, desired):
+    """Return the desired items missing from the running list.
+
+    The items are dicts, and each desired item is matched against the
+    running items projected onto its own keys, so the additional keys
+    reported by nmstate do not cause a mismatch.
+    """
+    missing = []
+    projections = {}
+    for item in desired:
+        keys = frozenset(item)
+        if keys not in projections:
+            projections[keys] = set(_project(r, keys) for r in running)
+        if _project(item, keys) not in projections[keys]:
+            missing.append(item)
+    return missing
+
+
+def _unwanted_items(running, desired):
+    """Return the running items that match none of the desired items."""
+    groups = {}
+    for item in desired:
+        groups.setdefault(frozenset(item), set()).add(_project(item, item))
+    return [r for r in running
+            if not any(keys <= set(r) and _project(r, keys) in items
+                       for keys, items in groups.items())]
+
+
+def iface_key(iface):
+    """Return the key of an interface in the desired or running state.
+
+    The internal interface of an OVS bridge has the name of the bridge, so
+    the ovs interfaces are told apart by their type.
+    """
+    name = iface[Interface.NAME]
+    if iface.get(Interface.TYPE) == InterfaceType.OVS_INTERFACE:
+        return f"{name}:{InterfaceType.OVS_INTERFACE}"
+    return name
+
+
+def state_fingerprint(iface_data):
+    """Return a stable hash of the desired state of an interface."""
+    return hashlib.sha256(
+        _hashable(normalize_state(iface_data)).encode('utf-8')).hexdigest()
+
+
 def is_dict_subset(superset, subset):
     """Check to see if one dict is a subset of another dict."""
-
     if superset == subset:
         return True
-    if superset and subset:
-        for key, value in subset.items():
-            if key not in superset:
-                return False
-            if isinstance(value, dict):
-                if not is_dict_subset(superset[key], value):
-                    return False
-            elif isinstance(value, int):
-                if value != superset[key]:
-                    return False
-            elif isinstance(value, str):
-                if value != superset[key]:
-                    return False
-            elif isinstance(value, list):
-                try:
-                    if not set(value) <= set(superset[key]):
-                        return False
-                except TypeError:
-                    for item in value:
-                        if item not in superset[key]:
-                            return False
-            elif isinstance(value, set):
-                if not value <= superset[key]:
-                    return False
-            else:
-                if not value == superset[key]:
-                    return False
-        return True
-    return False
+    if not superset or not subset:
+        return False
+    return not state_diff(superset, subset)
+
+
+class RunningState(object):
+    """Snapshot of the nmstate running config, indexed by iface_key().
+
+    Querying nmstate dumps the state of the whole host, so a snapshot is
+    taken once and all the per-interface lookups are served from it.
+    """
+
+    def __init__(self):
+        self.state = {}
+        self.ifaces = {}
+        self.refresh()
+
+    def refresh(self):
+        """Read the running config again from nmstate."""
+        self.state = netinfo.show_running_config()
+        self.ifaces = {}
+        for iface in self.state.get(Interface.KEY, []):
+            if Interface.NAME in iface:
+                self.ifaces[iface_key(iface)] = iface
+
+    def iface(self, key):
+        """Return the running config of the interface, or None.
+
+        :param key: the iface_key() of the interface
+        """
+        return self.ifaces.get(key)
+
+    def all_ifaces(self):
+        """Return the running config of all the interfaces."""
+        return self.state.get(Interface.KEY, [])
+
+    def dns(self):
+        """Return the running DNS config, or an empty dict."""
+        return self.state.get(DNS.KEY, {}).get(DNS.CONFIG) or {}
+
+    def routes(self):
+        """Return the running route config."""
+        return self.state.get(NMRoute.KEY, {}).get(NMRoute.CONFIG) or []
+
+    def rules(self):
+        """Return the running route rule config."""
+        return self.state.get(NMRouteRule.KEY, {}).get(
+            NMRouteRule.CONFIG) or []
 
 
 class NmstateNetConfig(os_net_config.NetConfig):
     """Configure network interfaces using NetworkManager via nmstate API."""
 
-    def __init__(self, noop=False, root_dir=''):
+    def __init__(self, noop=False, root_dir='', partial_state=False,
+                 dump_sink=DUMP_SINK_LOG, force_full_reconcile=False,
+                 rollback_timeout=None, deferred_verify=False,
+                 verify_timeout=VERIFY_TIMEOUT, runtime_only=False,
+                 offline=False, probe_dns=False):
         super(NmstateNetConfig, self).__init__(noop, root_dir)
+        self.partial_state = partial_state
+        self.dump_sink = dump_sink
+        self.force_full_reconcile = force_full_reconcile
+        self.rollback_timeout = rollback_timeout
+        self.deferred_verify = deferred_verify
+        self.verify_timeout = verify_timeout
+        self.runtime_only = runtime_only
+        self.offline = offline
+        self.probe_dns = probe_dns
+        self.fingerprint_file = root_dir + FINGERPRINT_FILE
+        self.runtime_state_file = root_dir + RUNTIME_STATE_FILE
         self.interface_data = {}
+        self.vlan_data = {}
+        self.bridge_data = {}
+        self.linuxbond_data = {}
+        self.route_data = {}
+        self.rules_data = []
+        self.route_table_data = {}
+        self.route_tables = None
         self.dns_data = {'server': [], 'domain': []}
+        self.sriov_vf_data = {}
+        self.running_state = None
         logger.info('nmstate net config provider created.')
 
     def __dump_config(self, config, msg="Applying config"):
+        """Dump the config to the dump sink.
+
+        The config is only serialized when the sink is going to use it, so
+        that large states are not dumped to be thrown away.
+        """
+        if self.dump_sink == DUMP_SINK_NONE:
+            return
+        if self.dump_sink == DUMP_SINK_LOG and \
+           not logger.isEnabledFor(logging.DEBUG):
+            return
         cfg_dump = yaml.dump(config, default_flow_style=False,
                              allow_unicode=True, encoding=None)
-        logger.debug("----------------------------")
-        logger.debug(f"{msg}\n{cfg_dump}")
+        if self.dump_sink == DUMP_SINK_LOG:
+            logger.debug("----------------------------")
+            logger.debug(f"{msg}\n{cfg_dump}")
+        elif self.dump_sink == DUMP_SINK_STDERR:
+            sys.stderr.write(f"----------------------------\n{msg}\n"
+                             f"{cfg_dump}")
+        else:
+            with open(self.dump_sink, 'a') as f:
+                f.write(f"----------------------------\n{msg}\n{cfg_dump}")
+
+    def get_running_state(self, refresh=False):
+        """Return the snapshot of the running config.
+
+        The snapshot is taken on first use and reused afterwards.
+        :param refresh: read the running config again from nmstate, e.g.
+                        after a transaction has been applied.
+        :returns: RunningState object
+        """
+        if self.running_state is None:
+            self.running_state = RunningState()
+        elif refresh:
+            self.running_state.refresh()
+        return self.running_state
 
     def iface_state(self, name=''):
         """Return the current interface state according to nmstate.
 
         Return the current state of all interfaces, or the named interface.
-        :param name: name of the interface to return state, otherwise all.
+        :param name: iface_key() of the interface to return state, otherwise
+                     all.
         :returns: list state of all interfaces when name is not specified, or
                   the state of the specific interface when name is specified
         """
-        ifaces = netinfo.show_running_config()[Interface.KEY]
+        running_state = self.get_running_state()
         if name != '':
-            for iface in ifaces:
-                if iface[Interface.NAME] != name:
-                    continue
+            iface = running_state.iface(name)
+            if iface is not None:
                 self.__dump_config(iface, msg=f"Running config for {name}")
-                return iface
+            return iface
         else:
+            ifaces = running_state.all_ifaces()
             self.__dump_config(ifaces,
                                msg=f"Running config for all interfaces")
             return ifaces
 
-    def cleanup_all_ifaces(self, exclude_nics=[]):
+    def route_state(self, name=''):
+        """Return the current routes according to nmstate.
+
+        :param name: name of the interface to return routes, otherwise all.
+        :returns: list of the routes of all interfaces, or of the named one
+        """
+        routes = self.get_running_state().routes()
+        if name != '':
+            routes = [route for route in routes
+                      if route.get(NMRoute.NEXT_HOP_INTERFACE) == name]
+        return routes
+
+    def rule_state(self):
+        """Return the current route rules according to nmstate.
+
+        :returns: list of all the route rules
+        """
+        return self.get_running_state().rules()
 
-        exclude_nics.extend(['lo'])
-        ifaces = netinfo.show_running_config()[Interface.KEY]
+    def read_fingerprints(self):
+        """Read the hashes of the interfaces last applied successfully.
 
-        for iface in ifaces:
+        :returns: dict of interface name to the hash of its desired state
+        """
+        data = common.get_file_data(self.fingerprint_file)
+        if not data:
+            return {}
+        try:
+            return json.loads(data)
+        except ValueError:
+            logger.warning(f"Ignoring invalid {self.fingerprint_file}")
+            return {}
+
+    def write_fingerprints(self, fingerprints):
+        """Store the hashes of the interfaces applied successfully.
+
+        :param fingerprints: dict of interface name to the hash of its
+                             desired state
+        """
+        os.makedirs(os.path.dirname(self.fingerprint_file), exist_ok=True)
+        with open(self.fingerprint_file, 'w') as f:
+            json.dump(fingerprints, f, indent=2, sort_keys=True)
+
+    def full_state(self):
+        """Return the whole desired state, regardless of the running one."""
+        return {Interface.KEY: [data for _, data in self._all_iface_data()],
+                NMRoute.KEY: {NMRoute.CONFIG: list(itertools.chain(
+                    *self.route_data.values()))},
+                NMRouteRule.KEY: {NMRouteRule.CONFIG: [
+                    rule for rule in self.rules_data
+                    if NMRouteRule.STATE not in rule]},
+                DNS.KEY: {DNS.CONFIG: self.dns_config()}}
+
+    def write_keyfiles(self):
+        """Generate the NetworkManager keyfiles of the desired state.
+
+        Used in offline mode, e.g. to build images: the keyfiles are
+        written under root_dir and neither NetworkManager nor the running
+        config are used.
+        :returns: a dict of the format: filename/data for each keyfile
+            that was changed (or would be changed if in --noop mode).
+        """
+        state = self.full_state()
+        self.__dump_config(state, msg="Generating keyfiles")
+        configs = gen_conf.generate_configurations(state)
+        keyfile_dir = self.root_dir + KEYFILE_DIR
+        updated_files = {}
+        for file_name, content in configs.get('NetworkManager', []):
+            path = os.path.join(keyfile_dir, file_name)
+            if common.get_file_data(path) == content:
+                logger.info('No changes required for keyfile: %s' % path)
+                continue
+            updated_files[path] = content
+            if self.noop:
+                continue
+            logger.info('Writing keyfile: %s' % path)
+            os.makedirs(keyfile_dir, exist_ok=True)
+            # NetworkManager ignores the keyfiles readable by other users
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.chmod(path, 0o600)
+        return updated_files
+
+    def write_runtime_state(self, fingerprints):
+        """Store the full desired state of a runtime only apply.
+
+        :param fingerprints: dict of interface name to the hash of its
+                             desired state, written by persist()
+        """
+        state = self.full_state()
+        os.makedirs(os.path.dirname(self.runtime_state_file), exist_ok=True)
+        with open(self.runtime_state_file, 'w') as f:
+            json.dump({'state': state, 'fingerprints': fingerprints}, f,
+                      indent=2, sort_keys=True)
+
+    def persist(self):
+        """Make the config of the last runtime only apply persistent.
+
+        The state is applied again with the profiles saved to disk. It
+        matches the running config, so the kernel state is left as is.
+        :raises: ConfigurationError if there is no runtime state to persist
+        """
+        data = common.get_file_data(self.runtime_state_file)
+        if not data:
+            msg = f"No runtime only config found in {self.runtime_state_file}"
+            raise os_net_config.ConfigurationError(msg)
+        runtime = json.loads(data)
+        self.__dump_config(runtime['state'], msg="Persisting the config")
+        if self.noop:
+            return
+        try:
+            netapplier.apply(runtime['state'], verify_change=True,
+                             save_to_disk=True)
+        except Exception as e:
+            msg = 'Error persisting the config with nmstate: %s' % str(e)
+            raise os_net_config.ConfigurationError(msg)
+        self.write_fingerprints(runtime['fingerprints'])
+        os.remove(self.runtime_state_file)
+        logger.info('Persisted the runtime only config')
+
+    def is_iface_live(self, name, iface_data):
+        """Cheap check that an interface still runs as last applied.
+
+        Only the state and the MTU of the interface are compared.
+        :param name: iface_key() of the interface
+        :param iface_data: the desired state of the interface
+        :returns: True if the running interface matches
+        """
+        running = self.get_running_state().iface(name)
+        if not running:
+            return False
+        for key in (Interface.STATE, Interface.MTU):
+            if key in iface_data and \
+               _normalize_value(key, iface_data[key]) != \
+               _normalize_value(key, running.get(key)):
+                return False
+        return True
+
+    def cleanup_all_ifaces(self, exclude_nics=None):
+        """Bring down all the interfaces that are not excluded.
+
+        All the interfaces are brought down in a single nmstate transaction.
+        If that transaction fails, each interface is brought down on its
+        own so that one bad interface does not block the cleanup of the
+        others.
+
+        :param exclude_nics: list of interface names that are left untouched
+        """
+        exclude_nics = list(exclude_nics or []) + ['lo']
+        down_ifaces = []
+
+        for iface in self.iface_state():
             if Interface.NAME in iface and \
                iface[Interface.NAME] not in exclude_nics:
+                # The running config is shared by the snapshot, so work on
+                # a copy of it
+                iface = copy.deepcopy(iface)
                 iface[Interface.STATE] = InterfaceState.DOWN
-                state = {Interface.KEY: [iface]}
-                self.__dump_config(state,
-                                   msg=f"Cleaning up {iface[Interface.NAME]}")
-                if not self.noop:
-                    netapplier.apply(state, verify_change=True)
+                down_ifaces.append(iface)
 
-    def set_ifaces(self, iface_data, verify=True):
-        """Apply the desired state using nmstate.
+        if not down_ifaces:
+            return
+
+        state = {Interface.KEY: down_ifaces}
+        names = ', '.join(iface[Interface.NAME] for iface in down_ifaces)
+        self.__dump_config(state, msg=f"Cleaning up {names}")
+        if self.noop:
+            return
+
+        try:
+            netapplier.apply(state, verify_change=True,
+                             save_to_disk=not self.runtime_only)
+        except Exception as e:
+            logger.warning(f"Batched cleanup failed: {e}, cleaning up the "
+                           "interfaces one at a time")
+            self._cleanup_each_iface(down_ifaces)
+        finally:
+            # The snapshot is stale once the interfaces are brought down
+            self.running_state = None
+
+    def _cleanup_each_iface(self, down_ifaces):
+        """Bring down the interfaces with one nmstate transaction each.
+
+        :param down_ifaces: list of interface states with state set to down
+        :raises: ConfigurationError if any of the interfaces failed
+        """
+        failed = []
+        for iface in down_ifaces:
+            state = {Interface.KEY: [iface]}
+            self.__dump_config(state,
+                               msg=f"Cleaning up {iface[Interface.NAME]}")
+            try:
+                netapplier.apply(state, verify_change=True,
+                                 save_to_disk=not self.runtime_only)
+            except Exception as e:
+                logger.error(f"Failed to clean up {iface[Interface.NAME]}: "
+                             f"{e}")
+                failed.append(iface[Interface.NAME])
+        if failed:
+            msg = 'Error cleaning up interfaces: %s' % ', '.join(failed)
+            raise os_net_config.ConfigurationError(msg)
+
+    def set_ifaces(self, iface_data):
+        """Prepare the desired interface state for nmstate.
 
         :param iface_data: interface config json
-        :param verify: boolean that determines if config will be verified
+        :returns: the interface state, or an empty dict when there are no
+                  interfaces to be applied
         """
+        if not iface_data:
+            return {}
         state = {Interface.KEY: iface_data}
-        self.__dump_config(state, msg=f"Applying interface config")
-        if not self.noop:
-            netapplier.apply(state, verify_change=verify)
+        self.__dump_config(state, msg=f"Overall interface config")
+        return state
+
+    def dns_state(self):
+        """Return the current DNS config according to nmstate.
+
+        :returns: dict with the running DNS servers and search domains
+        """
+        running_dns = self.get_running_state().dns()
+        return {DNS.SERVER: running_dns.get(DNS.SERVER, []),
+                DNS.SEARCH: running_dns.get(DNS.SEARCH, [])}
+
+    def dns_config(self):
+        """Return the desired DNS servers and search domains."""
+        return {DNS.SERVER: self.dns_data['server'],
+                DNS.SEARCH: self.dns_data['domain']}
+
+    def set_dns(self):
+        """Prepare the desired DNS state for nmstate.
+
+        The DNS config is compared against the running config, since nmstate
+        would re-apply it even when nothing has changed.
+        :returns: the DNS state, or an empty dict when the running DNS config
+                  already matches
+        """
+        dns_config = self.dns_config()
+        if dns_config == self.dns_state():
+            logger.info('No changes required for DNS')
+            return {}
+        state = {DNS.KEY: {DNS.CONFIG: dns_config}}
+        self.__dump_config(state, msg=f"Overall DNS")
+        return state
+
+    def set_routes(self, route_data):
+        """Prepare the desired route state for nmstate.
 
-    def set_dns(self, verify=True):
-        """Apply the desired DNS using nmstate.
+        :param route_data: list of the routes to be added or removed
+        :returns: the route state, or an empty dict when there are no routes
+                  to be applied
+        """
+        if not route_data:
+            return {}
+        state = {NMRoute.KEY: {NMRoute.CONFIG: route_data}}
+        self.__dump_config(state, msg=f"Overall routes")
+        return state
+
+    def set_rules(self, rule_data):
+        """Prepare the desired route rule state for nmstate.
+
+        :param rule_data: list of the route rules to be added or removed
+        :returns: the route rule state, or an empty dict when there are no
+                  rules to be applied
+        """
+        if not rule_data:
+            return {}
+        state = {NMRouteRule.KEY: {NMRouteRule.CONFIG: rule_data}}
+        self.__dump_config(state, msg=f"Overall rules")
+        return state
+
+    def generate_routes(self, interface_names):
+        """Generate the route changes for the managed interfaces.
 
-        :param dns_data:  config json
+        Only the routes missing from the running config are added, and the
+        running routes of the interfaces that are no longer desired are
+        marked absent.
+        :param interface_names: names of the interfaces managed by this run
+        :returns: list of the routes to be added or removed
+        """
+        routes = []
+        for name in interface_names:
+            curr_routes = self.route_state(name)
+            reqd_routes = self.route_data.get(name, [])
+            for route in _missing_items(curr_routes, reqd_routes):
+                logger.info(f"Adding route {route}")
+                routes.append(route)
+            for route in _unwanted_items(curr_routes, reqd_routes):
+                route = dict(route)
+                route[NMRoute.STATE] = NMRoute.STATE_ABSENT
+                logger.info(f"Removing route {route}")
+                routes.append(route)
+        return routes
+
+    def generate_rules(self):
+        """Generate the route rule changes.
+
+        Only the rules missing from the running config are added. The
+        running rules that are no longer desired are marked absent if they
+        use a route table of the config, the other rules are not managed by
+        os-net-config.
+        :returns: list of the route rules to be added or removed
+        """
+        rules = []
+        curr_rules = self.rule_state()
+        reqd_rules = [rule for rule in self.rules_data
+                      if NMRouteRule.STATE not in rule]
+        managed_tables = set(self.route_table_data)
+        managed_tables.update(rule[NMRouteRule.ROUTE_TABLE]
+                              for rule in self.rules_data
+                              if NMRouteRule.ROUTE_TABLE in rule)
+        managed_tables.update(route[NMRoute.TABLE_ID]
+                              for routes in self.route_data.values()
+                              for route in routes
+                              if NMRoute.TABLE_ID in route)
+        for rule in _missing_items(curr_rules, reqd_rules):
+            logger.info(f"Adding rule {rule}")
+            rules.append(rule)
+        for rule in _unwanted_items(curr_rules, reqd_rules):
+            if rule.get(NMRouteRule.ROUTE_TABLE) not in managed_tables:
+                continue
+            rule = dict(rule)
+            rule[NMRouteRule.STATE] = NMRouteRule.STATE_ABSENT
+            logger.info(f"Removing rule {rule}")
+            rules.append(rule)
+        # The rules explicitly deleted in the config
+        rules.extend(rule for rule in self.rules_data
+                     if NMRouteRule.STATE in rule)
+        return rules
+
+    def nmstate_apply(self, new_state, verify=True, check=None):
+        """Apply the desired state using nmstate.
+
+        :param new_state: desired state, skipped when empty
         :param verify: boolean that determines if config will be verified
+        :param check: optional callable verifying the applied config, called
+                      before the checkpoint is committed
+        """
+        if not new_state:
+            logger.info('No changes to be applied with nmstate')
+            return
+        self.__dump_config(new_state, msg=f"Applying the config with nmstate")
+        if self.noop:
+            return
+        if self.rollback_timeout:
+            self.checkpoint_apply(new_state, verify=verify, check=check)
+        else:
+            netapplier.apply(new_state, verify_change=verify,
+                             save_to_disk=not self.runtime_only)
+            if check:
+                check()
+
+    def probe_targets(self):
+        """Return the addresses probed before committing a checkpoint.
+
+        These are the static default gateways of the desired config and the
+        default gateways learnt by the DHCP interfaces, read from the applied
+        config. The DNS servers are only probed with probe_dns, since many
+        resolvers drop ICMP or are reached through another interface.
         """
+        default_routes = (IPV4_DEFAULT_GATEWAY_DESTINATION,
+                          IPV6_DEFAULT_GATEWAY_DESTINATION)
+        targets = []
+        for routes in self.route_data.values():
+            for route in routes:
+                if (route.get(NMRoute.DESTINATION) in default_routes and
+                        NMRoute.NEXT_HOP_ADDRESS in route):
+                    targets.append(route[NMRoute.NEXT_HOP_ADDRESS])
+        dhcp_ifaces = set(
+            data[Interface.NAME] for _, data in self._all_iface_data()
+            if data.get(Interface.IPV4, {}).get(InterfaceIPv4.DHCP) or
+            data.get(Interface.IPV6, {}).get(InterfaceIPv6.DHCP))
+        if dhcp_ifaces:
+            running_routes = netinfo.show().get(NMRoute.KEY, {}).get(
+                NMRoute.RUNNING) or []
+            for route in running_routes:
+                if (route.get(NMRoute.DESTINATION) in default_routes and
+                        route.get(NMRoute.NEXT_HOP_INTERFACE) in dhcp_ifaces
+                        and route.get(NMRoute.NEXT_HOP_ADDRESS)):
+                    targets.append(route[NMRoute.NEXT_HOP_ADDRESS])
+        if self.probe_dns:
+            targets.extend(self.dns_data['server'])
+        return list(dict.fromkeys(targets))
 
-        state = {DNS.KEY: {DNS.CONFIG: {DNS.SERVER: self.dns_data['server'],
-                                        DNS.SEARCH: self.dns_data['domain']}}}
-        self.__dump_config(state, msg=f"Applying DNS")
-        if not self.noop:
-            netapplier.apply(state, verify_change=verify)
+    def probe_connectivity(self, targets):
+        """Probe the targets in parallel.
+
+        :param targets: list of the addresses to probe
+        :returns: list of the targets that did not reply
+        """
+        if not targets:
+            return []
+        with futures.ThreadPoolExecutor(max_workers=len(targets)) as pool:
+            replies = list(pool.map(
+                lambda target: probe_address(target, PROBE_TIMEOUT),
+                targets))
+        return [target for target, reply in zip(targets, replies)
+                if not reply]
+
+    def checkpoint_apply(self, new_state, verify=True, check=None):
+        """Apply the desired state in a checkpoint.
+
+        The checkpoint is committed only when the check passes and the
+        probe_targets() reply, otherwise it is rolled back right away. If this
+        host can't commit at all, e.g. after losing its connectivity,
+        nmstate rolls back once the rollback timeout expires.
+        :param new_state: desired state
+        :param verify: boolean that determines if config will be verified
+        :param check: optional callable verifying the applied config
+        """
+        checkpoint = netapplier.apply(
+            new_state, verify_change=verify,
+            save_to_disk=not self.runtime_only, commit=False,
+            rollback_timeout=self.rollback_timeout)
+        try:
+            if check:
+                check()
+            failed = self.probe_connectivity(self.probe_targets())
+        except Exception:
+            netapplier.rollback(checkpoint=checkpoint)
+            raise
+        if failed:
+            logger.error('No reply from %s, rolling back the config' %
+                         ', '.join(failed))
+            netapplier.rollback(checkpoint=checkpoint)
+            msg = 'Connectivity check failed for %s' % ', '.join(failed)
+            raise os_net_config.ConfigurationError(msg)
+        netapplier.commit(checkpoint=checkpoint)
+        logger.info('Connectivity check passed, committed the config')
 
     def _add_common(self, base_opt):
 
@@ -204,10 +1039,12 @@ class NmstateNetConfig(os_net_config.NetConfig):
             if not base_opt.hotplug:
                 logger.info('Using NetworkManager, hotplug is always set to'
                             'true. Deprecating it from next release')
-        elif isinstance(base_opt, objects.Vlan) or \
-            re.match(r'\w+\.\d+$', base_opt.name):
-            msg = 'Error: VLAN interfaces not yet supported by impl_nmstate'
-            raise os_net_config.NotImplemented(msg)
+        elif isinstance(base_opt, (objects.Vlan, objects.LinuxBond,
+                                   objects.OvsBridge, objects.OvsUserBridge,
+                                   objects.OvsBond, objects.OvsDpdkPort,
+                                   objects.OvsDpdkBond, objects.SriovPF,
+                                   objects.SriovVF)):
+            pass
         elif isinstance(base_opt, objects.IvsInterface):
             msg = 'Error: IVS interfaces not yet supported by impl_nmstate'
             raise os_net_config.NotImplemented(msg)
@@ -217,9 +1054,6 @@ class NmstateNetConfig(os_net_config.NetConfig):
         elif isinstance(base_opt, objects.IbInterface):
             msg = 'Error: Infiniband not yet supported by impl_nmstate'
             raise os_net_config.NotImplemented(msg)
-        elif isinstance(base_opt, objects.OvsBond):
-            msg = "Error: Ovs Bonds are not yet supported by impl_nmstate"
-            raise os_net_config.NotImplemented(msg)
         elif isinstance(base_opt, objects.LinuxBridge):
             msg = "Error: Linux bridges are not yet supported by impl_nmstate"
             raise os_net_config.NotImplemented(msg)
@@ -232,9 +1066,6 @@ class NmstateNetConfig(os_net_config.NetConfig):
         elif isinstance(base_opt, objects.OvsPatchPort):
             msg = "Error: OVS tunnels not yet supported by impl_nmstate"
             raise os_net_config.NotImplemented(msg)
-        elif isinstance(base_opt, objects.OvsDpdkBond):
-            msg = "Error: OVS DPDK Bonds not yet supported by impl_nmstate"
-            raise os_net_config.NotImplemented(msg)
         else:
             msg = "Error: Unsupported interface by impl_nmstate"
             raise os_net_config.NotImplemented(msg)
@@ -279,13 +1110,157 @@ class NmstateNetConfig(os_net_config.NetConfig):
         if base_opt.domain:
             self._add_dns_domain(base_opt.domain)
         if base_opt.routes:
-            msg = "Error: Routes not yet supported by impl_nmstate"
-            raise os_net_config.NotImplemented(msg)
+            self._add_routes(base_opt.name, base_opt.routes)
         if base_opt.rules:
-            msg = "Error: IP Rules are not yet supported by impl_nmstate"
-            raise os_net_config.NotImplemented(msg)
+            self._add_rules(base_opt.rules)
         return data
 
+    def get_route_tables(self):
+        """Return the route table ids by name.
+
+        The tables are read from /etc/iproute2/rt_tables, and the tables
+        defined in the config take precedence.
+        :returns: dict of table name to table id
+        """
+        rt_tables = {}
+        rt_config = common.get_file_data(
+            self.root_dir + route_table_config_path()).split('\n')
+        for line in rt_config:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            id_name = line.split()
+            if len(id_name) > 1 and id_name[0].isdigit():
+                rt_tables[id_name[1]] = int(id_name[0])
+        for table_id, name in self.route_table_data.items():
+            rt_tables[name] = table_id
+        return rt_tables
+
+    def _route_table_id(self, route_table):
+        if str(route_table).isdigit():
+            return int(route_table)
+        # rt_tables is read once for all the routes and rules
+        if self.route_tables is None:
+            self.route_tables = self.get_route_tables()
+        if route_table in self.route_tables:
+            return self.route_tables[route_table]
+        msg = f"Unidentified mapping for route table {route_table}"
+        raise os_net_config.ConfigurationError(msg)
+
+    def _add_routes(self, interface_name, routes):
+        logger.info(f"adding custom route for interface: {interface_name}")
+        routes_data = []
+        for route in routes:
+            route_data = {NMRoute.NEXT_HOP_INTERFACE: interface_name}
+            metric = None
+            route_table = route.route_table
+            if route.route_options:
+                metric = get_route_options(route.route_options, 'metric')
+                table = get_route_options(route.route_options, 'table')
+                if table is not None:
+                    route_table = table
+            if route.default:
+                if ':' in route.next_hop:
+                    route_data[NMRoute.DESTINATION] = \
+                        IPV6_DEFAULT_GATEWAY_DESTINATION
+                else:
+                    route_data[NMRoute.DESTINATION] = \
+                        IPV4_DEFAULT_GATEWAY_DESTINATION
+            elif route.ip_netmask:
+                route_data[NMRoute.DESTINATION] = route.ip_netmask
+            if route.next_hop:
+                route_data[NMRoute.NEXT_HOP_ADDRESS] = route.next_hop
+            if metric is not None:
+                route_data[NMRoute.METRIC] = metric
+            if route_table:
+                route_data[NMRoute.TABLE_ID] = \
+                    self._route_table_id(route_table)
+            routes_data.append(route_data)
+
+        self.route_data.setdefault(interface_name, []).extend(routes_data)
+        logger.debug(f"route data: {self.route_data[interface_name]}")
+
+    def _parse_ip_rule(self, rule):
+        """Translate an ip rule command into an nmstate route rule.
+
+        :param rule: the rule as given to ip rule, e.g.
+                     "add from 192.0.2.0/24 table 200 prio 1000"
+        :returns: dict of the nmstate route rule
+        """
+        nm_rule_map = {
+            'blackhole': (NMRouteRule.ACTION, NMRouteRule.ACTION_BLACKHOLE),
+            'unreachable': (NMRouteRule.ACTION,
+                            NMRouteRule.ACTION_UNREACHABLE),
+            'prohibit': (NMRouteRule.ACTION, NMRouteRule.ACTION_PROHIBIT),
+            'fwmark': (NMRouteRule.FWMARK, None),
+            'fwmask': (NMRouteRule.FWMASK, None),
+            'iif': (NMRouteRule.IIF, None),
+            'from': (NMRouteRule.IP_FROM, None),
+            'to': (NMRouteRule.IP_TO, None),
+            'priority': (NMRouteRule.PRIORITY, None),
+            'prio': (NMRouteRule.PRIORITY, None),
+            'pref': (NMRouteRule.PRIORITY, None),
+            'table': (NMRouteRule.ROUTE_TABLE, None),
+            'lookup': (NMRouteRule.ROUTE_TABLE, None)}
+        logger.debug(f"Parse rule {rule}")
+        items = rule.split()
+        rule_config = {}
+        if items and items[0] in ['add', 'del']:
+            if items[0] == 'del':
+                rule_config[NMRouteRule.STATE] = NMRouteRule.STATE_ABSENT
+            items = items[1:]
+
+        items_iter = iter(items)
+        for item in items_iter:
+            if item not in nm_rule_map:
+                msg = f"unhandled ip rule command {rule}"
+                raise os_net_config.ConfigurationError(msg)
+            nm_key, value = nm_rule_map[item]
+            if value is None:
+                try:
+                    value = next(items_iter)
+                except StopIteration:
+                    msg = f"incomplete ip rule command {rule}"
+                    raise os_net_config.ConfigurationError(msg)
+                if nm_key == NMRouteRule.ROUTE_TABLE:
+                    value = self._route_table_id(value)
+                else:
+                    value = _get_type_value(value)
+            rule_config[nm_key] = value
+
+        # from/to all is the same as not setting the address
+        for key in (NMRouteRule.IP_FROM, NMRouteRule.IP_TO):
+            if key in rule_config and _is_any_ip_addr(rule_config[key]):
+                del rule_config[key]
+
+        # Without an address, the IP family has to be given
+        if NMRouteRule.IP_FROM not in rule_config and \
+           NMRouteRule.IP_TO not in rule_config:
+            rule_config[NMRouteRule.FAMILY] = NMRouteRule.FAMILY_IPV4
+
+        if NMRouteRule.PRIORITY not in rule_config:
+            logger.warning(f"The ip rule {rule} doesn't have the priority "
+                           "set. It is advisable to set the priorities in "
+                           "order to have a deterministic behaviour")
+        return rule_config
+
+    def _add_rules(self, rules):
+        for rule in rules:
+            rule_config = self._parse_ip_rule(rule.rule)
+            if rule_config not in self.rules_data:
+                self.rules_data.append(rule_config)
+        logger.debug(f"rule data: {self.rules_data}")
+
+    def add_route_table(self, route_table):
+        """Add a RouteTable object to the net config object.
+
+        :param route_table: the RouteTable object to add.
+        """
+        logger.info('adding route table: %s %s' % (route_table.table_id,
+                                                   route_table.name))
+        self.route_table_data[int(route_table.table_id)] = route_table.name
+        self.route_tables = None
+
     def _add_dns_servers(self, dns_servers):
         for dns_server in dns_servers:
             if dns_server not in self.dns_data['server']:
@@ -306,8 +1281,25 @@ class NmstateNetConfig(os_net_config.NetConfig):
     def add_interface(self, interface):
         """Add an Interface object to the net config object.
 
+        Interfaces named <device>.<vlan id> are added as VLANs.
         :param interface: The Interface object to add.
         """
+        if re.match(r'\w+\.\d+$', interface.name):
+            device, vlan_id = interface.name.split('.')
+            vlan = objects.Vlan(
+                device, int(vlan_id),
+                use_dhcp=interface.use_dhcp, use_dhcpv6=interface.use_dhcpv6,
+                addresses=interface.addresses, routes=interface.routes,
+                rules=interface.rules, mtu=interface.mtu,
+                primary=interface.primary, nic_mapping=None,
+                persist_mapping=None, defroute=interface.defroute,
+                dhclient_args=interface.dhclient_args,
+                dns_servers=interface.dns_servers, nm_controlled=True,
+                onboot=interface.onboot, domain=interface.domain)
+            vlan.name = interface.name
+            self.add_vlan(vlan)
+            return
+
         logger.info('adding interface: %s' % interface.name)
         data = self._add_common(interface)
         if isinstance(interface, objects.Interface):
@@ -323,6 +1315,447 @@ class NmstateNetConfig(os_net_config.NetConfig):
         logger.debug('interface data: %s' % data)
         self.interface_data[interface.name] = data
 
+    def add_vlan(self, vlan):
+        """Add a Vlan object to the net config object.
+
+        :param vlan: The vlan object to add.
+        """
+        logger.info('adding vlan: %s' % vlan.name)
+        data = self._add_common(vlan)
+        if vlan.bridge_name:
+            # VLANs on OVS bridges are internal ovs interfaces, tagged on
+            # their bridge port
+            data[Interface.TYPE] = InterfaceType.OVS_INTERFACE
+            logger.debug('vlan data: %s' % data)
+            self.vlan_data[vlan.name] = data
+            return
+
+        if vlan.device:
+            base_iface = vlan.device
+        elif vlan.linux_bond_name:
+            base_iface = vlan.linux_bond_name
+        else:
+            msg = 'Error: no device found for VLAN %s' % vlan.name
+            raise os_net_config.ConfigurationError(msg)
+
+        data[Interface.TYPE] = InterfaceType.VLAN
+        data[VLAN.CONFIG_SUBTREE] = {VLAN.ID: vlan.vlan_id,
+                                     VLAN.BASE_IFACE: base_iface}
+
+        logger.debug('vlan data: %s' % data)
+        self.vlan_data[vlan.name] = data
+
+    def _set_ovs_extra(self, data, path, value):
+        config = data
+        for key in path[:-1]:
+            config = config.setdefault(key, {})
+        config[path[-1]] = _get_type_value(value)
+
+    def parse_ovs_extra(self, ovs_extras, name, data, port=None):
+        """Translate the ovs_extra commands into nmstate settings.
+
+        :param ovs_extras: list of ovs-vsctl commands
+        :param name: name of the bridge or interface the commands are for
+        :param data: nmstate state of the bridge or interface, updated with
+                     the settings found
+        :param port: nmstate bridge port of the interface, updated with the
+                     port settings found
+        """
+        for ovs_extra in ovs_extras:
+            for command in ovs_extra.split(' -- '):
+                items = command.split()
+                if items[:1] == ['del-controller']:
+                    # Bridges configured by nmstate have no controller
+                    continue
+                if items[:1] == ['br-set-external-id'] and \
+                   len(items) in (3, 4) and items[1] == name:
+                    external_ids = data.setdefault(OvsDB.KEY, {}).setdefault(
+                        OvsDB.EXTERNAL_IDS, {})
+                    external_ids[items[2]] = items[3] if len(items) > 3 \
+                        else ''
+                    continue
+                if items[:1] != ['set'] or len(items) < 4 or \
+                   items[2] != name:
+                    logger.warning(f"Ignoring ovs_extra not supported by "
+                                   f"impl_nmstate: {command}")
+                    continue
+
+                table = items[1].lower()
+                for setting in items[3:]:
+                    key, _, value = setting.partition('=')
+                    other_config = re.match(r'^other[_-]config:(.+)$', key)
+                    if not value:
+                        msg = f"Invalid ovs_extra format detected: {command}"
+                        raise os_net_config.ConfigurationError(msg)
+                    elif other_config and table in ('bridge', 'interface'):
+                        self._set_ovs_extra(
+                            data, [OvsDB.KEY, OvsDB.OTHER_CONFIG,
+                                   other_config.group(1)], value)
+                    elif table == 'bridge' and key in _OVS_EXTRA_BRIDGE:
+                        self._set_ovs_extra(data, _OVS_EXTRA_BRIDGE[key],
+                                            value)
+                    elif table == 'interface' and \
+                            key in _OVS_EXTRA_INTERFACE:
+                        self._set_ovs_extra(data, _OVS_EXTRA_INTERFACE[key],
+                                            value)
+                    elif table == 'port' and key in _OVS_EXTRA_PORT and \
+                            port is not None:
+                        self._set_ovs_extra(port, _OVS_EXTRA_PORT[key], value)
+                        port[OVSBridge.Port.VLAN_SUBTREE][
+                            OVSBridge.Port.Vlan.MODE] = \
+                            OVSBridge.Port.Vlan.Mode.ACCESS
+                    else:
+                        logger.warning(f"Ignoring ovs_extra not supported by "
+                                       f"impl_nmstate: {command}")
+
+    def parse_bond_ovs_extra(self, bond):
+        """Translate the ovs_extra commands of an OVS bond into options.
+
+        Only the settings of the port of the bond are supported, as with
+        ovs_options.
+        :param bond: the OvsBond or OvsDpdkBond object
+        :returns: dict of the bonding options set by the commands
+        :raises ConfigurationError: for any other ovs_extra command
+        """
+        bond_options = {}
+        for ovs_extra in bond.ovs_extra:
+            for command in ovs_extra.split(' -- '):
+                items = command.split()
+                if items[:1] != ['set'] or len(items) < 4 or \
+                   items[1].lower() != 'port' or items[2] != bond.name:
+                    msg = (f"ovs_extra of OVS bond {bond.name} not supported "
+                           f"by impl_nmstate: {command}")
+                    raise os_net_config.ConfigurationError(msg)
+                if not all('=' in setting for setting in items[3:]):
+                    msg = f"Invalid ovs_extra format detected: {command}"
+                    raise os_net_config.ConfigurationError(msg)
+                bond_options.update(
+                    parse_bonding_options(' '.join(items[3:])))
+        return bond_options
+
+    def get_ovs_ports(self, members):
+        """Build the nmstate ports of an OVS bridge from its members.
+
+        :param members: list of the member objects of the bridge
+        :returns: list of the bridge ports
+        """
+        ports = []
+        for member in members:
+            port = {OVSBridge.Port.NAME: member.name}
+            if isinstance(member, (objects.OvsBond, objects.OvsDpdkBond)):
+                bond_options = parse_bonding_options(member.ovs_options)
+                if member.ovs_extra:
+                    bond_options.update(self.parse_bond_ovs_extra(member))
+                if member.primary_interface_name:
+                    bond_options.setdefault('other_config:bond-primary',
+                                            member.primary_interface_name)
+                bond_data = set_ovs_bonding_options(bond_options)
+                bond_data[OVSBridge.Port.LinkAggregation.PORT_SUBTREE] = [
+                    {OVSBridge.Port.LinkAggregation.Port.NAME: m.name}
+                    for m in member.members]
+                port[OVSBridge.Port.LINK_AGGREGATION_SUBTREE] = bond_data
+            elif isinstance(member, objects.Vlan):
+                port[OVSBridge.Port.VLAN_SUBTREE] = {
+                    OVSBridge.Port.Vlan.MODE: OVSBridge.Port.Vlan.Mode.ACCESS,
+                    OVSBridge.Port.Vlan.TAG: member.vlan_id}
+            ports.append(port)
+        logger.debug('ovs ports: %s' % ports)
+        return ports
+
+    def add_bridge(self, bridge, dpdk=False):
+        """Add an OvsBridge object to the net config object.
+
+        :param bridge: The OvsBridge object to add.
+        :param dpdk: use the userspace datapath, for OVS-DPDK bridges
+        """
+        logger.info('adding bridge: %s' % bridge.name)
+
+        # The bridge itself carries no addresses, these are set on its
+        # internal ovs interface, which has the name of the bridge like with
+        # ifcfg
+        iface_data = self._add_common(bridge)
+        iface_data[Interface.TYPE] = InterfaceType.OVS_INTERFACE
+        internal_port = {OVSBridge.Port.NAME: bridge.name}
+
+        options = {OVSBridge.Options.FAIL_MODE:
+                   objects.DEFAULT_OVS_BRIDGE_FAIL_MODE,
+                   OVSBridge.Options.MCAST_SNOOPING_ENABLED: False,
+                   OVSBridge.Options.RSTP: False,
+                   OVSBridge.Options.STP: False}
+        if dpdk:
+            options[OVSBridge.Options.DATAPATH] = 'netdev'
+        data = {Interface.NAME: bridge.name,
+                Interface.TYPE: InterfaceType.OVS_BRIDGE,
+                Interface.STATE: iface_data[Interface.STATE],
+                OVSBridge.CONFIG_SUBTREE: {
+                    OVSBridge.OPTIONS_SUBTREE: options,
+                    OVSBridge.PORT_SUBTREE: []},
+                OvsDB.KEY: {OvsDB.EXTERNAL_IDS: {},
+                            OvsDB.OTHER_CONFIG: {}}}
+        if bridge.primary_interface_name and self.offline:
+            logger.warning('%s: the MAC of %s is not known offline, the '
+                           'bridge MAC is not set' %
+                           (bridge.name, bridge.primary_interface_name))
+        elif bridge.primary_interface_name:
+            mac = common.interface_mac(bridge.primary_interface_name)
+            data[OvsDB.KEY][OvsDB.OTHER_CONFIG]['hwaddr'] = mac
+            iface_data[Interface.MAC] = mac
+        if bridge.ovs_extra:
+            self.parse_ovs_extra(bridge.ovs_extra, bridge.name, data,
+                                 port=internal_port)
+
+        data[OVSBridge.CONFIG_SUBTREE][OVSBridge.PORT_SUBTREE] = \
+            self.get_ovs_ports(bridge.members) + [internal_port]
+
+        logger.debug('bridge data: %s' % data)
+        self.bridge_data[bridge.name] = data
+        logger.debug('ovs interface data: %s' % iface_data)
+        self.interface_data[bridge.name] = iface_data
+
+    def add_ovs_user_bridge(self, bridge):
+        """Add an OvsUserBridge object to the net config object.
+
+        :param bridge: The OvsUserBridge object to add.
+        """
+        logger.info('adding ovs user bridge: %s' % bridge.name)
+        self.add_bridge(bridge, dpdk=True)
+
+    def add_bond(self, bond):
+        """Add an OvsBond object to the net config object.
+
+        The bond is a port of its bridge, see get_ovs_ports(), and its MTU
+        is set on its members.
+        :param bond: The OvsBond object to add.
+        :raises ConfigurationError: if the bond has an IP config, an OVS
+                                    bond port has no interface to carry it
+        """
+        logger.info('adding bond: %s' % bond.name)
+        if bond.use_dhcp or bond.use_dhcpv6 or bond.addresses or \
+           bond.routes or bond.rules:
+            msg = (f"OVS bond {bond.name} can't have addresses, routes or "
+                   f"rules with impl_nmstate")
+            raise os_net_config.ConfigurationError(msg)
+        for member in bond.members:
+            if bond.mtu:
+                member.mtu = bond.mtu
+
+    def add_linux_bond(self, bond):
+        """Add a LinuxBond object to the net config object.
+
+        :param bond: The LinuxBond object to add.
+        """
+        logger.info('adding linux bond: %s' % bond.name)
+        data = self._add_common(bond)
+        data[Interface.TYPE] = InterfaceType.BOND
+        bond_options = parse_bonding_options(bond.bonding_options)
+        data[Bond.CONFIG_SUBTREE] = set_linux_bonding_options(
+            bond_options, primary_iface=bond.primary_interface_name)
+        data[Bond.CONFIG_SUBTREE][Bond.PORT] = [
+            member.name for member in bond.members]
+        logger.debug('bond data: %s' % data)
+        self.linuxbond_data[bond.name] = data
+
+    def add_ovs_dpdk_port(self, ovs_dpdk_port):
+        """Add a OvsDpdkPort object to the net config object.
+
+        :param ovs_dpdk_port: The OvsDpdkPort object to add.
+        """
+        logger.info('adding ovs dpdk port: %s' % ovs_dpdk_port.name)
+        if self.offline:
+            msg = ('%s: the DPDK drivers are bound on the host, OVS-DPDK '
+                   'ports are not supported in offline mode' %
+                   ovs_dpdk_port.name)
+            raise os_net_config.ConfigurationError(msg)
+
+        # DPDK Port will have only one member of type Interface, validation
+        # checks are added at the object creation stage.
+        ifname = ovs_dpdk_port.members[0].name
+
+        # Bind the dpdk interface
+        utils.bind_dpdk_interfaces(ifname, ovs_dpdk_port.driver, self.noop)
+
+        data = self._add_common(ovs_dpdk_port)
+        data[Interface.TYPE] = InterfaceType.OVS_INTERFACE
+        dpdk_data = {OVSInterface.Dpdk.DEVARGS:
+                     utils.get_dpdk_devargs(ifname, self.noop)}
+        if ovs_dpdk_port.rx_queue:
+            dpdk_data[OVSInterface.Dpdk.RX_QUEUE] = ovs_dpdk_port.rx_queue
+        if ovs_dpdk_port.rx_queue_size:
+            dpdk_data[OVSInterface.Dpdk.N_RXQ_DESC] = \
+                ovs_dpdk_port.rx_queue_size
+        if ovs_dpdk_port.tx_queue_size:
+            dpdk_data[OVSInterface.Dpdk.N_TXQ_DESC] = \
+                ovs_dpdk_port.tx_queue_size
+        data[OVSInterface.DPDK_CONFIG_SUBTREE] = dpdk_data
+        if ovs_dpdk_port.ovs_extra:
+            self.parse_ovs_extra(ovs_dpdk_port.ovs_extra, ovs_dpdk_port.name,
+                                 data)
+        logger.debug('ovs dpdk port data: %s' % data)
+        self.interface_data[ovs_dpdk_port.name] = data
+
+    def add_ovs_dpdk_bond(self, ovs_dpdk_bond):
+        """Add an OvsDpdkBond object to the net config object.
+
+        The bond is a port of its bridge, see get_ovs_ports(), and its
+        members are added as DPDK ports.
+        :param ovs_dpdk_bond: The OvsDpdkBond object to add.
+        """
+        logger.info('adding ovs dpdk bond: %s' % ovs_dpdk_bond.name)
+        for dpdk_port in ovs_dpdk_bond.members:
+            if ovs_dpdk_bond.mtu:
+                dpdk_port.mtu = ovs_dpdk_bond.mtu
+            if ovs_dpdk_bond.rx_queue:
+                dpdk_port.rx_queue = ovs_dpdk_bond.rx_queue
+            if ovs_dpdk_bond.rx_queue_size:
+                dpdk_port.rx_queue_size = ovs_dpdk_bond.rx_queue_size
+            if ovs_dpdk_bond.tx_queue_size:
+                dpdk_port.tx_queue_size = ovs_dpdk_bond.tx_queue_size
+            self.add_ovs_dpdk_port(dpdk_port)
+
+    def add_sriov_pf(self, sriov_pf):
+        """Add a SriovPF object to the net config object.
+
+        The VFs are created by the same transaction, via the sr-iov
+        subtree of the PF.
+        :param sriov_pf: The SriovPF object to add.
+        """
+        logger.info('adding sriov pf: %s' % sriov_pf.name)
+        data = self._add_common(sriov_pf)
+        data[Interface.TYPE] = InterfaceType.ETHERNET
+        data[Ethernet.CONFIG_SUBTREE] = {
+            Ethernet.SRIOV_SUBTREE: {
+                Ethernet.SRIOV.TOTAL_VFS: sriov_pf.numvfs}}
+        if sriov_pf.promisc:
+            data[Interface.ACCEPT_ALL_MAC_ADDRESSES] = \
+                sriov_pf.promisc == 'on'
+        if sriov_pf.link_mode != 'legacy' or sriov_pf.steering_mode:
+            # The eswitch is configured by the sriov_config service
+            logger.info('%s: link_mode %s and steering_mode %s are '
+                        'configured by the sriov_config service' %
+                        (sriov_pf.name, sriov_pf.link_mode,
+                         sriov_pf.steering_mode))
+        if sriov_pf.hwaddr:
+            data[Interface.MAC] = sriov_pf.hwaddr
+        logger.debug('sriov pf data: %s' % data)
+        self.interface_data[sriov_pf.name] = data
+
+    def get_vf_config(self, sriov_vf):
+        """Return the nmstate config of a VF in the sr-iov subtree of its PF.
+
+        :param sriov_vf: The SriovVF object.
+        """
+        vf_config = {Ethernet.SRIOV.VFS.ID: sriov_vf.vfid}
+        if sriov_vf.macaddr:
+            vf_config[Ethernet.SRIOV.VFS.MAC_ADDRESS] = sriov_vf.macaddr
+        if sriov_vf.spoofcheck:
+            vf_config[Ethernet.SRIOV.VFS.SPOOF_CHECK] = \
+                sriov_vf.spoofcheck == 'on'
+        if sriov_vf.trust:
+            vf_config[Ethernet.SRIOV.VFS.TRUST] = sriov_vf.trust == 'on'
+        if sriov_vf.min_tx_rate:
+            vf_config[Ethernet.SRIOV.VFS.MIN_TX_RATE] = sriov_vf.min_tx_rate
+        if sriov_vf.max_tx_rate:
+            vf_config[Ethernet.SRIOV.VFS.MAX_TX_RATE] = sriov_vf.max_tx_rate
+        if sriov_vf.vlan_id:
+            vf_config[Ethernet.SRIOV.VFS.VLAN_ID] = sriov_vf.vlan_id
+            if sriov_vf.qos:
+                vf_config[Ethernet.SRIOV.VFS.QOS] = sriov_vf.qos
+        return vf_config
+
+    def add_sriov_vf(self, sriov_vf):
+        """Add a SriovVF object to the net config object.
+
+        The VF settings are added to the sr-iov subtree of the PF, see
+        set_sriov_vfs(). A VF which is not created yet is only configured
+        there, it has no interface of its own until the PF is applied.
+        :param sriov_vf: The SriovVF object to add.
+        """
+        logger.info('adding sriov vf: %s for pf: %s, vfid: %d'
+                    % (sriov_vf.name, sriov_vf.device, sriov_vf.vfid))
+        vfs = self.sriov_vf_data.setdefault(sriov_vf.device, {})
+        vfs[sriov_vf.vfid] = self.get_vf_config(sriov_vf)
+        if sriov_vf.vf_ref:
+            return
+        data = self._add_common(sriov_vf)
+        data[Interface.TYPE] = InterfaceType.ETHERNET
+        data[Ethernet.CONFIG_SUBTREE] = {}
+        if sriov_vf.promisc:
+            data[Interface.ACCEPT_ALL_MAC_ADDRESSES] = \
+                sriov_vf.promisc == 'on'
+        logger.debug('sriov vf data: %s' % data)
+        self.interface_data[sriov_vf.name] = data
+
+    def set_sriov_vfs(self):
+        """Add the VF settings to the sr-iov subtree of their PFs.
+
+        PFs that are not part of this config are configured by the
+        sriov_config service.
+        """
+        for pf_name, vfs in self.sriov_vf_data.items():
+            pf_data = self.interface_data.get(pf_name)
+            if not pf_data or Ethernet.SRIOV_SUBTREE not in \
+               pf_data.get(Ethernet.CONFIG_SUBTREE, {}):
+                logger.debug('%s: VFs are configured by the sriov_config '
+                             'service' % pf_name)
+                continue
+            pf_data[Ethernet.CONFIG_SUBTREE][Ethernet.SRIOV_SUBTREE][
+                Ethernet.SRIOV.VFS_SUBTREE] = [
+                    vfs[vfid] for vfid in sorted(vfs)]
+
+    def verify_applied(self, changed_paths, dns=False):
+        """Verify the changed paths of the applied config.
+
+        Used when nmstate does not verify the config it applies. The running
+        config is read again, with an exponential backoff, until the changed
+        paths match the desired config or the verification timeout expires.
+        :param changed_paths: dict of the changed paths by interface name, as
+                              returned by state_diff()
+        :param dns: whether the DNS config was changed
+        :raises ConfigurationError: when some paths still don't match, after
+                                    logging them for each interface
+        """
+        desired = dict(self._all_iface_data())
+        deadline = time.monotonic() + self.verify_timeout
+        delay = VERIFY_INITIAL_DELAY
+        while True:
+            self.get_running_state(refresh=True)
+            pending = {}
+            for name, paths in changed_paths.items():
+                mismatch = _overlapping_paths(
+                    paths, state_diff(self.iface_state(name), desired[name]))
+                if mismatch:
+                    pending[name] = mismatch
+            if dns:
+                dns_config = self.dns_config()
+                running_dns = self.dns_state()
+                mismatch = {key for key in dns_config
+                            if dns_config[key] != running_dns[key]}
+                if mismatch:
+                    pending[DNS.KEY] = mismatch
+            if not pending:
+                logger.info('Verified the applied config')
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            logger.debug('Config not applied yet for %s, checking again in '
+                         '%.1fs' % (', '.join(sorted(pending)), delay))
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, VERIFY_MAX_DELAY)
+
+        for name, paths in sorted(pending.items()):
+            logger.error('%s: %s not matching the desired config' %
+                         (name, ', '.join(sorted(paths))))
+        msg = ('Verification of the applied config failed for %s' %
+               ', '.join(sorted(pending)))
+        raise os_net_config.ConfigurationError(msg)
+
+    def _all_iface_data(self):
+        """Return the desired state of all the interfaces, by iface_key()."""
+        return ((iface_key(data), data) for data in itertools.chain(
+            self.interface_data.values(), self.bridge_data.values(),
+            self.linuxbond_data.values(), self.vlan_data.values()))
+
     def apply(self, cleanup=False, activate=True):
         """Apply the network configuration.
 
@@ -338,33 +1771,78 @@ class NmstateNetConfig(os_net_config.NetConfig):
             mode).
         Note the noop mode is set via the constructor noop boolean
         """
+        if self.offline:
+            logger.info('generating network keyfiles...')
+            self.set_sriov_vfs()
+            updated_files = self.write_keyfiles()
+            self._clear_data()
+            return updated_files
+
         logger.info('applying network configs...')
         if cleanup:
             logger.info('Cleaning up all network configs...')
             self.cleanup_all_ifaces()
 
+        self.set_sriov_vfs()
         updated_interfaces = {}
+        changed_paths = {}
+        apply_ifaces = []
+        fingerprints = {}
+        last_fingerprints = {}
+        if not self.force_full_reconcile:
+            last_fingerprints = self.read_fingerprints()
         logger.debug("----------------------------")
-        for interface_name, iface_data in self.interface_data.items():
+        # Take a single snapshot of the running config for this apply
+        self.get_running_state(refresh=True)
+        for interface_name, iface_data in self._all_iface_data():
+            fingerprints[interface_name] = state_fingerprint(iface_data)
+            if fingerprints[interface_name] == \
+               last_fingerprints.get(interface_name) and \
+               self.is_iface_live(interface_name, iface_data):
+                logger.info('No changes in the config of interface: %s' %
+                            interface_name)
+                continue
             iface_state = self.iface_state(interface_name)
-            if not is_dict_subset(iface_state, iface_data):
+            changed = state_diff(iface_state, iface_data)
+            if changed:
+                logger.info('Interface %s changed: %s' %
+                            (interface_name, ', '.join(sorted(changed))))
                 updated_interfaces[interface_name] = iface_data
+                changed_paths[interface_name] = changed
+                if self.partial_state:
+                    apply_ifaces.append(
+                        partial_iface_state(iface_data, changed))
+                else:
+                    apply_ifaces.append(iface_data)
             else:
                 logger.info('No changes required for interface: %s' %
                             interface_name)
 
         if activate:
+            new_state = {}
+            new_state.update(self.set_ifaces(apply_ifaces))
+            # An ovs bridge and its internal interface share the same name
+            new_state.update(self.set_routes(self.generate_routes(
+                list(dict.fromkeys(data[Interface.NAME] for _, data in
+                                   self._all_iface_data())))))
+            new_state.update(self.set_rules(self.generate_rules()))
+            new_state.update(self.set_dns())
             if not self.noop:
+                # The running config is about to change, so a later lookup
+                # shall take a new snapshot
+                self.running_state = None
+                check = None
+                if self.deferred_verify:
+                    # Verified before a checkpoint is committed
+                    check = functools.partial(self.verify_applied,
+                                              changed_paths,
+                                              dns=DNS.KEY in new_state)
                 try:
-                    self.set_ifaces(list(updated_interfaces.values()))
+                    self.nmstate_apply(new_state,
+                                       verify=not self.deferred_verify,
+                                       check=check)
                 except Exception as e:
-                    msg = 'Error setting interfaces state: %s' % str(e)
-                    raise os_net_config.ConfigurationError(msg)
-
-                try:
-                    self.set_dns()
-                except Exception as e:
-                    msg = 'Error setting dns servers: %s' % str(e)
+                    msg = 'Error applying the config with nmstate: %s' % str(e)
                     raise os_net_config.ConfigurationError(msg)
 
             if self.errors:
@@ -374,5 +1852,25 @@ class NmstateNetConfig(os_net_config.NetConfig):
                     logger.error(str(e))
                 raise os_net_config.ConfigurationError(message)
 
-        self.interface_data = {}
+            # The fingerprints are only recorded for a successful apply
+            if not self.noop:
+                if self.runtime_only:
+                    # The fingerprints are written once the config is
+                    # persisted
+                    self.write_runtime_state(fingerprints)
+                else:
+                    self.write_fingerprints(fingerprints)
+
+        self._clear_data()
         return updated_interfaces
+
+    def _clear_data(self):
+        """Drop the desired state once it has been handled."""
+        self.interface_data = {}
+        self.vlan_data = {}
+        self.bridge_data = {}
+        self.linuxbond_data = {}
+        self.route_data = {}
+        self.rules_data = []
+        self.route_tables = None
+        self.sriov_vf_data = {}
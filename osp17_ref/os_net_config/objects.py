@@ -20,6 +20,8 @@
 #
 
 import logging
+import re
+
 import netaddr
 from oslo_utils import strutils
 
@@ -30,6 +32,8 @@ from os_net_config import utils
 logger = logging.getLogger(__name__)
 
 _MAPPED_NICS = None
+_SRIOV_VF_REFS = False
+_OFFLINE = False
 STANDALONE_FAIL_MODE = 'standalone'
 DEFAULT_OVS_BRIDGE_FAIL_MODE = STANDALONE_FAIL_MODE
 
@@ -143,6 +147,25 @@ def mapped_nics(nic_mapping=None):
         return _MAPPED_NICS
     _MAPPED_NICS = {}
 
+    if _OFFLINE:
+        # The nics of this host are not the nics of the config, only the
+        # names of the mapping file are used
+        for nic_alias, nic_mapped in mapping.items():
+            if netaddr.valid_mac(nic_mapped):
+                msg = ('cannot map %s to the mac %s, the macs need the '
+                       'devices of the host, they are not supported offline'
+                       % (nic_alias, nic_mapped))
+                raise InvalidConfigException(msg)
+            if nic_mapped in _MAPPED_NICS.values():
+                msg = ('interface %s already mapped, '
+                       'check mapping file for duplicates'
+                       % nic_mapped)
+                raise InvalidConfigException(msg)
+            _MAPPED_NICS[nic_alias] = nic_mapped
+            logger.info("%s in mapping file mapped to: %s"
+                        % (nic_alias, nic_mapped))
+        return _MAPPED_NICS
+
     if mapping:
         # If mapping file provided, nics need not be active
         available_nics = utils.ordered_available_nics()
@@ -213,6 +236,46 @@ def mapped_nics(nic_mapping=None):
     return _MAPPED_NICS
 
 
+def use_sriov_vf_refs(enabled=True):
+    """Refer to VFs that are not created yet by the PF name and VF id.
+
+    The nmstate provider creates the VFs in the same transaction that
+    configures them, so the VF device names are not known while parsing.
+    :param enabled: whether the references shall be used.
+    """
+    global _SRIOV_VF_REFS
+    _SRIOV_VF_REFS = enabled
+
+
+def _check_offline_nic(name):
+    """Reject the nicN names which are not mapped in offline mode.
+
+    The nicN names are the active nics of the host, they can't be
+    resolved when the config is generated for another host.
+    :param name: the interface name of the config.
+    """
+    if _OFFLINE and re.match(r'^nic\d+$', name):
+        msg = ('%s is not in the mapping file, the nicN names need the '
+               'devices of the host when not mapped' % name)
+        raise InvalidConfigException(msg)
+
+
+def use_offline(enabled=True):
+    """Parse the config without reading the devices of this host.
+
+    Used to generate the config of another host, e.g. an image. The VFs are
+    referred by the PF name and the VF id, and the settings which need the
+    devices of the host are rejected.
+    :param enabled: whether the config is parsed offline.
+    """
+    global _OFFLINE
+    _OFFLINE = enabled
+
+
+def sriov_vf_ref(device, vfid):
+    return 'sriov:%s:%d' % (device, vfid)
+
+
 def format_ovs_extra(obj, templates):
     """Map OVS object properties into a string to be used for ovs_extra."""
 
@@ -350,6 +413,10 @@ class _BaseOpts(object):
             vlan_suffix = ''
         if base_name in mapped_nic_names:
             if persist_mapping:
+                if _OFFLINE:
+                    msg = ('%s: persist_mapping needs the devices of the '
+                           'host, it is not supported offline' % name)
+                    raise InvalidConfigException(msg)
                 self.name = name
                 self.hwname = '%s%s' % (mapped_nic_names[base_name],
                                         vlan_suffix)
@@ -358,6 +425,7 @@ class _BaseOpts(object):
             else:
                 self.name = '%s%s' % (mapped_nic_names[base_name], vlan_suffix)
         else:
+            _check_offline_nic(base_name)
             self.name = name
 
         self.mtu = mtu
@@ -524,6 +592,7 @@ class Vlan(_BaseOpts):
         if device in mapped_nic_names:
             self.device = mapped_nic_names[device]
         else:
+            _check_offline_nic(device)
             self.device = device
 
     @staticmethod
@@ -657,6 +726,10 @@ class OvsBridge(_BaseOpts):
             logger.info("Promisc is not set for VF %s:%d, defaulting to on"
                         % (iface.device, iface.vfid))
             iface.promisc = "on"
+        if iface.vf_ref:
+            msg = ('VF %s:%d is not created yet, it can\'t be a member of '
+                   'a bridge or a bond' % (iface.device, iface.vfid))
+            raise InvalidConfigException(msg)
         utils.update_sriov_vf_map(iface.device, iface.vfid, iface.name,
                                   vlan_id=iface.vlan_id, qos=iface.qos,
                                   spoofcheck=iface.spoofcheck,
@@ -1034,6 +1107,10 @@ class LinuxBond(_BaseOpts):
             logger.info("Promisc is not set for VF %s:%d, defaulting to off"
                         % (iface.device, iface.vfid))
             iface.promisc = 'off'
+        if iface.vf_ref:
+            msg = ('VF %s:%d is not created yet, it can\'t be a member of '
+                   'a bridge or a bond' % (iface.device, iface.vfid))
+            raise InvalidConfigException(msg)
         utils.update_sriov_vf_map(iface.device, iface.vfid, iface.name,
                                   vlan_id=iface.vlan_id, qos=iface.qos,
                                   spoofcheck=iface.spoofcheck,
@@ -1122,6 +1199,10 @@ class OvsBond(_BaseOpts):
             logger.info("Promisc is not set for VF %s:%d, defaulting to on"
                         % (iface.device, iface.vfid))
             iface.promisc = "on"
+        if iface.vf_ref:
+            msg = ('VF %s:%d is not created yet, it can\'t be a member of '
+                   'a bridge or a bond' % (iface.device, iface.vfid))
+            raise InvalidConfigException(msg)
         utils.update_sriov_vf_map(iface.device, iface.vfid, iface.name,
                                   vlan_id=iface.vlan_id, qos=iface.qos,
                                   spoofcheck=iface.spoofcheck,
@@ -1318,7 +1399,7 @@ class OvsDpdkPort(_BaseOpts):
                  dhclient_args=None, dns_servers=None, nm_controlled=False,
                  onboot=True, domain=None, members=None, driver='vfio-pci',
                  ovs_options=None, ovs_extra=None, rx_queue=None,
-                 rx_queue_size=None, tx_queue_size=None):
+                 rx_queue_size=None, tx_queue_size=None, rxq_affinity=None):
 
         check_ovs_installed(self.__class__.__name__)
 
@@ -1335,6 +1416,7 @@ class OvsDpdkPort(_BaseOpts):
         self.rx_queue = rx_queue
         self.rx_queue_size = rx_queue_size
         self.tx_queue_size = tx_queue_size
+        self.rxq_affinity = rxq_affinity
 
     @staticmethod
     def update_vf_config(iface, driver=None):
@@ -1408,6 +1490,11 @@ class OvsDpdkPort(_BaseOpts):
         rx_queue = json.get('rx_queue', None)
         rx_queue_size = json.get('rx_queue_size', None)
         tx_queue_size = json.get('tx_queue_size', None)
+        rxq_affinity = json.get('rxq_affinity', None)
+        if rxq_affinity not in (None, 'auto'):
+            msg = 'Invalid rxq_affinity "%s", only "auto" is supported' % \
+                rxq_affinity
+            raise InvalidConfigException(msg)
         ovs_options = json.get('ovs_options', [])
         ovs_options = ['options:%s' % opt for opt in ovs_options]
         ovs_extra = json.get('ovs_extra', [])
@@ -1424,7 +1511,8 @@ class OvsDpdkPort(_BaseOpts):
                            ovs_options=ovs_options,
                            ovs_extra=ovs_extra, rx_queue=rx_queue,
                            rx_queue_size=rx_queue_size,
-                           tx_queue_size=tx_queue_size)
+                           tx_queue_size=tx_queue_size,
+                           rxq_affinity=rxq_affinity)
 
 
 class SriovVF(_BaseOpts):
@@ -1445,10 +1533,28 @@ class SriovVF(_BaseOpts):
         mapped_nic_names = mapped_nics(nic_mapping)
         if device in mapped_nic_names:
             device = mapped_nic_names[device]
+        else:
+            _check_offline_nic(device)
         # Empty strings are set for the name field.
         # The provider shall identify the VF name from the PF device name
         # (device) and the VF id.
-        name = utils.get_vf_devname(device, vfid)
+        vf_ref = _OFFLINE
+        if not vf_ref:
+            try:
+                name = utils.get_vf_devname(device, vfid)
+            except utils.SriovVfNotFoundException:
+                if not _SRIOV_VF_REFS:
+                    raise
+                vf_ref = True
+        if vf_ref:
+            # Only the settings of the PF's sr-iov subtree can be applied to
+            # a VF before it is created
+            if (use_dhcp or use_dhcpv6 or addresses or routes or rules or
+                    dns_servers or domain or mtu or promisc or ethtool_opts):
+                msg = ('VF %s:%s is not created yet, it can\'t have an IP, '
+                       'MTU, promisc or ethtool config' % (device, vfid))
+                raise InvalidConfigException(msg)
+            name = sriov_vf_ref(device, int(vfid))
         super(SriovVF, self).__init__(name, use_dhcp, use_dhcpv6, addresses,
                                       routes, rules, mtu, primary, nic_mapping,
                                       persist_mapping, defroute,
@@ -1463,14 +1569,20 @@ class SriovVF(_BaseOpts):
         self.spoofcheck = spoofcheck
         self.trust = trust
         self.state = state
-        pci_address = utils.get_pci_address(name, False)
-        if pci_address is None:
-            pci_address = utils.get_stored_pci_address(name, False)
+        self.vf_ref = vf_ref
+        pci_address = None
+        if not vf_ref:
+            pci_address = utils.get_pci_address(name, False)
+            if pci_address is None:
+                pci_address = utils.get_stored_pci_address(name, False)
         self.macaddr = macaddr
         self.promisc = promisc
         self.pci_address = pci_address
         self.driver = None
         self.ethtool_opts = ethtool_opts
+        if vf_ref:
+            # The VF settings are applied along with the PF by nmstate
+            return
         utils.update_sriov_vf_map(device, self.vfid, name,
                                   vlan_id=self.vlan_id,
                                   qos=self.qos,
@@ -1552,6 +1664,7 @@ class SriovPF(_BaseOpts):
         if name in mapped_nic_names:
             self.name = mapped_nic_names[name]
         else:
+            _check_offline_nic(name)
             self.name = name
         self.promisc = promisc
         self.link_mode = link_mode
@@ -0,0 +1,575 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import os.path
+import shutil
+import stat
+import tempfile
+import threading
+
+from oslo_concurrency import processutils
+
+import os_net_config
+from os_net_config import common
+from os_net_config import impl_ifcfg
+from os_net_config import objects
+from os_net_config.tests import base
+
+# Stand-in for 'ip -force -batch -': it logs the commands it reads and fails
+# the ones using the 203.0.113.0/24 addresses, reporting them like ip does.
+_FAKE_IP = """#!/bin/sh
+[ "$*" = "-force -batch -" ] || exit 2
+line=0
+rc=0
+while read -r command; do
+    line=$((line + 1))
+    echo "$command" >> "$0.log"
+    case "$command" in
+    *203.0.113.*)
+        echo "Error: Nexthop has invalid gateway." >&2
+        echo "Command failed -:$line" >&2
+        rc=1;;
+    esac
+done
+echo "batch" >> "$0.calls"
+exit $rc
+"""
+
+# Stand-in for ovs-vsctl: it logs its arguments and fails when asked to set
+# a 'bogus' column, like a transaction rejected by ovsdb. The pmd-cpu-mask
+# is read from a fixture file.
+_FAKE_OVS_VSCTL = """#!/bin/sh
+case "$*" in
+*pmd-cpu-mask*)
+    cat "$0.pmd-cpu-mask" 2>/dev/null
+    exit 0;;
+esac
+echo "$*" >> "$0.log"
+case "$*" in
+*bogus*)
+    echo "ovs-vsctl: Bridge does not contain a column whose name matches" \\
+        "bogus" >&2
+    exit 1;;
+esac
+"""
+
+
+class TestIfcfgNetConfigApply(base.TestCase):
+
+    def setUp(self):
+        super(TestIfcfgNetConfigApply, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        for name, path_format in (('ifcfg_config_path', 'ifcfg-%s'),
+                                  ('bridge_config_path', 'ifcfg-%s'),
+                                  ('route_config_path', 'route-%s'),
+                                  ('route6_config_path', 'route6-%s'),
+                                  ('route_rule_config_path', 'rule-%s')):
+            self.stub_out('os_net_config.impl_ifcfg.%s' % name,
+                          lambda ifname, path_format=path_format:
+                              os.path.join(self.temp_dir,
+                                           path_format % ifname))
+        self.resolv_conf = os.path.join(self.temp_dir, 'resolv.conf')
+        self.stub_out('os_net_config.impl_ifcfg.resolv_conf_path',
+                      lambda: self.resolv_conf)
+        self.stub_out('os_net_config.impl_ifcfg.stop_dhclient_process',
+                      lambda interface: None)
+
+        self.fake_ip = os.path.join(self.temp_dir, 'ip')
+        with open(self.fake_ip, 'w') as f:
+            f.write(_FAKE_IP)
+        os.chmod(self.fake_ip, stat.S_IRWXU)
+        self.stub_out('os_net_config.utils.iproute2_path',
+                      lambda: self.fake_ip)
+
+        self.fake_ovs_vsctl = os.path.join(self.temp_dir, 'ovs-vsctl')
+        with open(self.fake_ovs_vsctl, 'w') as f:
+            f.write(_FAKE_OVS_VSCTL)
+        os.chmod(self.fake_ovs_vsctl, stat.S_IRWXU)
+        self.stub_out('os_net_config.impl_ifcfg.ovs_vsctl_path',
+                      lambda: self.fake_ovs_vsctl)
+
+        self.ifup_interface_names = []
+        execute = processutils.execute
+
+        def execute_stub(*args, **kwargs):
+            if args[0] in (self.fake_ip, self.fake_ovs_vsctl):
+                return execute(*args, **kwargs)
+            if args[0] == '/sbin/ifup':
+                self.ifup_interface_names.append(args[1])
+        self.stub_out('oslo_concurrency.processutils.execute', execute_stub)
+        self.stub_out('os_net_config.utils.is_active_nic',
+                      lambda interface: False)
+
+        self.stub_out('os_net_config.utils.is_ovs_installed', lambda: True)
+
+        self.provider = impl_ifcfg.IfcfgNetConfig()
+
+    def read_fake_ip_log(self, suffix, fake=None):
+        path = '%s.%s' % (fake or self.fake_ip, suffix)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return f.read().splitlines()
+
+    def add_interfaces(self, addresses, routes=None):
+        for name, address in sorted(addresses.items()):
+            interface_routes = [objects.Route(*route)
+                                for route in (routes or {}).get(name, [])]
+            self.provider.add_interface(objects.Interface(
+                name, addresses=[objects.Address(address)],
+                routes=interface_routes))
+
+    def test_ip_batch(self):
+        self.add_interfaces({'em1': '192.0.2.2/24', 'em2': '198.51.100.2/24'})
+        self.provider.apply()
+        self.assertEqual(['em1', 'em2'], self.ifup_interface_names)
+        self.assertEqual([], self.read_fake_ip_log('calls'))
+
+        self.ifup_interface_names = []
+        self.add_interfaces({'em1': '192.0.2.3/24', 'em2': '198.51.100.3/24'},
+                            {'em1': [('192.0.2.1', '172.19.0.0/24')]})
+        self.provider.apply()
+        self.assertEqual([], self.ifup_interface_names)
+        # One batch for the addresses and one for the routes
+        self.assertEqual(['batch', 'batch'], self.read_fake_ip_log('calls'))
+        self.assertEqual(['addr add 192.0.2.3/24 dev em1',
+                          'addr del 192.0.2.2/24 dev em1',
+                          'addr add 198.51.100.3/24 dev em2',
+                          'addr del 198.51.100.2/24 dev em2',
+                          'route add 172.19.0.0/24 via 192.0.2.1 dev em1'],
+                         self.read_fake_ip_log('log'))
+
+    def test_ip_batch_failure_restarts_interface(self):
+        self.add_interfaces({'em1': '192.0.2.2/24', 'em2': '198.51.100.2/24'})
+        self.provider.apply()
+
+        self.ifup_interface_names = []
+        self.add_interfaces({'em1': '192.0.2.3/24', 'em2': '203.0.113.2/24'})
+        self.provider.apply()
+        # All the commands are run, only em2 failed and is restarted
+        self.assertEqual(4, len(self.read_fake_ip_log('log')))
+        self.assertEqual(['em2'], self.ifup_interface_names)
+
+    def test_hitless_address_and_dns_change(self):
+        def add_vlan(addresses, dns_servers, domain):
+            self.provider.add_vlan(objects.Vlan(
+                'em1', 10, addresses=[objects.Address(address)
+                                      for address in addresses],
+                dns_servers=dns_servers, domain=domain))
+
+        with open(self.resolv_conf, 'w') as f:
+            f.write('search example.com\nnameserver 192.0.2.53\n'
+                    'nameserver 198.51.100.53\n')
+        add_vlan(['192.0.2.2/24', '192.0.2.3/24', '2001:db8::2/64'],
+                 ['192.0.2.53'], 'example.com')
+        self.provider.apply()
+        self.assertEqual(['vlan10'], self.ifup_interface_names)
+
+        self.ifup_interface_names = []
+        add_vlan(['192.0.2.2/24', '192.0.2.4/24', '2001:db8::2/64',
+                  '2001:db8::3/64'], ['192.0.2.54'], 'example.org')
+        self.provider.apply()
+        self.assertEqual([], self.ifup_interface_names)
+        self.assertEqual(['addr add 192.0.2.4/24 dev vlan10',
+                          'addr add 2001:db8::3/64 dev vlan10',
+                          'addr del 192.0.2.3/24 dev vlan10'],
+                         self.read_fake_ip_log('log'))
+        with open(self.resolv_conf) as f:
+            self.assertEqual('search example.org\nnameserver 192.0.2.54\n'
+                             'nameserver 198.51.100.53\n', f.read())
+
+    def test_hitless_first_and_last_dns_server(self):
+        with open(self.resolv_conf, 'w') as f:
+            f.write('nameserver 198.51.100.53\n')
+        self.add_interfaces({'em1': '192.0.2.2/24'})
+        self.provider.apply()
+        self.assertEqual(['em1'], self.ifup_interface_names)
+
+        # Adding the first server drops PEERDNS=no
+        self.ifup_interface_names = []
+        self.provider.add_interface(objects.Interface(
+            'em1', addresses=[objects.Address('192.0.2.2/24')],
+            dns_servers=['192.0.2.53']))
+        self.provider.apply()
+        self.assertEqual([], self.ifup_interface_names)
+        with open(self.resolv_conf) as f:
+            self.assertEqual('nameserver 192.0.2.53\n'
+                             'nameserver 198.51.100.53\n', f.read())
+
+        # Removing the last server sets PEERDNS=no again
+        self.add_interfaces({'em1': '192.0.2.2/24'})
+        self.provider.apply()
+        self.assertEqual([], self.ifup_interface_names)
+        with open(self.resolv_conf) as f:
+            self.assertEqual('nameserver 198.51.100.53\n', f.read())
+
+    def add_ovs_bridge(self, ovs_extra):
+        self.provider.add_interface(objects.Interface('em1'))
+        self.provider.add_bridge(objects.OvsBridge(
+            'br-ex', members=[objects.Interface('em1')], ovs_extra=ovs_extra))
+
+    def test_ovs_extra_transaction(self):
+        self.add_ovs_bridge(['set bridge br-ex fail_mode=standalone',
+                             'set bridge br-ex other-config:foo=bar'])
+        self.provider.apply()
+        self.assertIn('br-ex', self.ifup_interface_names)
+
+        self.ifup_interface_names = []
+        self.add_ovs_bridge(['set bridge br-ex fail_mode=secure',
+                             'set port em1 tag=10'])
+        self.provider.apply()
+        self.assertEqual([], self.ifup_interface_names)
+        self.assertEqual(['-t 10 -- remove bridge br-ex other-config foo '
+                          '-- set bridge br-ex fail_mode=secure '
+                          '-- set port em1 tag=10'],
+                         self.read_fake_ip_log('log', self.fake_ovs_vsctl))
+
+    def test_ovs_extra_transaction_failure_restarts_bridge(self):
+        self.add_ovs_bridge(['set bridge br-ex fail_mode=standalone'])
+        self.provider.apply()
+
+        self.ifup_interface_names = []
+        self.add_ovs_bridge(['set bridge br-ex bogus=1'])
+        self.provider.apply()
+        self.assertEqual(1, len(self.read_fake_ip_log('log',
+                                                      self.fake_ovs_vsctl)))
+        self.assertIn('br-ex', self.ifup_interface_names)
+        self.assertIn('em1', self.ifup_interface_names)
+
+    def test_ovs_extra_removal_requires_restart(self):
+        self.add_ovs_bridge(['br-set-external-id br-ex bridge-id br-ex'])
+        self.provider.apply()
+
+        self.ifup_interface_names = []
+        self.add_ovs_bridge([])
+        self.provider.apply()
+        self.assertEqual([], self.read_fake_ip_log('log',
+                                                   self.fake_ovs_vsctl))
+        self.assertIn('br-ex', self.ifup_interface_names)
+
+    def stub_dpdk(self):
+        self.stub_out('os_net_config.utils.bind_dpdk_interfaces',
+                      lambda ifname, driver, noop: None)
+        self.stub_out('os_net_config.utils.get_dpdk_devargs',
+                      lambda ifname, noop: '0000:00:08.0')
+        self.stub_out('os_net_config.common.is_mellanox_interface',
+                      lambda ifname: False)
+        self.stub_out('os_net_config.impl_ifcfg.remove_ifcfg_config',
+                      lambda ifname: None)
+        execute_strings = []
+
+        def execute_stub(*args, **kwargs):
+            execute_strings.append(args[1])
+        self.stub_out('os_net_config.NetConfig.execute', execute_stub)
+        return execute_strings
+
+    def add_dpdk_port(self, **kwargs):
+        dpdk_port = objects.OvsDpdkPort(
+            'dpdk0', members=[objects.Interface('em1')], **kwargs)
+        bridge = objects.OvsUserBridge('br-link', members=[dpdk_port])
+        self.provider.add_ovs_dpdk_port(dpdk_port)
+        self.provider.add_bridge(bridge)
+
+    def test_dpdk_port_hotplug(self):
+        execute_strings = self.stub_dpdk()
+        self.add_dpdk_port(rx_queue=2)
+        self.provider.apply()
+        self.assertNotIn('Restart openvswitch', execute_strings)
+        self.assertIn('Running ovs-vsctl -t 10 '
+                      '-- --if-exists del-port br-link dpdk0 '
+                      '-- add-port br-link dpdk0 '
+                      '-- set Interface dpdk0 type=dpdk '
+                      '-- set Interface dpdk0 '
+                      'options:dpdk-devargs=0000:00:08.0 '
+                      '-- set Interface dpdk0 options:n_rxq=2',
+                      execute_strings)
+        self.assertEqual("Running ovs-appctl dpif-netdev/pmd-rxq-rebalance "
+                         "()", execute_strings[-1])
+        self.assertNotIn('running ifdown on interface: dpdk0',
+                         execute_strings)
+
+    def test_dpdk_queue_tuning(self):
+        execute_strings = self.stub_dpdk()
+        self.add_dpdk_port(rx_queue=2, mtu=9000)
+        self.provider.apply()
+
+        del execute_strings[:]
+        self.add_dpdk_port(rx_queue=4, rx_queue_size=2048, mtu=9100)
+        self.provider.apply()
+        self.assertEqual(['Running ovs-vsctl -t 10 '
+                          '-- set Interface dpdk0 mtu_request=9100 '
+                          '-- set Interface dpdk0 options:n_rxq=4 '
+                          '-- set Interface dpdk0 options:n_rxq_desc=2048',
+                          "Running ovs-appctl dpif-netdev/pmd-rxq-rebalance "
+                          "()"],
+                         execute_strings)
+
+        # The queues are not rebalanced for the other OVS_EXTRA changes
+        del execute_strings[:]
+        self.add_dpdk_port(rx_queue=4, rx_queue_size=2048, mtu=9000)
+        self.provider.apply()
+        self.assertEqual(['Running ovs-vsctl -t 10 '
+                          '-- set Interface dpdk0 mtu_request=9000'],
+                         execute_strings)
+
+    def test_dpdk_rxq_affinity(self):
+        self.stub_dpdk()
+        devargs = {'em1': '0000:00:08.0', 'em2': '0000:00:09.0'}
+        self.stub_out('os_net_config.utils.get_dpdk_devargs',
+                      lambda ifname, noop: devargs[ifname])
+        sysfs = os.path.join(self.temp_dir, 'sys')
+        for path, data in (('bus/pci/devices/0000:00:08.0/numa_node', '1'),
+                           ('bus/pci/devices/0000:00:09.0/numa_node', '1'),
+                           ('devices/system/node/node0/cpulist', '0-3'),
+                           ('devices/system/node/node1/cpulist', '4-11')):
+            os.makedirs(os.path.dirname(os.path.join(sysfs, path)),
+                        exist_ok=True)
+            with open(os.path.join(sysfs, path), 'w') as f:
+                f.write('%s\n' % data)
+        self.stub_out('os_net_config.common._SYS_BUS_PCI_DEV',
+                      os.path.join(sysfs, 'bus/pci/devices'))
+        self.stub_out('os_net_config.impl_ifcfg._SYS_DEVICES_NODE',
+                      os.path.join(sysfs, 'devices/system/node'))
+        with open(self.fake_ovs_vsctl + '.pmd-cpu-mask', 'w') as f:
+            f.write('"0xf0f"\n')
+        mask_reads = []
+        pmd_cpu_mask = impl_ifcfg.pmd_cpu_mask
+
+        def pmd_cpu_mask_stub():
+            mask_reads.append(True)
+            return pmd_cpu_mask()
+        self.stub_out('os_net_config.impl_ifcfg.pmd_cpu_mask',
+                      pmd_cpu_mask_stub)
+
+        for name, nic, rx_queue in (('dpdk0', 'em1', 2),
+                                    ('dpdk1', 'em2', 3)):
+            self.provider.add_ovs_dpdk_port(objects.OvsDpdkPort(
+                name, members=[objects.Interface(nic)], rx_queue=rx_queue,
+                rxq_affinity='auto'))
+        # Only the PMDs 8-11 are on the NUMA node 1 of the NICs
+        self.assertIn('set Interface $DEVICE '
+                      'other_config:pmd-rxq-affinity=0:8,1:9"',
+                      self.provider.interface_data['dpdk0'])
+        self.assertIn('set Interface $DEVICE '
+                      'other_config:pmd-rxq-affinity=0:10,1:11,2:8"',
+                      self.provider.interface_data['dpdk1'])
+        # ovs-vsctl is run once for the pmd-cpu-mask of all the ports
+        self.assertEqual(1, len(mask_reads))
+
+    def test_file_snapshot(self):
+        addresses = {'em1': '192.0.2.2/24', 'em2': '198.51.100.2/24'}
+        routes = {'em1': [('192.0.2.1', '172.19.0.0/24')]}
+        self.add_interfaces(addresses, routes)
+        self.provider.apply()
+
+        reads = collections.Counter()
+        get_file_data = common.get_file_data
+
+        def get_file_data_stub(filename):
+            reads[filename] += 1
+            return get_file_data(filename)
+        self.stub_out('os_net_config.common.get_file_data',
+                      get_file_data_stub)
+        self.add_interfaces(addresses, routes)
+        self.assertEqual({}, self.provider.apply())
+        # Each config file is read once by a no-op apply
+        self.assertIn(os.path.join(self.temp_dir, 'ifcfg-em1'), reads)
+        self.assertEqual({1}, set(reads.values()))
+        self.assertIsNone(self.provider.file_snapshot)
+
+    def test_file_snapshot_cleared_on_error(self):
+        self.add_interfaces({'em1': '192.0.2.2/24'})
+
+        def run_restarts(action, levels):
+            raise os_net_config.ConfigurationError('ifdown failed')
+        self.provider.run_restarts = run_restarts
+        self.assertRaises(os_net_config.ConfigurationError,
+                          self.provider.apply)
+        self.assertIsNone(self.provider.file_snapshot)
+        self.assertIsNone(self.provider.member_closure)
+
+    def test_bridge_route_change_with_restart(self):
+        routes = [objects.Route('192.0.2.1', '172.19.0.0/24')]
+        self.add_ovs_bridge(['br-set-external-id br-ex bridge-id br-ex'])
+        self.provider.apply()
+
+        # The routes of a restarted OVS bridge are set by its ifup
+        self.ifup_interface_names = []
+        self.provider.add_interface(objects.Interface('em1'))
+        self.provider.add_bridge(objects.OvsBridge(
+            'br-ex', members=[objects.Interface('em1')], routes=routes))
+        self.provider.apply()
+        self.assertIn('br-ex', self.ifup_interface_names)
+        self.assertEqual([], self.read_fake_ip_log('log'))
+        with open(os.path.join(self.temp_dir, 'route-br-ex')) as f:
+            self.assertIn('172.19.0.0/24 via 192.0.2.1 dev br-ex', f.read())
+
+    def test_team_and_bond_rules_applied_live(self):
+        def add_team_and_bond(rules):
+            for master, names in (('bond0', ['em1', 'em2']),
+                                  ('team0', ['em3', 'em4'])):
+                members = [objects.Interface(name) for name in names]
+                for member in members:
+                    self.provider.add_interface(member)
+                if master == 'bond0':
+                    self.provider.add_linux_bond(objects.LinuxBond(
+                        master, members=members, rules=rules))
+                else:
+                    self.provider.add_linux_team(objects.LinuxTeam(
+                        master, members=members, rules=rules))
+
+        add_team_and_bond([])
+        self.provider.apply()
+
+        self.ifup_interface_names = []
+        add_team_and_bond([objects.RouteRule('from 192.0.2.0/24 table 200')])
+        self.provider.apply()
+        self.assertEqual([], self.ifup_interface_names)
+        self.assertEqual(['rule add from 192.0.2.0/24 table 200',
+                          'rule add from 192.0.2.0/24 table 200'],
+                         self.read_fake_ip_log('log'))
+
+    def test_linux_bridge_route6(self):
+        self.provider.add_interface(objects.Interface('em1'))
+        self.provider.add_linux_bridge(objects.LinuxBridge(
+            'br0', members=[objects.Interface('em1')],
+            routes=[objects.Route('192.0.2.1', '172.19.0.0/24'),
+                    objects.Route('2001:db8::1', '2001:db8:1::/64')]))
+        self.provider.apply()
+        with open(os.path.join(self.temp_dir, 'route-br0')) as f:
+            route_data = f.read()
+        with open(os.path.join(self.temp_dir, 'route6-br0')) as f:
+            route6_data = f.read()
+        self.assertIn('172.19.0.0/24 via 192.0.2.1 dev br0', route_data)
+        self.assertNotIn('2001:db8', route_data)
+        self.assertIn('2001:db8:1::/64 via 2001:db8::1 dev br0', route6_data)
+
+    def test_planning_linear(self):
+        calls = []
+
+        def count(cls, method):
+            func = getattr(cls, method)
+
+            def counted(*args, **kwargs):
+                calls.append(method)
+                return func(*args, **kwargs)
+            self.stub_out('os_net_config.impl_ifcfg.%s.%s' %
+                          (cls.__name__, method), counted)
+        for method in ('get_ifcfg_values', 'diff', 'child_members'):
+            count(impl_ifcfg.IfcfgNetConfig, method)
+        for method in ('add', '__contains__'):
+            count(impl_ifcfg.RestartSet, method)
+
+        def planning_ops(count):
+            del calls[:]
+            provider = impl_ifcfg.IfcfgNetConfig(noop=True)
+            provider.add_interface(objects.Interface('em1'))
+            for vlan_id in range(1, count + 1):
+                provider.add_vlan(objects.Vlan(
+                    'em1', vlan_id, addresses=[objects.Address(
+                        '10.%d.%d.1/24' % divmod(vlan_id, 250))]))
+            provider.apply(activate=False)
+            return len(calls)
+
+        # A quadratic planner does 4 times the work for twice the vlans
+        small = planning_ops(100)
+        self.assertGreater(small, 100)
+        self.assertLessEqual(planning_ops(200), small * 2)
+
+    def test_member_closure(self):
+        self.provider.member_names = {'br-ex': ['bond0', 'vlan10'],
+                                      'bond0': ['em1', 'em2'],
+                                      'br-int': ['em3']}
+        closure = impl_ifcfg.MemberClosure(self.provider.member_names)
+        self.assertEqual({'bond0', 'vlan10', 'em1', 'em2'},
+                         closure.descendants('br-ex'))
+        self.assertEqual(set(), closure.descendants('em1'))
+        self.assertEqual({'br-ex', 'bond0'}, closure.ancestors('em1'))
+        self.assertEqual({'br-ex'}, closure.ancestors('bond0'))
+        self.assertEqual(set(), closure.ancestors('br-ex'))
+        # Without an apply in progress, the closure is computed on demand
+        self.assertEqual({'em1', 'em2'}, self.provider.child_members('bond0'))
+        self.assertEqual({'br-int'}, self.provider.member_masters('em3'))
+
+    def test_restart_levels(self):
+        levels = []
+        barriers = {}
+        lock = threading.Lock()
+
+        def ifup(interface, iftype='interface'):
+            # Each restart of a level waits for all the others, a level which
+            # is not run concurrently breaks its barrier
+            barriers[interface].wait(timeout=5)
+            with lock:
+                self.ifup_interface_names.append(interface)
+        self.provider.ifup = ifup
+        run_restarts = self.provider.run_restarts
+
+        def record_restarts(action, restart_levels):
+            if action == ifup:
+                for level in restart_levels:
+                    names = [name for name, _ in level]
+                    levels.append(sorted(names))
+                    barrier = threading.Barrier(
+                        min(impl_ifcfg.RESTART_WORKERS, len(level)))
+                    barriers.update((name, barrier) for name in names)
+            run_restarts(action, restart_levels)
+        self.provider.run_restarts = record_restarts
+
+        for bond_name, members, vlan_ids in (
+                ('bond0', ['em1', 'em2'], [10, 11, 12, 13]),
+                ('bond1', ['em3', 'em4'], [20, 21, 22, 23])):
+            interfaces = [objects.Interface(name) for name in members]
+            for interface in interfaces:
+                self.provider.add_interface(interface)
+            self.provider.add_linux_bond(
+                objects.LinuxBond(bond_name, members=interfaces))
+            for vlan_id in vlan_ids:
+                self.provider.add_vlan(objects.Vlan(bond_name, vlan_id))
+        self.provider.apply()
+
+        # Slaves, one at a time per bond, then bonds, then vlans, each level
+        # being run concurrently
+        self.assertEqual([['em1', 'em3'], ['em2', 'em4'], ['bond0', 'bond1'],
+                          ['vlan10', 'vlan11', 'vlan12', 'vlan13',
+                           'vlan20', 'vlan21', 'vlan22', 'vlan23']],
+                         levels)
+        self.assertEqual(sorted(sum(levels, [])),
+                         sorted(self.ifup_interface_names))
+
+    def test_vlans_restarted_last(self):
+        calls = []
+        self.provider.ifup = \
+            lambda interface, iftype='interface': calls.append(interface)
+        self.provider.ovs_appctl = \
+            lambda action, *params: calls.append(action)
+        interfaces = [objects.Interface('em1', primary=True),
+                      objects.Interface('em2')]
+        bond = objects.OvsBond('bond0', members=interfaces)
+        self.provider.add_bond(bond)
+        for interface in interfaces:
+            self.provider.add_interface(interface)
+        self.provider.add_ib_interface(objects.IbInterface('ib0'))
+        self.provider.add_ib_child_interface(
+            objects.IbChildInterface('ib0', pkey_id=100))
+        self.provider.add_vlan(objects.Vlan('em1', 10))
+        self.provider.apply()
+        # As before the restarts were planned by level, the vlans and the ib
+        # childs come up after the active OVS bond members are set
+        self.assertEqual('bond/set-active-slave', calls[-3])
+        self.assertEqual(['ib0.8064', 'vlan10'], sorted(calls[-2:]))
@@ -14,11 +14,16 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import logging
 import os.path
+import shutil
+import tempfile
 import yaml
 
+import os_net_config
 from os_net_config import impl_nmstate
 from os_net_config import objects
+from os_net_config import utils
 from os_net_config.tests import base
 
 TEST_ENV_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__),
@@ -144,6 +149,32 @@ _V6_NMCFG_MULTIPLE = _V6_NMCFG + """    - ip: 2001:abc:b::1
 """
 
 
+_RUNNING_IFACES = """
+- name: em1
+  type: ethernet
+  state: up
+  ethernet: {}
+  ipv4:
+    enabled: false
+    dhcp: false
+  ipv6:
+    enabled: false
+    dhcp: false
+    autoconf: false
+- name: eno2
+  type: ethernet
+  state: up
+  ethernet: {}
+  ipv4:
+    enabled: false
+    dhcp: false
+  ipv6:
+    enabled: false
+    dhcp: false
+    autoconf: false
+"""
+
+
 class TestNmstateNetConfig(base.TestCase):
     def setUp(self):
         super(TestNmstateNetConfig, self).setUp()
@@ -286,17 +317,500 @@ class TestNmstateNetConfig(base.TestCase):
         self.assertEqual(yaml.safe_load(test_dns_config3),
                          self.get_dns_data())
 
+    def test_add_vlan(self):
+        vlan = objects.Vlan('em1', 5,
+                            addresses=[objects.Address('192.168.1.2/24')])
+        self.provider.add_vlan(vlan)
+        vlan_config = """
+name: vlan5
+type: vlan
+state: up
+vlan:
+  id: 5
+  base-iface: em1
+ipv4:
+  enabled: true
+  dhcp: false
+  address:
+  - ip: 192.168.1.2
+    prefix-length: 24
+ipv6:
+  enabled: false
+  autoconf: false
+  dhcp: false
+"""
+        self.assertEqual(yaml.safe_load(vlan_config),
+                         self.provider.vlan_data['vlan5'])
+
+    def test_add_vlan_from_interface_name(self):
+        interface = objects.Interface('em1.10', mtu=1400)
+        self.provider.add_interface(interface)
+        self.assertNotIn('em1.10', self.provider.interface_data)
+        vlan_data = self.provider.vlan_data['em1.10']
+        self.assertEqual('vlan', vlan_data['type'])
+        self.assertEqual({'id': 10, 'base-iface': 'em1'}, vlan_data['vlan'])
+        self.assertEqual(1400, vlan_data['mtu'])
+
+    def test_add_vlan_on_linux_bond(self):
+        vlan = objects.Vlan(None, 20)
+        vlan.linux_bond_name = 'bond1'
+        self.provider.add_vlan(vlan)
+        self.assertEqual({'id': 20, 'base-iface': 'bond1'},
+                         self.provider.vlan_data['vlan20']['vlan'])
+
+    def test_add_routes(self):
+        route_table = objects.RouteTable('custom', 200)
+        self.provider.add_route_table(route_table)
+        routes = [objects.Route('192.168.1.1', default=True),
+                  objects.Route('192.168.1.1', '172.19.0.0/24',
+                                route_options='metric 10'),
+                  objects.Route('192.168.1.5', '172.20.0.0/24',
+                                route_table='custom'),
+                  objects.Route('2001:db8::1', default=True,
+                                route_options='metric 100 table 201')]
+        interface = objects.Interface('em1', routes=routes)
+        self.provider.add_interface(interface)
+        routes_config = """
+- destination: 0.0.0.0/0
+  next-hop-address: 192.168.1.1
+  next-hop-interface: em1
+- destination: 172.19.0.0/24
+  next-hop-address: 192.168.1.1
+  next-hop-interface: em1
+  metric: 10
+- destination: 172.20.0.0/24
+  next-hop-address: 192.168.1.5
+  next-hop-interface: em1
+  table-id: 200
+- destination: ::/0
+  next-hop-address: 2001:db8::1
+  next-hop-interface: em1
+  metric: 100
+  table-id: 201
+"""
+        self.assertEqual(yaml.safe_load(routes_config),
+                         self.provider.route_data['em1'])
+
+    def test_add_rules(self):
+        rules = [objects.RouteRule('add from 192.0.2.0/24 table 200 '
+                                   'prio 1000'),
+                 objects.RouteRule('iif em1 blackhole priority 10'),
+                 objects.RouteRule('del to all table 201')]
+        interface = objects.Interface('em1', rules=rules)
+        self.provider.add_interface(interface)
+        rules_config = """
+- ip-from: 192.0.2.0/24
+  route-table: 200
+  priority: 1000
+- iif: em1
+  action: blackhole
+  priority: 10
+  family: ipv4
+- state: absent
+  route-table: 201
+  family: ipv4
+"""
+        self.assertEqual(yaml.safe_load(rules_config),
+                         self.provider.rules_data)
+
+    def test_invalid_rules(self):
+        interface = objects.Interface(
+            'em1', rules=[objects.RouteRule('from 192.0.2.0/24 via em1')])
+        self.assertRaises(os_net_config.ConfigurationError,
+                          self.provider.add_interface, interface)
+        interface = objects.Interface(
+            'em1', rules=[objects.RouteRule('from 192.0.2.0/24 table')])
+        self.assertRaises(os_net_config.ConfigurationError,
+                          self.provider.add_interface, interface)
+
+    def test_add_linux_bond(self):
+        nic_config = """
+- type: linux_bond
+  name: bond1
+  bonding_options: "mode=active-backup miimon=100"
+  members:
+  - type: interface
+    name: em1
+    primary: true
+  - type: interface
+    name: em2
+  addresses:
+  - ip_netmask: 192.168.1.2/24
+"""
+        for obj_json in yaml.safe_load(nic_config):
+            self.provider.add_object(objects.object_from_json(obj_json))
+        bond_config = """
+name: bond1
+type: bond
+state: up
+link-aggregation:
+  mode: active-backup
+  options:
+    miimon: 100
+    primary: em1
+  port:
+  - em1
+  - em2
+ipv4:
+  enabled: true
+  dhcp: false
+  address:
+  - ip: 192.168.1.2
+    prefix-length: 24
+ipv6:
+  enabled: false
+  autoconf: false
+  dhcp: false
+"""
+        self.assertEqual(yaml.safe_load(bond_config),
+                         self.provider.linuxbond_data['bond1'])
+        self.assertEqual('ethernet', self.get_interface_config('em2')['type'])
+
+    def test_add_ovs_bridge_with_bond_and_vlan(self):
+        nic_config = """
+- type: ovs_bridge
+  name: br-ex
+  mtu: 9000
+  addresses:
+  - ip_netmask: 192.168.1.2/24
+  ovs_extra:
+  - set bridge {name} stp_enable=true other_config:mac-table-size=50000
+  - br-set-external-id {name} bridge-id br-ex
+  - set port {name} tag=10
+  members:
+  - type: ovs_bond
+    name: bond1
+    mtu: 9000
+    ovs_options: "bond_mode=balance-slb other_config:bond-miimon-interval=100"
+    ovs_extra:
+    - set port {name} bond_updelay=1000 other_config:lacp-time=fast
+    members:
+    - type: interface
+      name: em1
+      primary: true
+    - type: interface
+      name: em2
+  - type: vlan
+    vlan_id: 20
+    addresses:
+    - ip_netmask: 172.17.0.2/24
+"""
+        for obj_json in yaml.safe_load(nic_config):
+            self.provider.add_object(objects.object_from_json(obj_json))
+        bridge_config = """
+name: br-ex
+type: ovs-bridge
+state: up
+bridge:
+  options:
+    fail-mode: standalone
+    mcast-snooping-enable: false
+    rstp: false
+    stp: true
+  port:
+  - name: bond1
+    link-aggregation:
+      mode: balance-slb
+      bond-updelay: 1000
+      port:
+      - name: em1
+      - name: em2
+      ovs-db:
+        other_config:
+          bond-miimon-interval: 100
+          bond-primary: em1
+          lacp-time: fast
+  - name: vlan20
+    vlan:
+      mode: access
+      tag: 20
+  - name: br-ex
+    vlan:
+      mode: access
+      tag: 10
+ovs-db:
+  external_ids:
+    bridge-id: br-ex
+  other_config:
+    mac-table-size: 50000
+"""
+        self.assertEqual(yaml.safe_load(bridge_config),
+                         self.provider.bridge_data['br-ex'])
+        internal_iface = self.get_interface_config('br-ex')
+        self.assertEqual('ovs-interface', internal_iface['type'])
+        self.assertEqual(9000, internal_iface['mtu'])
+        self.assertEqual([{'ip': '192.168.1.2', 'prefix-length': 24}],
+                         internal_iface['ipv4']['address'])
+        vlan_data = self.provider.vlan_data['vlan20']
+        self.assertEqual('ovs-interface', vlan_data['type'])
+        self.assertNotIn('vlan', vlan_data)
+        self.assertEqual('ethernet', self.get_interface_config('em2')['type'])
+        self.assertEqual(9000, self.get_interface_config('em2')['mtu'])
+
+    def test_add_ovs_bond_unsupported(self):
+        members = [objects.Interface('em1'), objects.Interface('em2')]
+        bond = objects.OvsBond('bond1', members=members, addresses=[
+            objects.Address('192.168.1.2/24')])
+        self.assertRaises(os_net_config.ConfigurationError,
+                          self.provider.add_bond, bond)
+        bond = objects.OvsBond('bond1', members=members, ovs_extra=[
+            'set interface em1 other_config:foo=bar'])
+        self.assertRaises(os_net_config.ConfigurationError,
+                          self.provider.get_ovs_ports, [bond])
+
+    def test_add_ovs_bridge_primary_mac(self):
+        self.stub_out('os_net_config.common.interface_mac',
+                      lambda name: 'a1:b2:c3:d4:e5:f6')
+        interface = objects.Interface('em1', primary=True)
+        bridge = objects.OvsBridge('br-ctlplane', members=[interface])
+        self.provider.add_bridge(bridge)
+        self.assertEqual(
+            {'hwaddr': 'a1:b2:c3:d4:e5:f6'},
+            self.provider.bridge_data['br-ctlplane']['ovs-db'][
+                'other_config'])
+        self.assertEqual('a1:b2:c3:d4:e5:f6',
+                         self.get_interface_config('br-ctlplane')[
+                             'mac-address'])
+
+    def test_add_ovs_user_bridge_with_dpdk_bond(self):
+        self.stub_out('os_net_config.utils.bind_dpdk_interfaces',
+                      lambda ifname, driver, noop: None)
+        devargs = {'em1': '0000:00:08.0', 'em2': '0000:00:09.0'}
+        self.stub_out('os_net_config.utils.get_dpdk_devargs',
+                      lambda ifname, noop: devargs[ifname])
+        nic_config = """
+- type: ovs_user_bridge
+  name: br-link
+  members:
+  - type: ovs_dpdk_bond
+    name: dpdkbond0
+    mtu: 9000
+    rx_queue: 4
+    members:
+    - type: ovs_dpdk_port
+      name: dpdk0
+      rx_queue_size: 2048
+      members:
+      - type: interface
+        name: em1
+    - type: ovs_dpdk_port
+      name: dpdk1
+      ovs_extra:
+      - set Interface {name} options:n_txq_desc=4096
+      members:
+      - type: interface
+        name: em2
+"""
+        for obj_json in yaml.safe_load(nic_config):
+            self.provider.add_object(objects.object_from_json(obj_json))
+        bridge_data = self.provider.bridge_data['br-link']
+        self.assertEqual('netdev',
+                         bridge_data['bridge']['options']['datapath'])
+        self.assertEqual([{'name': 'dpdk0'}, {'name': 'dpdk1'}],
+                         bridge_data['bridge']['port'][0][
+                             'link-aggregation']['port'])
+        dpdk0 = self.get_interface_config('dpdk0')
+        self.assertEqual('ovs-interface', dpdk0['type'])
+        self.assertEqual(9000, dpdk0['mtu'])
+        self.assertEqual({'devargs': '0000:00:08.0', 'rx-queue': 4,
+                          'n_rxq_desc': 2048}, dpdk0['dpdk'])
+        dpdk1 = self.get_interface_config('dpdk1')
+        self.assertEqual({'devargs': '0000:00:09.0', 'rx-queue': 4,
+                          'n_txq_desc': 4096}, dpdk1['dpdk'])
+
+    def stub_sriov_vfs(self, vf_names):
+        def get_vf_devname(device, vfid):
+            if (device, vfid) not in vf_names:
+                raise utils.SriovVfNotFoundException()
+            return vf_names[(device, vfid)]
+        self.stub_out('os_net_config.utils.get_vf_devname', get_vf_devname)
+        self.stub_out('os_net_config.utils.get_pci_address',
+                      lambda ifname, noop: None)
+        self.stub_out('os_net_config.utils.get_stored_pci_address',
+                      lambda ifname, noop: None)
+        self.stub_out('os_net_config.utils.update_sriov_vf_map',
+                      lambda *args, **kwargs: None)
+
+    def test_add_sriov_pf_and_vfs(self):
+        self.stub_sriov_vfs({('eth2', 1): 'eth2_1', ('eth2', 3): 'eth2_3'})
+        nic_config = """
+- type: sriov_pf
+  name: eth2
+  numvfs: 4
+- type: sriov_vf
+  device: eth2
+  vfid: 3
+  vlan_id: 111
+  qos: 1
+  spoofcheck: false
+  trust: true
+  max_tx_rate: 100
+  addresses:
+  - ip_netmask: 192.0.2.1/24
+- type: sriov_vf
+  device: eth2
+  vfid: 1
+  macaddr: 00:11:22:33:44:55
+  promisc: false
+"""
+        for obj_json in yaml.safe_load(nic_config):
+            self.provider.add_object(objects.object_from_json(obj_json))
+        self.provider.set_sriov_vfs()
+        pf_config = """
+name: eth2
+type: ethernet
+state: up
+accept-all-mac-addresses: true
+ethernet:
+  sr-iov:
+    total-vfs: 4
+    vfs:
+    - id: 1
+      mac-address: 00:11:22:33:44:55
+    - id: 3
+      spoof-check: false
+      trust: true
+      max-tx-rate: 100
+      vlan-id: 111
+      qos: 1
+ipv4:
+  enabled: false
+  dhcp: false
+ipv6:
+  enabled: false
+  autoconf: false
+  dhcp: false
+"""
+        self.assertEqual(yaml.safe_load(pf_config),
+                         self.get_interface_config('eth2'))
+        vf = self.get_interface_config('eth2_3')
+        self.assertEqual('ethernet', vf['type'])
+        self.assertEqual([{'ip': '192.0.2.1', 'prefix-length': 24}],
+                         vf['ipv4']['address'])
+        self.assertFalse(
+            self.get_interface_config('eth2_1')['accept-all-mac-addresses'])
+
+    def test_add_sriov_vf_not_created(self):
+        self.stub_sriov_vfs({})
+        vf_json = {'type': 'sriov_vf', 'device': 'eth2', 'vfid': 0}
+        self.assertRaises(utils.SriovVfNotFoundException,
+                          objects.object_from_json, vf_json)
+
+        objects.use_sriov_vf_refs()
+        self.addCleanup(objects.use_sriov_vf_refs, False)
+        vf = objects.object_from_json(dict(vf_json, vlan_id=20))
+        self.assertEqual('sriov:eth2:0', vf.name)
+        self.provider.add_object(objects.SriovPF('eth2', 2))
+        self.provider.add_object(vf)
+        self.provider.set_sriov_vfs()
+        # The VF is only configured in the sr-iov subtree of its PF
+        self.assertNotIn('sriov:eth2:0', self.provider.interface_data)
+        self.assertEqual(
+            [{'id': 0, 'vlan-id': 20}],
+            self.get_interface_config('eth2')['ethernet']['sr-iov']['vfs'])
+
+        # The interface config of a VF needs its device
+        self.assertRaises(objects.InvalidConfigException,
+                          objects.object_from_json,
+                          dict(vf_json, addresses=[
+                              {'ip_netmask': '192.0.2.1/24'}]))
+        self.assertRaises(objects.InvalidConfigException,
+                          objects.object_from_json,
+                          {'type': 'linux_bond', 'name': 'bond0',
+                           'members': [vf_json]})
+
+
+class TestNmstateStateDiff(base.TestCase):
+
+    def test_normalized_values_match(self):
+        running = yaml.safe_load("""
+name: eno2
+mtu: 9000
+mac-address: AA:BB:CC:DD:EE:FF
+ipv4:
+  enabled: true
+  address:
+  - ip: 192.168.1.2
+    prefix-length: 24
+ipv6:
+  enabled: true
+  address:
+  - ip: 2001:abc:a::2
+    prefix-length: 64
+""")
+        desired = yaml.safe_load("""
+name: eno2
+mtu: '9000'
+mac-address: aa:bb:cc:dd:ee:ff
+ipv4:
+  enabled: 'yes'
+  address:
+  - ip: 192.168.1.2/24
+ipv6:
+  enabled: true
+  address:
+  - ip: 2001:0abc:000a:0:0:0:0:2
+    prefix-length: '64'
+""")
+        self.assertEqual(set(), impl_nmstate.state_diff(running, desired))
+        self.assertTrue(impl_nmstate.is_dict_subset(running, desired))
+
+    def test_changed_paths(self):
+        running = yaml.safe_load("""
+name: eno2
+mtu: 1500
+ipv4:
+  enabled: true
+  address:
+  - ip: 192.168.1.2
+    prefix-length: 24
+  - ip: 192.168.1.3
+    prefix-length: 24
+""")
+        desired = yaml.safe_load("""
+name: eno2
+mtu: 9000
+ethernet: {}
+ipv4:
+  enabled: true
+  address:
+  - ip: 192.168.1.2
+    prefix-length: 24
+""")
+        self.assertEqual({'mtu', 'ethernet', 'ipv4.address'},
+                         impl_nmstate.state_diff(running, desired))
+        self.assertEqual({'name', 'mtu', 'ethernet', 'ipv4'},
+                         impl_nmstate.state_diff(None, desired))
+
+    def test_list_items_subset(self):
+        running = {'routes': [{'destination': '0.0.0.0/0',
+                               'next-hop-address': '192.168.1.1',
+                               'metric': 100}]}
+        desired = {'routes': [{'destination': '0.0.0.0/0',
+                               'next-hop-address': '192.168.1.1'}]}
+        self.assertEqual(set(), impl_nmstate.state_diff(running, desired))
+        desired['routes'][0]['next-hop-address'] = '192.168.1.254'
+        self.assertEqual({'routes'},
+                         impl_nmstate.state_diff(running, desired))
+
 
 class TestNmstateNetConfigApply(base.TestCase):
 
     def setUp(self):
         super(TestNmstateNetConfigApply, self).setUp()
 
-        def test_iface_state(iface_data='', verify_change=True):
+        def test_iface_state(iface_data='', verify_change=True,
+                             save_to_disk=True):
             # This function returns None
             return None
         self.stub_out(
             'libnmstate.netapplier.apply', test_iface_state)
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.stub_out('os_net_config.impl_nmstate.FINGERPRINT_FILE',
+                      os.path.join(self.temp_dir, 'fingerprints.json'))
+        self.stub_out('os_net_config.impl_nmstate.RUNTIME_STATE_FILE',
+                      os.path.join(self.temp_dir, 'runtime_state.json'))
         self.provider = impl_nmstate.NmstateNetConfig()
 
     def add_object(self, nic_config):
@@ -329,3 +843,792 @@ class TestNmstateNetConfigApply(base.TestCase):
         self.assertEqual(yaml.load(_BASE_IFACE_CFG_APPLIED,
                                    Loader=yaml.SafeLoader),
                          updated_files)
+
+    def test_running_config_queried_once(self):
+        running_info = {'interfaces': yaml.safe_load(_RUNNING_IFACES)}
+        calls = []
+
+        def show_running_info_stub():
+            calls.append(True)
+            return running_info
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      show_running_info_stub)
+
+        self.add_object(_BASE_IFACE_CFG)
+        self.provider.apply()
+        self.assertEqual(1, len(calls))
+
+        # The snapshot is reused until a refresh is requested
+        self.assertEqual('em1', self.provider.iface_state('em1')['name'])
+        self.assertIsNone(self.provider.iface_state('em3'))
+        self.assertEqual(2, len(calls))
+        self.provider.get_running_state(refresh=True)
+        self.assertEqual(3, len(calls))
+
+    def test_cleanup_takes_new_snapshot(self):
+        running_info = {'interfaces': yaml.safe_load(_RUNNING_IFACES)}
+        calls = []
+
+        def show_running_info_stub():
+            calls.append(True)
+            return running_info
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      show_running_info_stub)
+
+        self.add_object(_BASE_IFACE_CFG)
+        self.provider.apply(cleanup=True)
+        self.assertEqual(2, len(calls))
+        # The running config held by the snapshot is left untouched
+        self.assertEqual('up', running_info['interfaces'][0]['state'])
+
+    def test_cleanup_single_transaction(self):
+        running_info = {'interfaces': yaml.safe_load(_RUNNING_IFACES)}
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: running_info)
+        applied = []
+
+        def apply_stub(state, verify_change=True, save_to_disk=True):
+            applied.append(state)
+        self.stub_out('libnmstate.netapplier.apply', apply_stub)
+
+        self.provider.cleanup_all_ifaces(exclude_nics=['eno2'])
+        self.assertEqual(1, len(applied))
+        ifaces = applied[0]['interfaces']
+        self.assertEqual(['em1'], [i['name'] for i in ifaces])
+        self.assertEqual('down', ifaces[0]['state'])
+
+        applied.clear()
+        self.provider.cleanup_all_ifaces()
+        self.assertEqual(1, len(applied))
+        self.assertEqual(2, len(applied[0]['interfaces']))
+
+    def test_cleanup_per_iface_fallback(self):
+        running_info = {'interfaces': yaml.safe_load(_RUNNING_IFACES)}
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: running_info)
+        applied = []
+
+        def apply_stub(state, verify_change=True, save_to_disk=True):
+            names = [i['name'] for i in state['interfaces']]
+            applied.append(names)
+            if 'em1' in names:
+                raise Exception('em1 failed')
+        self.stub_out('libnmstate.netapplier.apply', apply_stub)
+
+        self.assertRaises(os_net_config.ConfigurationError,
+                          self.provider.cleanup_all_ifaces)
+        self.assertEqual([['em1', 'eno2'], ['em1'], ['eno2']], applied)
+
+    def test_single_transaction_and_idle_rerun(self):
+        nic_config = """
+  -
+    type: interface
+    name: em1
+    dns_servers:
+     - 192.168.1.254
+    domain: example.com
+"""
+        running_info = {'interfaces': []}
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: running_info)
+        applied = []
+
+        def apply_stub(state, verify_change=True, save_to_disk=True):
+            applied.append(state)
+        self.stub_out('libnmstate.netapplier.apply', apply_stub)
+
+        self.add_object(nic_config)
+        updated = self.provider.apply()
+        self.assertEqual(1, len(applied))
+        self.assertEqual(['em1'],
+                         [i['name'] for i in applied[0]['interfaces']])
+        self.assertEqual({'server': ['192.168.1.254'],
+                          'search': ['example.com']},
+                         applied[0]['dns-resolver']['config'])
+
+        # Nothing has changed, so nothing shall be sent to nmstate
+        running_info['interfaces'] = list(updated.values())
+        running_info['dns-resolver'] = applied[0]['dns-resolver']
+        applied.clear()
+        self.add_object(nic_config)
+        self.assertEqual({}, self.provider.apply())
+        self.assertEqual([], applied)
+
+    def test_partial_state(self):
+        nic_config = """
+  -
+    type: interface
+    name: em1
+    mtu: 9000
+"""
+        running_info = {'interfaces': yaml.safe_load(_RUNNING_IFACES)}
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: running_info)
+        applied = []
+
+        def apply_stub(state, verify_change=True, save_to_disk=True):
+            applied.append(state)
+        self.stub_out('libnmstate.netapplier.apply', apply_stub)
+
+        self.provider = impl_nmstate.NmstateNetConfig(partial_state=True)
+        self.add_object(nic_config)
+        updated = self.provider.apply()
+        self.assertIn('ipv4', updated['em1'])
+        self.assertEqual([{'name': 'em1', 'type': 'ethernet', 'state': 'up',
+                           'mtu': 9000}],
+                         applied[0]['interfaces'])
+
+        # Without partial state the whole interface is sent
+        applied.clear()
+        self.provider = impl_nmstate.NmstateNetConfig()
+        self.add_object(nic_config)
+        updated = self.provider.apply()
+        self.assertEqual([updated['em1']], applied[0]['interfaces'])
+
+    def test_dump_sinks(self):
+        running_info = {'interfaces': yaml.safe_load(_RUNNING_IFACES)}
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: running_info)
+        dumps = []
+        yaml_dump = yaml.dump
+
+        def dump_stub(*args, **kwargs):
+            dumps.append(True)
+            return yaml_dump(*args, **kwargs)
+        self.stub_out('yaml.dump', dump_stub)
+
+        # Nothing is serialized when the debug log is disabled
+        logger = logging.getLogger('os_net_config.impl_nmstate')
+        level = logger.level
+        self.addCleanup(logger.setLevel, level)
+        logger.setLevel(logging.INFO)
+        self.add_object(_BASE_IFACE_CFG)
+        self.provider.apply()
+        self.assertEqual([], dumps)
+
+        logger.setLevel(logging.DEBUG)
+        self.provider = impl_nmstate.NmstateNetConfig(dump_sink='none')
+        self.add_object(_BASE_IFACE_CFG)
+        self.provider.apply()
+        self.assertEqual([], dumps)
+
+        dump_file = os.path.join(self.temp_dir, 'dump.yaml')
+        self.provider = impl_nmstate.NmstateNetConfig(
+            dump_sink=dump_file, force_full_reconcile=True)
+        self.add_object(_BASE_IFACE_CFG)
+        self.provider.apply()
+        with open(dump_file) as f:
+            self.assertIn('Applying the config with nmstate', f.read())
+
+    def test_fingerprint_cache(self):
+        running_info = {'interfaces': []}
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: running_info)
+        applied = []
+
+        def apply_stub(state, verify_change=True, save_to_disk=True):
+            applied.append(state)
+        self.stub_out('libnmstate.netapplier.apply', apply_stub)
+
+        self.add_object(_BASE_IFACE_CFG)
+        updated = self.provider.apply()
+        self.assertEqual(['em1', 'eno2'], sorted(updated))
+
+        # The running config is reported down, but em1 is skipped since
+        # its config is unchanged and it is still up
+        running_info['interfaces'] = [
+            {'name': 'em1', 'type': 'ethernet', 'state': 'up'},
+            {'name': 'eno2', 'type': 'ethernet', 'state': 'down'}]
+        self.add_object(_BASE_IFACE_CFG)
+        self.assertEqual(['eno2'], sorted(self.provider.apply()))
+
+        # The cache is not used with a full reconcile
+        self.provider = impl_nmstate.NmstateNetConfig(
+            force_full_reconcile=True)
+        self.add_object(_BASE_IFACE_CFG)
+        self.assertEqual(['em1', 'eno2'], sorted(self.provider.apply()))
+
+    def test_no_fingerprints_on_errors(self):
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: {'interfaces': []})
+        self.add_object(_BASE_IFACE_CFG)
+        self.provider.errors.append(Exception('ifup failed'))
+        self.assertRaises(os_net_config.ConfigurationError,
+                          self.provider.apply)
+        self.assertFalse(os.path.exists(self.provider.fingerprint_file))
+
+    def test_vlans_single_transaction(self):
+        nic_config = """
+  -
+    type: interface
+    name: em2
+  -
+    type: vlan
+    device: em2
+    vlan_id: 20
+    addresses:
+     - ip_netmask: 172.17.0.10/24
+  -
+    type: vlan
+    device: em2
+    vlan_id: 30
+    addresses:
+     - ip_netmask: 172.18.0.10/24
+"""
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: {'interfaces': []})
+        applied = []
+
+        def apply_stub(state, verify_change=True, save_to_disk=True):
+            applied.append(state)
+        self.stub_out('libnmstate.netapplier.apply', apply_stub)
+
+        self.add_object(nic_config)
+        updated = self.provider.apply()
+        self.assertEqual(['em2', 'vlan20', 'vlan30'], sorted(updated))
+        self.assertEqual(1, len(applied))
+        self.assertEqual(['em2', 'vlan20', 'vlan30'],
+                         [i['name'] for i in applied[0]['interfaces']])
+
+    def test_route_changes(self):
+        nic_config = """
+  -
+    type: interface
+    name: em1
+    routes:
+     - default: true
+       next_hop: 192.168.1.1
+     - ip_netmask: 172.19.0.0/24
+       next_hop: 192.168.1.1
+    rules:
+     - rule: from 192.0.2.0/24 table 200 prio 1000
+"""
+        running_info = {
+            'interfaces': [],
+            'routes': {'config': yaml.safe_load("""
+- destination: 0.0.0.0/0
+  next-hop-address: 192.168.1.1
+  next-hop-interface: em1
+  metric: 100
+  table-id: 254
+- destination: 172.18.0.0/24
+  next-hop-address: 192.168.1.1
+  next-hop-interface: em1
+  table-id: 254
+- destination: 172.18.0.0/24
+  next-hop-address: 192.168.2.1
+  next-hop-interface: em2
+  table-id: 254
+""")},
+            'route-rules': {'config': yaml.safe_load("""
+- ip-from: 192.0.2.0/24
+  route-table: 200
+  priority: 1000
+- ip-from: 192.0.3.0/24
+  route-table: 200
+  priority: 1001
+- ip-from: 192.0.4.0/24
+  route-table: 300
+  priority: 1002
+""")}}
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: running_info)
+        applied = []
+
+        def apply_stub(state, verify_change=True, save_to_disk=True):
+            applied.append(state)
+        self.stub_out('libnmstate.netapplier.apply', apply_stub)
+
+        self.add_object(nic_config)
+        self.provider.apply()
+        # Only the routes and rules to be added or removed are sent, the
+        # rule of the table 300 is not managed by os-net-config
+        routes = yaml.safe_load("""
+- destination: 172.19.0.0/24
+  next-hop-address: 192.168.1.1
+  next-hop-interface: em1
+- destination: 172.18.0.0/24
+  next-hop-address: 192.168.1.1
+  next-hop-interface: em1
+  table-id: 254
+  state: absent
+""")
+        rules = yaml.safe_load("""
+- ip-from: 192.0.3.0/24
+  route-table: 200
+  priority: 1001
+  state: absent
+""")
+        self.assertEqual(routes, applied[0]['routes']['config'])
+        self.assertEqual(rules, applied[0]['route-rules']['config'])
+
+    def test_ovs_bridge_routes(self):
+        nic_config = """
+  -
+    type: ovs_bridge
+    name: br-ex
+    addresses:
+     - ip_netmask: 192.168.1.2/24
+    routes:
+     - ip_netmask: 172.19.0.0/24
+       next_hop: 192.168.1.1
+    members:
+     -
+       type: interface
+       name: em2
+"""
+        running_info = {
+            'interfaces': [],
+            'routes': {'config': yaml.safe_load("""
+- destination: 172.18.0.0/24
+  next-hop-address: 192.168.1.1
+  next-hop-interface: br-ex
+  table-id: 254
+""")}}
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: running_info)
+        self.stub_out('os_net_config.utils.is_ovs_installed', lambda: True)
+        applied = []
+
+        def apply_stub(state, verify_change=True, save_to_disk=True):
+            applied.append(state)
+        self.stub_out('libnmstate.netapplier.apply', apply_stub)
+
+        self.add_object(nic_config)
+        self.provider.apply()
+        # The bridge and its internal interface are named br-ex, the
+        # routes are sent once
+        routes = yaml.safe_load("""
+- destination: 172.19.0.0/24
+  next-hop-address: 192.168.1.1
+  next-hop-interface: br-ex
+- destination: 172.18.0.0/24
+  next-hop-address: 192.168.1.1
+  next-hop-interface: br-ex
+  table-id: 254
+  state: absent
+""")
+        self.assertEqual(routes, applied[0]['routes']['config'])
+
+    def test_ovs_bridge_single_transaction(self):
+        nic_config = """
+  -
+    type: ovs_bridge
+    name: br-ex
+    addresses:
+     - ip_netmask: 192.168.1.2/24
+    members:
+     -
+       type: interface
+       name: em2
+     -
+       type: vlan
+       vlan_id: 20
+"""
+        self.stub_out('os_net_config.utils.is_ovs_installed', lambda: True)
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: {'interfaces': []})
+        applied = []
+
+        def apply_stub(state, verify_change=True, save_to_disk=True):
+            applied.append(state)
+        self.stub_out('libnmstate.netapplier.apply', apply_stub)
+
+        self.add_object(nic_config)
+        self.provider.apply()
+        self.assertEqual(1, len(applied))
+        self.assertEqual(['br-ex', 'br-ex', 'em2', 'vlan20'],
+                         sorted(i['name'] for i in applied[0]['interfaces']))
+
+    def test_sriov_single_transaction(self):
+        nic_config = """
+- type: sriov_pf
+  name: eth2
+  numvfs: 2
+- type: sriov_vf
+  device: eth2
+  vfid: 1
+  vlan_id: 20
+"""
+        self.stub_out('os_net_config.utils.get_vf_devname',
+                      lambda device, vfid: '%s_%d' % (device, vfid))
+        self.stub_out('os_net_config.utils.get_pci_address',
+                      lambda ifname, noop: None)
+        self.stub_out('os_net_config.utils.get_stored_pci_address',
+                      lambda ifname, noop: None)
+        self.stub_out('os_net_config.utils.update_sriov_vf_map',
+                      lambda *args, **kwargs: None)
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: {'interfaces': []})
+        applied = []
+
+        def apply_stub(state, verify_change=True, save_to_disk=True):
+            applied.append(state)
+        self.stub_out('libnmstate.netapplier.apply', apply_stub)
+
+        self.add_object(nic_config)
+        self.provider.apply()
+        self.assertEqual(1, len(applied))
+        ifaces = {i['name']: i for i in applied[0]['interfaces']}
+        self.assertEqual(['eth2', 'eth2_1'], sorted(ifaces))
+        self.assertEqual({'total-vfs': 2, 'vfs': [{'id': 1, 'vlan-id': 20}]},
+                         ifaces['eth2']['ethernet']['sr-iov'])
+
+    def stub_checkpoint(self, replies):
+        calls = []
+
+        def apply_stub(state, verify_change=True, save_to_disk=True,
+                       commit=True, rollback_timeout=60):
+            calls.append(('apply', commit, rollback_timeout))
+            return 'checkpoint-1'
+
+        def probe_stub(address, timeout):
+            calls.append(('probe', address))
+            return replies.get(address, True)
+        self.stub_out('libnmstate.netapplier.apply', apply_stub)
+        self.stub_out('libnmstate.netapplier.commit',
+                      lambda checkpoint: calls.append(('commit', checkpoint)))
+        self.stub_out('libnmstate.netapplier.rollback',
+                      lambda checkpoint: calls.append(('rollback',
+                                                       checkpoint)))
+        self.stub_out('os_net_config.impl_nmstate.probe_address', probe_stub)
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: {'interfaces': []})
+        running_routes = yaml.safe_load("""
+- destination: 0.0.0.0/0
+  next-hop-address: 198.51.100.1
+  next-hop-interface: em2
+- destination: 0.0.0.0/0
+  next-hop-address: 203.0.113.1
+  next-hop-interface: em3
+""")
+        self.stub_out('libnmstate.netinfo.show',
+                      lambda: {'interfaces': [],
+                               'routes': {'running': running_routes}})
+        return calls
+
+    def test_checkpoint_commit(self):
+        nic_config = """
+- type: interface
+  name: em1
+  addresses:
+  - ip_netmask: 192.0.2.2/24
+  routes:
+  - default: true
+    next_hop: 192.0.2.1
+  dns_servers: [192.0.2.53, 192.0.2.1]
+"""
+        calls = self.stub_checkpoint({'192.0.2.53': False})
+        self.provider.rollback_timeout = 30
+        self.add_object(nic_config)
+        self.provider.apply()
+        self.assertEqual(('apply', False, 30), calls[0])
+        # The DNS servers are not probed by default
+        self.assertEqual([('probe', '192.0.2.1')],
+                         [call for call in calls if call[0] == 'probe'])
+        self.assertEqual(('commit', 'checkpoint-1'), calls[-1])
+
+    def test_checkpoint_probe_dns(self):
+        nic_config = """
+- type: interface
+  name: em1
+  addresses:
+  - ip_netmask: 192.0.2.2/24
+  routes:
+  - default: true
+    next_hop: 192.0.2.1
+  dns_servers: [192.0.2.53, 192.0.2.1]
+"""
+        calls = self.stub_checkpoint({})
+        self.provider.rollback_timeout = 30
+        self.provider.probe_dns = True
+        self.add_object(nic_config)
+        self.provider.apply()
+        self.assertEqual([('probe', '192.0.2.1'), ('probe', '192.0.2.53')],
+                         sorted(call for call in calls
+                                if call[0] == 'probe'))
+        self.assertEqual(('commit', 'checkpoint-1'), calls[-1])
+
+    def test_checkpoint_probe_dhcp_gateway(self):
+        nic_config = """
+- type: interface
+  name: em2
+  use_dhcp: true
+"""
+        calls = self.stub_checkpoint({})
+        self.provider.rollback_timeout = 30
+        self.add_object(nic_config)
+        self.provider.apply()
+        # Only the gateway learnt by the DHCP interface of the config
+        self.assertEqual([('probe', '198.51.100.1')],
+                         [call for call in calls if call[0] == 'probe'])
+        self.assertEqual(('commit', 'checkpoint-1'), calls[-1])
+
+    def test_checkpoint_rollback(self):
+        nic_config = """
+- type: interface
+  name: em1
+  addresses:
+  - ip_netmask: 192.0.2.2/24
+  routes:
+  - default: true
+    next_hop: 192.0.2.1
+"""
+        calls = self.stub_checkpoint({'192.0.2.1': False})
+        self.provider.rollback_timeout = 30
+        self.add_object(nic_config)
+        self.assertRaises(os_net_config.ConfigurationError,
+                          self.provider.apply)
+        self.assertEqual(('rollback', 'checkpoint-1'), calls[-1])
+        self.assertNotIn('commit', [call[0] for call in calls])
+        # Nothing is recorded as applied when the config is rolled back
+        self.assertFalse(os.path.exists(self.provider.fingerprint_file))
+
+    def stub_clock(self):
+        clock = [0]
+        sleeps = []
+
+        def sleep_stub(delay):
+            sleeps.append(delay)
+            clock[0] += delay
+        self.stub_out('os_net_config.impl_nmstate.time.monotonic',
+                      lambda: clock[0])
+        self.stub_out('os_net_config.impl_nmstate.time.sleep', sleep_stub)
+        return sleeps
+
+    def test_deferred_verify(self):
+        nic_config = """
+- type: interface
+  name: em1
+  mtu: 9000
+  dns_servers: [192.0.2.53]
+"""
+        running = {'interfaces': yaml.safe_load(_RUNNING_IFACES),
+                   'dns-resolver': {'config': {}}}
+        reads = []
+
+        def show_running_info_stub():
+            reads.append(True)
+            # The changes show up at the third read after the apply
+            if len(reads) >= 4:
+                em1 = running['interfaces'][0]
+                em1['mtu'] = 9000
+                em1['ipv4']['auto-dns'] = False
+                em1['ipv6']['auto-dns'] = False
+                running['dns-resolver']['config'] = {
+                    'server': ['192.0.2.53'], 'search': []}
+            return running
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      show_running_info_stub)
+        verify_changes = []
+        self.stub_out('libnmstate.netapplier.apply',
+                      lambda state, verify_change=True, save_to_disk=True:
+                          verify_changes.append(verify_change))
+        sleeps = self.stub_clock()
+
+        self.provider.deferred_verify = True
+        self.add_object(nic_config)
+        self.provider.apply()
+        self.assertEqual([False], verify_changes)
+        self.assertEqual([0.5, 1.0], sleeps)
+
+    def test_deferred_verify_deadline(self):
+        nic_config = """
+- type: interface
+  name: em1
+  mtu: 9000
+"""
+        running = {'interfaces': yaml.safe_load(_RUNNING_IFACES)}
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: running)
+        sleeps = self.stub_clock()
+
+        self.provider.deferred_verify = True
+        self.provider.verify_timeout = 12
+        self.add_object(nic_config)
+        err = self.assertRaises(os_net_config.ConfigurationError,
+                                self.provider.apply)
+        self.assertIn('em1', str(err))
+        self.assertEqual([0.5, 1.0, 2.0, 4.0, 4.5], sleeps)
+        self.assertFalse(os.path.exists(self.provider.fingerprint_file))
+
+    def test_checkpoint_deferred_verify(self):
+        nic_config = """
+- type: interface
+  name: em1
+  mtu: 9000
+"""
+        calls = self.stub_checkpoint({})
+        applied_mtu = [1500]
+
+        def show_running_info_stub():
+            running = {'interfaces': yaml.safe_load(_RUNNING_IFACES)}
+            if ('apply', False, 30) in calls:
+                calls.append(('verify',))
+                running['interfaces'][0]['mtu'] = applied_mtu[0]
+            return running
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      show_running_info_stub)
+        self.stub_clock()
+        self.provider.rollback_timeout = 30
+        self.provider.deferred_verify = True
+        self.provider.verify_timeout = 1
+        self.add_object(nic_config)
+        self.assertRaises(os_net_config.ConfigurationError,
+                          self.provider.apply)
+        # The config is verified in the checkpoint, and rolled back
+        self.assertEqual(('apply', False, 30), calls[0])
+        self.assertEqual(('verify',), calls[-2])
+        self.assertEqual(('rollback', 'checkpoint-1'), calls[-1])
+        self.assertNotIn('commit', [call[0] for call in calls])
+
+        applied_mtu[0] = 9000
+        del calls[:]
+        self.provider.apply()
+        self.assertEqual(['apply', 'verify', 'commit'],
+                         [call[0] for call in calls])
+
+    def test_runtime_only_and_persist(self):
+        nic_config = """
+- type: interface
+  name: em1
+  mtu: 9000
+  routes:
+  - ip_netmask: 172.19.0.0/24
+    next_hop: 192.168.1.1
+"""
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      lambda: {'interfaces': yaml.safe_load(_RUNNING_IFACES)})
+        applied = []
+
+        def apply_stub(state, verify_change=True, save_to_disk=True):
+            applied.append((state, save_to_disk))
+        self.stub_out('libnmstate.netapplier.apply', apply_stub)
+
+        self.provider.runtime_only = True
+        self.add_object(nic_config)
+        self.provider.apply()
+        self.assertFalse(applied[0][1])
+        self.assertFalse(os.path.exists(self.provider.fingerprint_file))
+        self.assertTrue(os.path.exists(self.provider.runtime_state_file))
+
+        provider = impl_nmstate.NmstateNetConfig()
+        provider.persist()
+        state, save_to_disk = applied[1]
+        self.assertTrue(save_to_disk)
+        self.assertEqual(['em1'],
+                         [iface['name'] for iface in state['interfaces']])
+        self.assertEqual(9000, state['interfaces'][0]['mtu'])
+        self.assertEqual(['172.19.0.0/24'],
+                         [route['destination']
+                          for route in state['routes']['config']])
+        self.assertIn('em1', provider.read_fingerprints())
+        self.assertFalse(os.path.exists(provider.runtime_state_file))
+
+        # There is nothing left to persist
+        self.assertRaises(os_net_config.ConfigurationError, provider.persist)
+
+    def test_offline_keyfiles(self):
+        nic_config = """
+- type: interface
+  name: em1
+  mtu: 9000
+  dns_servers: [192.0.2.53]
+"""
+
+        def show_running_info_stub():
+            raise AssertionError('NetworkManager used in offline mode')
+        self.stub_out('libnmstate.netinfo.show_running_config',
+                      show_running_info_stub)
+        self.stub_out('libnmstate.netapplier.apply',
+                      lambda *args, **kwargs: show_running_info_stub())
+        states = []
+
+        def gen_conf_stub(desired_state):
+            states.append(desired_state)
+            return {'NetworkManager': [
+                ['em1.nmconnection', '[connection]\nid=em1\n']]}
+        self.stub_out('libnmstate.gen_conf.generate_configurations',
+                      gen_conf_stub)
+
+        provider = impl_nmstate.NmstateNetConfig(root_dir=self.temp_dir,
+                                                 offline=True)
+        self.provider = provider
+        self.add_object(nic_config)
+        updated_files = provider.apply(cleanup=True)
+        keyfile = os.path.join(self.temp_dir,
+                               'etc/NetworkManager/system-connections',
+                               'em1.nmconnection')
+        self.assertEqual({keyfile: '[connection]\nid=em1\n'}, updated_files)
+        self.assertEqual(0o600, os.stat(keyfile).st_mode & 0o777)
+        self.assertEqual(9000, states[0]['interfaces'][0]['mtu'])
+        self.assertEqual(['192.0.2.53'],
+                         states[0]['dns-resolver']['config']['server'])
+
+        # Unchanged keyfiles are not rewritten
+        self.add_object(nic_config)
+        self.assertEqual({}, provider.apply())
+
+    def test_offline_host_devices_unused(self):
+        def host_used(*args, **kwargs):
+            raise AssertionError('Host device used in offline mode')
+        self.stub_out('os_net_config.common.interface_mac', host_used)
+        self.stub_out('os_net_config.utils.get_vf_devname', host_used)
+        self.stub_out('os_net_config.utils.bind_dpdk_interfaces', host_used)
+        self.stub_out('os_net_config.utils.get_dpdk_devargs', host_used)
+        self.stub_out('os_net_config.utils.is_ovs_installed', lambda: True)
+        objects.use_offline()
+        self.addCleanup(objects.use_offline, False)
+        provider = impl_nmstate.NmstateNetConfig(root_dir=self.temp_dir,
+                                                 offline=True)
+        self.provider = provider
+        self.add_object("""
+- type: ovs_bridge
+  name: br-ex
+  members:
+  - type: interface
+    name: em1
+    primary: true
+- type: sriov_vf
+  device: eth2
+  vfid: 1
+""")
+        self.assertNotIn('mac-address', provider.interface_data['br-ex'])
+        self.assertNotIn('sriov:eth2:1', provider.interface_data)
+        self.assertEqual({1: {'id': 1}}, provider.sriov_vf_data['eth2'])
+
+        port = objects.OvsDpdkPort('dpdk0', members=[
+            objects.Interface('em2')])
+        self.assertRaises(os_net_config.ConfigurationError,
+                          provider.add_ovs_dpdk_port, port)
+
+
+class TestNmstateOfflineNicMapping(base.TestCase):
+    stub_mapped_nics = False
+
+    def test_offline_nic_mapping(self):
+        def host_used(*args, **kwargs):
+            raise AssertionError('Host nics used in offline mode')
+        self.stub_out('os_net_config.utils.ordered_available_nics',
+                      host_used)
+        self.stub_out('os_net_config.utils.ordered_active_nics', host_used)
+        self.stub_out('os_net_config.common.interface_mac', host_used)
+        objects.use_offline()
+        self.addCleanup(objects.use_offline, False)
+        self.stub_out('os_net_config.objects._MAPPED_NICS', None)
+
+        mapping = {'nic1': 'ens1f0', 'nic2': 'ens1f1'}
+        iface = objects.Interface('nic1', nic_mapping=mapping)
+        self.assertEqual('ens1f0', iface.name)
+        vlan = objects.Vlan('nic2', 10, nic_mapping=mapping)
+        self.assertEqual('ens1f1', vlan.device)
+        # The nics of the build host don't name the nics of the config
+        self.assertRaises(objects.InvalidConfigException,
+                          objects.Interface, 'nic3', nic_mapping=mapping)
+        self.assertRaises(objects.InvalidConfigException,
+                          objects.Vlan, 'nic3', 10, nic_mapping=mapping)
+
+        self.stub_out('os_net_config.objects._MAPPED_NICS', None)
+        self.assertRaises(objects.InvalidConfigException,
+                          objects.mapped_nics,
+                          {'nic1': '52:54:00:12:34:56'})